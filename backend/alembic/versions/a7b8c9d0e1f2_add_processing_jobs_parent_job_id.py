@@ -0,0 +1,32 @@
+"""add processing_jobs parent_job_id
+
+Revision ID: a7b8c9d0e1f2
+Revises: f6a7b8c9d0e1
+Create Date: 2026-02-13
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "a7b8c9d0e1f2"
+down_revision: Union[str, None] = "f6a7b8c9d0e1"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 一覧形式の発注から展開した子ジョブと親ジョブの関連
+    op.add_column("processing_jobs", sa.Column("parent_job_id", sa.Integer(), nullable=True))
+    op.create_foreign_key(
+        "fk_processing_jobs_parent_job_id", "processing_jobs", "processing_jobs", ["parent_job_id"], ["id"],
+    )
+    op.create_index("ix_processing_jobs_parent_job_id", "processing_jobs", ["parent_job_id"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_processing_jobs_parent_job_id", table_name="processing_jobs")
+    op.drop_constraint("fk_processing_jobs_parent_job_id", "processing_jobs", type_="foreignkey")
+    op.drop_column("processing_jobs", "parent_job_id")
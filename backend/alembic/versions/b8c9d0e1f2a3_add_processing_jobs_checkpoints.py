@@ -0,0 +1,26 @@
+"""add processing_jobs checkpoints
+
+Revision ID: b8c9d0e1f2a3
+Revises: a7b8c9d0e1f2
+Create Date: 2026-02-13
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "b8c9d0e1f2a3"
+down_revision: Union[str, None] = "a7b8c9d0e1f2"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 承認後の実行ステップの完了記録 (再試行時は未完了のステップから再開する)
+    op.add_column("processing_jobs", sa.Column("checkpoints", sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("processing_jobs", "checkpoints")
@@ -0,0 +1,45 @@
+"""add processing step timings table
+
+Revision ID: c9d0e1f2a3b4
+Revises: b8c9d0e1f2a3
+Create Date: 2026-02-14
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "c9d0e1f2a3b4"
+down_revision: Union[str, None] = "b8c9d0e1f2a3"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # パイプラインのステップごとの所要時間 (GET /jobs/metrics でパーセンタイルを集計する)
+    op.create_table(
+        "processing_step_timings",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("job_id", sa.Integer(), nullable=False),
+        sa.Column("step", sa.String(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("started_at", sa.DateTime(), nullable=False),
+        sa.Column("finished_at", sa.DateTime(), nullable=False),
+        sa.Column("duration_ms", sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(["job_id"], ["processing_jobs.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_processing_step_timings_id", "processing_step_timings", ["id"], unique=False)
+    op.create_index("ix_processing_step_timings_job_id", "processing_step_timings", ["job_id"], unique=False)
+    op.create_index(
+        "ix_processing_step_timings_step_finished_at", "processing_step_timings", ["step", "finished_at"], unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_processing_step_timings_step_finished_at", table_name="processing_step_timings")
+    op.drop_index("ix_processing_step_timings_job_id", table_name="processing_step_timings")
+    op.drop_index("ix_processing_step_timings_id", table_name="processing_step_timings")
+    op.drop_table("processing_step_timings")
@@ -0,0 +1,52 @@
+"""add dead letter jobs table
+
+Revision ID: d0e1f2a3b4c5
+Revises: c9d0e1f2a3b4
+Create Date: 2026-02-14
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "d0e1f2a3b4c5"
+down_revision: Union[str, None] = "c9d0e1f2a3b4"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 失敗したジョブの記録 (まとめて再実行するために失敗したステップ・例外・入力を残す)
+    op.create_table(
+        "dead_letter_jobs",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("job_id", sa.Integer(), nullable=False),
+        sa.Column("step", sa.String(), nullable=False),
+        sa.Column("error_class", sa.String(), nullable=False),
+        sa.Column("error_message", sa.Text(), nullable=True),
+        sa.Column("assigned_system", sa.String(), nullable=True),
+        sa.Column("input_snapshot", sa.JSON(), nullable=True),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("replayed_at", sa.DateTime(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["job_id"], ["processing_jobs.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_dead_letter_jobs_id", "dead_letter_jobs", ["id"], unique=False)
+    op.create_index("ix_dead_letter_jobs_job_id", "dead_letter_jobs", ["job_id"], unique=False)
+    op.create_index("ix_dead_letter_jobs_error_class", "dead_letter_jobs", ["error_class"], unique=False)
+    op.create_index("ix_dead_letter_jobs_assigned_system", "dead_letter_jobs", ["assigned_system"], unique=False)
+    op.create_index("ix_dead_letter_jobs_status", "dead_letter_jobs", ["status"], unique=False)
+    op.create_index("ix_dead_letter_jobs_created_at", "dead_letter_jobs", ["created_at"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_dead_letter_jobs_created_at", table_name="dead_letter_jobs")
+    op.drop_index("ix_dead_letter_jobs_status", table_name="dead_letter_jobs")
+    op.drop_index("ix_dead_letter_jobs_assigned_system", table_name="dead_letter_jobs")
+    op.drop_index("ix_dead_letter_jobs_error_class", table_name="dead_letter_jobs")
+    op.drop_index("ix_dead_letter_jobs_job_id", table_name="dead_letter_jobs")
+    op.drop_index("ix_dead_letter_jobs_id", table_name="dead_letter_jobs")
+    op.drop_table("dead_letter_jobs")
@@ -0,0 +1,25 @@
+"""add payments status amount index
+
+Revision ID: e5f6a7b8c9d0
+Revises: d4e5f6a7b8c9
+Create Date: 2026-02-12
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "e5f6a7b8c9d0"
+down_revision: Union[str, None] = "d4e5f6a7b8c9"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 請求書送付イベントで未消込入金を金額帯で絞り込むためのインデックス
+    op.create_index("ix_payments_status_amount", "payments", ["status", "amount"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_payments_status_amount", table_name="payments")
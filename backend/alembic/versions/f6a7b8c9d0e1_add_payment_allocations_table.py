@@ -0,0 +1,42 @@
+"""add payment allocations table
+
+Revision ID: f6a7b8c9d0e1
+Revises: e5f6a7b8c9d0
+Create Date: 2026-02-12
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "f6a7b8c9d0e1"
+down_revision: Union[str, None] = "e5f6a7b8c9d0"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 複数請求書をまとめて支払った入金の割当明細
+    op.create_table(
+        "payment_allocations",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("payment_id", sa.Integer(), nullable=False),
+        sa.Column("invoice_id", sa.Integer(), nullable=False),
+        sa.Column("amount", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["payment_id"], ["payments.id"]),
+        sa.ForeignKeyConstraint(["invoice_id"], ["invoices.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_payment_allocations_id", "payment_allocations", ["id"], unique=False)
+    op.create_index("ix_payment_allocations_payment_id", "payment_allocations", ["payment_id"], unique=False)
+    op.create_index("ix_payment_allocations_invoice_id", "payment_allocations", ["invoice_id"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_payment_allocations_invoice_id", table_name="payment_allocations")
+    op.drop_index("ix_payment_allocations_payment_id", table_name="payment_allocations")
+    op.drop_index("ix_payment_allocations_id", table_name="payment_allocations")
+    op.drop_table("payment_allocations")
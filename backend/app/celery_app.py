@@ -1,5 +1,6 @@
 from celery import Celery
 from celery.schedules import crontab
+from kombu import Queue
 
 from app.config import settings
 
@@ -9,6 +10,31 @@ celery = Celery(
     backend=settings.REDIS_URL,
 )
 
+# 用途ごとのキュー。ワーカーは -Q でキューを指定して起動し、キューごとに並列数・台数を決める
+QUEUE_ORDERS = "orders"  # 発注Excelの解析・振り分け (Slack受信直後で待たせたくない)
+QUEUE_MCP = "mcp"  # 承認後の発注登録・Web入力 (外部システムとの通信待ちが長い)
+QUEUE_RECONCILIATION = "reconciliation"  # 入金消込
+QUEUE_REPORTS = "reports"  # 月次レポートなど重いバッチ
+QUEUES = (QUEUE_ORDERS, QUEUE_MCP, QUEUE_RECONCILIATION, QUEUE_REPORTS)
+
+# キュー内の優先度 (Redis ブローカーでは 0 が最優先)
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 9
+
+TASK_ROUTES = {
+    "workers.process_order": {"queue": QUEUE_ORDERS, "priority": PRIORITY_HIGH},
+    "workers.route_child_jobs": {"queue": QUEUE_ORDERS, "priority": PRIORITY_NORMAL},
+    "workers.finalize_fanout": {"queue": QUEUE_ORDERS, "priority": PRIORITY_NORMAL},
+    "workers.replay_dead_letters": {"queue": QUEUE_ORDERS, "priority": PRIORITY_LOW},
+    "workers.process_order_async": {"queue": QUEUE_MCP, "priority": PRIORITY_HIGH},
+    "workers.resume_deferred_jobs": {"queue": QUEUE_MCP, "priority": PRIORITY_NORMAL},
+    "workers.match_sent_invoice": {"queue": QUEUE_RECONCILIATION, "priority": PRIORITY_HIGH},
+    "workers.match_new_payments": {"queue": QUEUE_RECONCILIATION, "priority": PRIORITY_NORMAL},
+    "workers.auto_reconcile": {"queue": QUEUE_RECONCILIATION, "priority": PRIORITY_LOW},
+    "workers.generate_report": {"queue": QUEUE_REPORTS, "priority": PRIORITY_NORMAL},
+}
+
 celery.conf.update(
     task_serializer="json",
     accept_content=["json"],
@@ -18,12 +44,31 @@ celery.conf.update(
     task_track_started=True,
     task_acks_late=True,
     worker_prefetch_multiplier=1,
+    task_queues=[Queue(name) for name in QUEUES],
+    task_default_queue=QUEUE_ORDERS,
+    task_default_priority=PRIORITY_NORMAL,
+    task_routes=TASK_ROUTES,
+    broker_transport_options={
+        "priority_steps": list(range(PRIORITY_HIGH, PRIORITY_LOW + 1)),
+        "sep": ":",
+        "queue_order_strategy": "priority",
+    },
+    # Redis に繋がらないときは API 側が同期実行に切り替えるので、結果バックエンドの再接続で長く待たない
+    result_backend_transport_options={"retry_policy": {"timeout": 2.0}},
     beat_schedule={
         "auto-reconcile-daily": {
             "task": "workers.auto_reconcile",
             "schedule": crontab(hour=9, minute=0),
         },
+        # API が流量制限のため実行できず、キューにも投入できなかったジョブを拾う
+        "resume-deferred-jobs": {
+            "task": "workers.resume_deferred_jobs",
+            "schedule": 60.0,
+        },
     },
 )
 
+# API プロセスの別スレッドから delay() した場合も、このアプリ (ブローカー・キューの設定) を使う
+celery.set_default()
+
 celery.autodiscover_tasks(["workers"])
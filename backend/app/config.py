@@ -13,6 +13,28 @@ class Settings(BaseSettings):
 
     REDIS_URL: str = "redis://redis:6379/0"
 
+    # Excel解析結果キャッシュ: "disk" / "redis" / "none"
+    PARSE_CACHE_BACKEND: str = "disk"
+    PARSE_CACHE_DIR: str = "/app/uploads/.parse_cache"
+    PARSE_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+    PARSE_CACHE_MAX_ENTRY_BYTES: int = 16 * 1024 * 1024
+
+    # Excel/CSV解析の上限 (超えたファイルは ExcelParseError で中断する)
+    EXCEL_MAX_FILE_BYTES: int | None = 20 * 1024 * 1024
+    EXCEL_MAX_UNCOMPRESSED_BYTES: int | None = 200 * 1024 * 1024
+    EXCEL_MAX_COMPRESSION_RATIO: float | None = 100.0
+    EXCEL_MAX_ROWS: int | None = 100_000  # データ行の上限 (見出し行は数えない)
+    EXCEL_MAX_COLS: int | None = 200
+    EXCEL_PARSE_TIMEOUT_SECONDS: float | None = 60.0
+
+    # Webシステムへの入力の流量制限 (振り分け先ごと)。上限を超えた入力は WEB_INPUT_MAX_WAIT_SECONDS まで待つ
+    WEB_INPUT_RATE_PER_SECOND: float = 1.0
+    WEB_INPUT_BURST: int = 5
+    WEB_INPUT_MAX_CONCURRENCY: int = 2
+    WEB_INPUT_MAX_WAIT_SECONDS: float = 30.0
+    # 振り分け先ごとの上書き 例: {"system_b": {"rate_per_second": 0.5, "max_concurrency": 1}}
+    WEB_INPUT_LIMITS: dict[str, dict[str, float]] = {}
+
     ENCRYPTION_KEY: str = ""
 
     SLACK_BOT_TOKEN: str = ""
@@ -1,6 +1,8 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
+from app.celery_app import celery  # noqa: F401  (delay() で送るタスクのキュー設定を読み込む)
 from app.config import settings
 from app.routers import (
     auth,
@@ -16,6 +18,7 @@ from app.routers import (
     quotations,
     reconciliation,
     reports,
+    routing,
     slack,
 )
 
@@ -48,8 +51,17 @@ app.include_router(dashboard.router, prefix="/api/v1/dashboard", tags=["ダッ
 app.include_router(reconciliation.router, prefix="/api/v1/reconciliation", tags=["入金消込"])
 app.include_router(reports.router, prefix="/api/v1/reports", tags=["レポート"])
 app.include_router(slack.router, prefix="/api/v1/slack", tags=["Slack連携"])
+app.include_router(routing.router, prefix="/api/v1/routing", tags=["振り分け"])
 
 
 @app.get("/api/health")
 def health_check():
     return {"status": "ok"}
+
+
+@app.get("/api/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Prometheus 形式のメトリクス"""
+    from app.services.metrics import metrics
+
+    return metrics.render_prometheus()
@@ -8,7 +8,7 @@ from app.models.order import Order, OrderStatus
 from app.models.contract import Contract, ContractType, ContractStatus
 from app.models.invoice import Invoice, InvoiceStatus
 from app.models.matching import MatchingResult
-from app.models.payment import Payment, PaymentStatus
+from app.models.payment import Payment, PaymentAllocation, PaymentStatus
 from app.models.automation import (
     RoutingRule,
     TargetSystem,
@@ -16,6 +16,8 @@ from app.models.automation import (
     ProcessingJob,
     JobStatus,
     ProcessingLog,
+    ProcessingStepTiming,
+    DeadLetterJob,
     WebSystemCredential,
     SlackChannel,
     ReportSchedule,
@@ -55,6 +57,7 @@ __all__ = [
     "MatchingResult",
     # Payment
     "Payment",
+    "PaymentAllocation",
     "PaymentStatus",
     # Automation
     "RoutingRule",
@@ -63,6 +66,8 @@ __all__ = [
     "ProcessingJob",
     "JobStatus",
     "ProcessingLog",
+    "ProcessingStepTiming",
+    "DeadLetterJob",
     "WebSystemCredential",
     "SlackChannel",
     "ReportSchedule",
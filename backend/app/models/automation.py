@@ -1,6 +1,6 @@
 import enum
 
-from sqlalchemy import Boolean, DateTime, ForeignKey, Integer, String, Text, func
+from sqlalchemy import Boolean, DateTime, Float, ForeignKey, Index, Integer, String, Text, func
 from sqlalchemy import Enum as SAEnum
 from sqlalchemy import JSON
 from sqlalchemy.orm import Mapped, mapped_column, relationship
@@ -58,6 +58,8 @@ class ProcessingJob(Base):
     __tablename__ = "processing_jobs"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    # 一覧形式の発注から展開した子ジョブの場合の親ジョブ
+    parent_job_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("processing_jobs.id"), nullable=True, index=True)
     slack_message_id: Mapped[str | None] = mapped_column(String, nullable=True)
     slack_channel_id: Mapped[str | None] = mapped_column(String, nullable=True)
     excel_file_path: Mapped[str | None] = mapped_column(String, nullable=True)
@@ -66,6 +68,8 @@ class ProcessingJob(Base):
     approved_by: Mapped[int | None] = mapped_column(Integer, ForeignKey("users.id"), nullable=True)
     approved_at = mapped_column(DateTime, nullable=True)
     result = mapped_column(JSON, nullable=True)
+    # 承認後の実行ステップごとの完了記録 ({ステップ名: {key, completed_at, result}})
+    checkpoints = mapped_column(JSON, nullable=True)
     error_message: Mapped[str | None] = mapped_column(String, nullable=True)
     created_at = mapped_column(DateTime, default=func.now())
     updated_at = mapped_column(DateTime, default=func.now(), onupdate=func.now())
@@ -87,6 +91,43 @@ class ProcessingLog(Base):
     job = relationship("ProcessingJob", backref="logs")
 
 
+class ProcessingStepTiming(Base):
+    """パイプラインのステップ (解析・振り分け・登録・Web入力など) ごとの所要時間"""
+
+    __tablename__ = "processing_step_timings"
+    __table_args__ = (
+        # ステップごとの期間指定の集計用
+        Index("ix_processing_step_timings_step_finished_at", "step", "finished_at"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    job_id: Mapped[int] = mapped_column(Integer, ForeignKey("processing_jobs.id"), nullable=False, index=True)
+    step: Mapped[str] = mapped_column(String, nullable=False)
+    status: Mapped[str] = mapped_column(String, nullable=False)  # completed / failed
+    started_at = mapped_column(DateTime, nullable=False)
+    finished_at = mapped_column(DateTime, nullable=False)
+    duration_ms: Mapped[float] = mapped_column(Float, nullable=False)
+
+
+class DeadLetterJob(Base):
+    """失敗したジョブの記録 (失敗したステップ・例外・入力のスナップショット)。まとめて再実行できる"""
+
+    __tablename__ = "dead_letter_jobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    job_id: Mapped[int] = mapped_column(Integer, ForeignKey("processing_jobs.id"), nullable=False, index=True)
+    step: Mapped[str] = mapped_column(String, nullable=False)
+    error_class: Mapped[str] = mapped_column(String, nullable=False, index=True)
+    error_message: Mapped[str | None] = mapped_column(Text, nullable=True)
+    assigned_system: Mapped[str | None] = mapped_column(String, nullable=True, index=True)
+    input_snapshot = mapped_column(JSON, nullable=True)
+    status: Mapped[str] = mapped_column(String, nullable=False, default="pending", index=True)  # pending / replayed
+    replayed_at = mapped_column(DateTime, nullable=True)
+    created_at = mapped_column(DateTime, default=func.now(), index=True)
+
+    job = relationship("ProcessingJob", backref="dead_letters")
+
+
 class WebSystemCredential(Base):
     __tablename__ = "web_system_credentials"
 
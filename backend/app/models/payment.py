@@ -1,6 +1,6 @@
 import enum
 
-from sqlalchemy import Date, DateTime, ForeignKey, Integer, String, Text, func
+from sqlalchemy import Date, DateTime, ForeignKey, Index, Integer, String, Text, func
 from sqlalchemy import Enum as SAEnum
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
@@ -15,6 +15,10 @@ class PaymentStatus(str, enum.Enum):
 
 class Payment(Base):
     __tablename__ = "payments"
+    __table_args__ = (
+        # 請求書送付時の未消込入金の絞り込み用
+        Index("ix_payments_status_amount", "status", "amount"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     invoice_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("invoices.id"), nullable=True)
@@ -29,3 +33,18 @@ class Payment(Base):
     updated_at = mapped_column(DateTime, default=func.now(), onupdate=func.now())
 
     invoice = relationship("Invoice", backref="payments")
+
+
+class PaymentAllocation(Base):
+    """1件の入金を複数の請求書に割り当てる明細 (複数請求書の一括入金)"""
+
+    __tablename__ = "payment_allocations"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    payment_id: Mapped[int] = mapped_column(Integer, ForeignKey("payments.id"), nullable=False, index=True)
+    invoice_id: Mapped[int] = mapped_column(Integer, ForeignKey("invoices.id"), nullable=False, index=True)
+    amount: Mapped[int] = mapped_column(Integer, nullable=False)  # JPY
+    created_at = mapped_column(DateTime, default=func.now())
+
+    payment = relationship("Payment", backref="allocations")
+    invoice = relationship("Invoice", backref="allocations")
@@ -113,6 +113,14 @@ def send_invoice(
     invoice.sent_at = datetime.now(timezone.utc)
     db.commit()
     db.refresh(invoice)
+
+    # 送付済みになった請求書を未消込の入金と照合（Redis未接続時は日次バッチで消込）
+    try:
+        from workers.tasks import match_sent_invoice_task
+        match_sent_invoice_task.delay(invoice.id)
+    except Exception:
+        pass
+
     return invoice
 
 
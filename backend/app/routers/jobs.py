@@ -1,13 +1,18 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session, joinedload
 
 from app.database import get_db
-from app.models.user import User
+from app.models.user import User, UserRole
 from app.models.automation import ProcessingJob, ProcessingLog, JobStatus
-from app.schemas.job import JobResponse, JobApproveRequest
-from app.auth.dependencies import get_current_user
+from app.schemas.job import (
+    JobResponse, JobApproveRequest, JobMetricsResponse,
+    DeadLetterResponse, DeadLetterReplayRequest, DeadLetterReplayResponse, StreamTicketResponse,
+)
+from app.auth.dependencies import get_current_user, require_roles
 
 router = APIRouter()
 
@@ -17,11 +22,14 @@ def list_jobs(
     page: int = 1,
     per_page: int = 20,
     status: str | None = None,
+    parent_job_id: int | None = None,
     db: Session = Depends(get_db),
 ):
     base_query = db.query(ProcessingJob)
     if status:
         base_query = base_query.filter(ProcessingJob.status == status)
+    if parent_job_id is not None:
+        base_query = base_query.filter(ProcessingJob.parent_job_id == parent_job_id)
     base_query = base_query.order_by(ProcessingJob.created_at.desc())
     total = base_query.count()
     items = base_query.options(
@@ -36,6 +44,87 @@ def list_jobs(
     }
 
 
+@router.get("/metrics", response_model=JobMetricsResponse, summary="処理ステップの所要時間")
+def get_job_metrics(
+    since_hours: int = Query(24, ge=1, le=24 * 90),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """直近 since_hours 時間に完了したステップごとの所要時間 (件数・平均・最大・p50/p95/p99)"""
+    from app.services.step_timing import step_percentiles
+
+    since = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=since_hours)
+    return {"since": since, "steps": step_percentiles(db, since)}
+
+
+@router.post("/stream-ticket", response_model=StreamTicketResponse, summary="進捗の配信に接続するためのチケット発行")
+def issue_stream_ticket(current_user: User = Depends(get_current_user)):
+    """GET /jobs/stream に渡す使い捨てのチケット (EventSource はヘッダーを付けられないため)"""
+    from app.services.job_events import STREAM_TICKET_TTL, issue_stream_ticket
+
+    return {"ticket": issue_stream_ticket(current_user.id), "expires_in": STREAM_TICKET_TTL}
+
+
+@router.get("/stream", summary="処理ジョブの進捗の配信 (Server-Sent Events)")
+async def stream_jobs(
+    request: Request,
+    ticket: str = Query(..., description="POST /jobs/stream-ticket で発行したチケット (1回のみ有効)"),
+    job_id: int | None = None,
+):
+    """ステータス変更とログの差分を配信する。初期表示は GET /jobs で取得し、以降はこの差分を適用する"""
+    from app.services.job_events import redeem_stream_ticket, stream_events, subscribe
+
+    # チケットの確認は Redis への同期アクセスのため、イベントループを止めないようスレッドで行う
+    if await run_in_threadpool(redeem_stream_ticket, ticket) is None:
+        raise HTTPException(status_code=401, detail="配信用のチケットが無効です")
+    return StreamingResponse(
+        stream_events(await subscribe(), request.is_disconnected, job_id=job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/dead-letters", response_model=list[DeadLetterResponse], summary="失敗したジョブの記録一覧")
+def list_dead_letters(
+    error_class: str | None = None,
+    assigned_system: str | None = None,
+    step: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    status: str | None = "pending",
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    from app.services.dead_letter import query_dead_letters
+
+    return query_dead_letters(
+        db, error_class=error_class, assigned_system=assigned_system, step=step,
+        since=since, until=until, status=status,
+    ).limit(limit).all()
+
+
+@router.post("/dead-letters/replay", response_model=DeadLetterReplayResponse, summary="失敗したジョブのまとめて再実行")
+def replay_dead_letters(
+    req: DeadLetterReplayRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(require_roles(UserRole.admin)),
+):
+    """条件に一致する未処理の記録のジョブを、batch_size 件ずつ interval_seconds 秒おきに再投入する"""
+    from kombu.exceptions import OperationalError
+    from app.services.dead_letter import query_dead_letters, replay
+
+    dead_letters = query_dead_letters(
+        db, ids=req.ids, error_class=req.error_class, assigned_system=req.assigned_system,
+        step=req.step, since=req.since, until=req.until,
+    ).limit(req.limit).all()
+    try:
+        return replay(db, dead_letters, batch_size=req.batch_size, interval_seconds=req.interval_seconds)
+    except (OperationalError, OSError):
+        # ブローカーに接続できない場合のみ (それ以外の例外はそのまま500にする)
+        raise HTTPException(status_code=503, detail="非同期タスクキューが利用できません")
+
+
 @router.get("/{job_id}", response_model=JobResponse, summary="処理ジョブ詳細")
 def get_job(
     job_id: int,
@@ -73,17 +162,22 @@ def approve_job(
             from workers.tasks import process_order_async
             process_order_async.delay(job_id)
         except Exception:
-            # Redis未接続時は同期実行
-            from app.services.order_registration import register_order_from_job
-            from app.services.mcp_executor import execute_mcp_input
+            # Redis未接続時は同期実行 (リクエスト内では流量制限の枠を待たず、枠がなければワーカーに任せる)
+            from app.services.dead_letter import record_failure
+            from app.services.job_steps import defer_to_worker, pending_step, run_steps
+            from app.services.web_input_limiter import WebInputThrottled
             try:
-                register_order_from_job(db, job)
-                execute_mcp_input(db, job)
+                run_steps(db, job, max_wait=0)
                 job.status = JobStatus.completed
                 db.commit()
+            except WebInputThrottled as e:
+                # ブローカーには繋がらなかったため、投入は resume_deferred_jobs に任せる
+                defer_to_worker(db, job, pending_step(job), e, enqueue=False)
+                db.commit()
             except Exception as e:
                 job.status = JobStatus.failed
                 job.error_message = f"処理エラー: {e}"
+                record_failure(db, job, pending_step(job), e)
                 db.commit()
     else:
         job.status = JobStatus.failed
@@ -91,6 +185,8 @@ def approve_job(
         db.commit()
 
     db.refresh(job)
+    from app.services.job_events import publish, status_event
+    publish([status_event(job)])
     return job
 
 
@@ -4,7 +4,7 @@ from sqlalchemy.orm import Session
 from app.database import get_db
 from app.models.user import User
 from app.models.invoice import Invoice, InvoiceStatus
-from app.models.payment import Payment, PaymentStatus
+from app.models.payment import Payment, PaymentAllocation, PaymentStatus
 from app.schemas.payment import PaymentResponse, PaymentManualMatch, ReconciliationSummary
 from app.auth.dependencies import get_current_user
 
@@ -51,6 +51,13 @@ def import_bank_csv(
     for p in created:
         db.refresh(p)
 
+    # 取り込んだ入金だけを対象に自動消込を起動（Redis未接続時は日次バッチで消込）
+    try:
+        from workers.tasks import match_new_payments_task
+        match_new_payments_task.delay([p.id for p in created])
+    except Exception:
+        pass
+
     return {
         "imported_count": len(created),
         "payments": [
@@ -112,6 +119,10 @@ def list_payments(
                 "bank_name": p.bank_name,
                 "status": p.status.value,
                 "notes": p.notes,
+                "allocations": [
+                    {"invoice_id": a.invoice_id, "invoice_number": a.invoice.invoice_number, "amount": a.amount}
+                    for a in p.allocations
+                ],
             }
             for p in items
         ],
@@ -161,6 +172,7 @@ def manual_match(
     if not invoice:
         raise HTTPException(status_code=404, detail="請求書が見つかりません")
 
+    db.query(PaymentAllocation).filter(PaymentAllocation.payment_id == payment.id).delete()
     payment.invoice_id = invoice.id
     payment.status = PaymentStatus.matched
     db.commit()
@@ -191,14 +203,30 @@ def unmatch_payment(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    """マッチングを取り消す。"""
+    """マッチングを取り消す。
+
+    分割入金は同じ請求書に照合された入金をまとめて取り消す
+    (一部だけ外すと、照合済みの入金が残った請求書は自動消込の対象にならず再照合できないため)。
+    """
     payment = db.query(Payment).filter(Payment.id == payment_id).first()
     if not payment:
         raise HTTPException(status_code=404, detail="入金データが見つかりません")
     if payment.status == PaymentStatus.confirmed:
         raise HTTPException(status_code=400, detail="確定済みの消込は取り消せません")
 
-    payment.invoice_id = None
-    payment.status = PaymentStatus.unmatched
+    group = [payment]
+    if payment.status == PaymentStatus.matched and payment.invoice_id is not None:
+        group = (
+            db.query(Payment)
+            .filter(Payment.invoice_id == payment.invoice_id, Payment.status == PaymentStatus.matched)
+            .all()
+        )
+    payment_ids = sorted(p.id for p in group)
+    db.query(PaymentAllocation).filter(PaymentAllocation.payment_id.in_(payment_ids)).delete(synchronize_session=False)
+    for p in group:
+        p.invoice_id = None
+        p.status = PaymentStatus.unmatched
+        if p.notes and p.notes.startswith("分割入金 "):
+            p.notes = None
     db.commit()
-    return {"message": "マッチングを取り消しました", "payment_id": payment.id}
+    return {"message": "マッチングを取り消しました", "payment_id": payment.id, "payment_ids": payment_ids}
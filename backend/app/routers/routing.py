@@ -0,0 +1,49 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+
+from app.auth.dependencies import get_current_user, require_roles
+from app.database import get_db
+from app.models.user import User, UserRole
+from app.schemas.routing import RoutingSimulationRequest, RoutingSimulationResponse
+from app.services.metrics import metrics
+from app.services.routing import compile_rule_set, simulate_routing
+
+router = APIRouter()
+
+
+@router.get("/metrics", summary="振り分けメトリクス")
+def get_routing_metrics(
+    current_user: User = Depends(get_current_user),
+):
+    """ルールごとの一致 (hit) / 不一致 (miss) 件数と評価時間を返す。"""
+    series = [s for s in metrics.snapshot() if s["name"].startswith("routing_")]
+    rules: dict[str, dict] = {}
+    totals = {}
+    latency = {}
+    for s in series:
+        name, labels, value = s["name"], s["labels"], s["value"]
+        if name in ("routing_rule_hits_total", "routing_rule_misses_total"):
+            key = "hits" if name == "routing_rule_hits_total" else "misses"
+            rules.setdefault(labels["rule_id"], {"hits": 0, "misses": 0})[key] = int(value)
+        elif name.startswith("routing_evaluation_seconds"):
+            mode = latency.setdefault(labels.get("mode", ""), {"count": 0, "sum": 0.0, "buckets": {}})
+            if name.endswith("_bucket"):
+                mode["buckets"][labels["le"]] = int(value)
+            elif name.endswith("_sum"):
+                mode["sum"] = value
+            else:
+                mode["count"] = int(value)
+        else:
+            totals[name.removeprefix("routing_").removesuffix("_total")] = int(value)
+    return {"evaluations": totals.get("evaluations", 0), "unmatched": totals.get("unmatched", 0), "rules": rules, "latency": latency}
+
+
+@router.post("/simulate", response_model=RoutingSimulationResponse, summary="振り分けルールのシミュレーション")
+def simulate(
+    req: RoutingSimulationRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(require_roles(UserRole.admin)),
+):
+    """過去のジョブの解析結果を、現行ルールと提案ルールで振り分け直して差分を返す (DBは変更しない)。"""
+    proposed = compile_rule_set(rule.model_dump() for rule in req.rules)
+    return simulate_routing(db, proposed, limit=req.limit, statuses=req.statuses)
@@ -126,7 +126,21 @@ async def _handle_file_shared_event(event: dict):
     file_info = data["file"]
     filename = file_info.get("name", "")
 
-    if not filename.endswith((".xlsx", ".xls")):
+    if not filename.endswith((".xlsx", ".xls", ".csv", ".tsv")):
+        return
+
+    # 上限を超えるファイルはダウンロードせずに断る
+    size = file_info.get("size") or 0
+    if settings.EXCEL_MAX_FILE_BYTES is not None and size > settings.EXCEL_MAX_FILE_BYTES:
+        async with httpx.AsyncClient() as client:
+            await client.post(
+                "https://slack.com/api/chat.postMessage",
+                headers={"Authorization": f"Bearer {settings.SLACK_BOT_TOKEN}"},
+                json={
+                    "channel": channel_id,
+                    "text": f"❌ `{filename}` はファイルサイズが上限 ({settings.EXCEL_MAX_FILE_BYTES:,}バイト) を超えているため処理できません。",
+                },
+            )
         return
 
     # ファイルをダウンロード
@@ -178,107 +192,224 @@ async def _handle_file_shared_event(event: dict):
             },
         )
 
-    # Excel解析を実行（ExcelParserで形式を自動判定）
+    # Excel解析を実行（形式を自動判定し、合致するテンプレートがあれば適用。解析済みの内容ならキャッシュを利用）
+    # 解析と子ジョブの作成は同期処理のため、スレッドプールで実行してイベントループを塞がない
+    from starlette.concurrency import run_in_threadpool
     try:
-        from workers.excel_parser import ExcelParser
-        parser = ExcelParser()
-        result = parser.smart_parse(file_path)
-
-        if isinstance(result, list):
-            # テーブル形式（一覧Excel）: 行ごとに個別ジョブを作成
-            # 親ジョブは完了扱いにする
-            job.result = {"format": "table", "child_count": len(result)}
-            job.status = JobStatus.completed
-            db.add(ProcessingLog(job_id=job.id, step_name="解析", status="completed", message=f"一覧形式: {len(result)}件を検出、個別ジョブを作成"))
-            db.commit()
-
+        outcome = await run_in_threadpool(_parse_upload, db, job, file_path)
+        if "error" in outcome:
+            text = f"❌ ジョブ #{job.id} 解析エラー: {outcome['error']}"
             async with httpx.AsyncClient() as client:
                 await client.post(
                     "https://slack.com/api/chat.postMessage",
                     headers={"Authorization": f"Bearer {settings.SLACK_BOT_TOKEN}"},
-                    json={
-                        "channel": channel_id,
-                        "text": f"📋 一覧形式のExcelを検出: {len(result)}件。個別に承認リクエストを送信します。",
-                    },
-                )
-
-            # 各行を個別ジョブとして作成し、それぞれ承認メッセージを送信
-            for i, row in enumerate(result):
-                row_data = {k: str(v) for k, v in row.items()}
-                child_job = ProcessingJob(
-                    slack_channel_id=channel_id,
-                    slack_message_id=event.get("event_ts", ""),
-                    excel_file_path=file_path,
-                    status=JobStatus.pending_approval,
-                    result=row_data,
+                    json={"channel": channel_id, "text": text},
                 )
-                db.add(child_job)
-                db.commit()
-                db.refresh(child_job)
-                db.add(ProcessingLog(job_id=child_job.id, step_name="解析", status="completed", message=f"一覧 {i+1}/{len(result)}行目"))
-                db.commit()
-
-                # 解析内容を表示
-                summary = "\n".join(f"  • {k}: {v}" for k, v in list(row_data.items())[:10])
-                async with httpx.AsyncClient() as client:
-                    await client.post(
-                        "https://slack.com/api/chat.postMessage",
-                        headers={"Authorization": f"Bearer {settings.SLACK_BOT_TOKEN}"},
-                        json={
-                            "channel": channel_id,
-                            "text": f"✅ ジョブ #{child_job.id} ({i+1}/{len(result)}):\n{summary}",
-                            "blocks": [
-                                {"type": "section", "text": {"type": "mrkdwn", "text": f"✅ *ジョブ #{child_job.id}* ({i+1}/{len(result)})\n{summary}"}},
-                                {"type": "actions", "elements": [
-                                    {"type": "button", "text": {"type": "plain_text", "text": "承認"}, "style": "primary", "action_id": f"approve_job_{child_job.id}"},
-                                    {"type": "button", "text": {"type": "plain_text", "text": "却下"}, "style": "danger", "action_id": f"reject_job_{child_job.id}"},
-                                ]},
-                            ],
-                        },
-                    )
-        else:
-            # キーバリュー形式（発注仕様書）: 従来通り1ジョブ
-            records = {k: str(v) for k, v in result.items()}
-            job.result = records
-            job.status = JobStatus.pending_approval
-            db.add(ProcessingLog(job_id=job.id, step_name="解析", status="completed", message=f"全{len(records)}項目を読み取り"))
-            db.commit()
+            return
 
-            summary = "\n".join(f"  • {k}: {v}" for k, v in list(records.items())[:10])
+        if "children" in outcome:
+            # 一覧・複数シート: コミット後に子ジョブごとの承認リクエストを送信する
+            await _notify_child_jobs(db, outcome["children"], channel_id)
             async with httpx.AsyncClient() as client:
                 await client.post(
                     "https://slack.com/api/chat.postMessage",
                     headers={"Authorization": f"Bearer {settings.SLACK_BOT_TOKEN}"},
-                    json={
-                        "channel": channel_id,
-                        "text": f"✅ ジョブ #{job.id} 解析完了:\n{summary}\n\n全{len(records)}項目",
-                        "blocks": [
-                            {"type": "section", "text": {"type": "mrkdwn", "text": f"✅ *ジョブ #{job.id} 解析完了*\n{summary}\n\n全{len(records)}項目"}},
-                            {"type": "actions", "elements": [
-                                {"type": "button", "text": {"type": "plain_text", "text": "承認"}, "style": "primary", "action_id": f"approve_job_{job.id}"},
-                                {"type": "button", "text": {"type": "plain_text", "text": "却下"}, "style": "danger", "action_id": f"reject_job_{job.id}"},
-                            ]},
-                        ],
-                    },
+                    json={"channel": channel_id, "text": outcome["message"]},
                 )
-    except Exception as e:
-        job.status = JobStatus.failed
-        job.error_message = str(e)
-        db.add(ProcessingLog(job_id=job.id, step_name="解析", status="failed", message=str(e)))
-        db.commit()
+            return
+
+        # キーバリュー形式（発注仕様書）: 従来通り1ジョブ
+        records = outcome["records"]
+        summary = "\n".join(f"  • {k}: {v}" for k, v in list(records.items())[:10])
         async with httpx.AsyncClient() as client:
             await client.post(
                 "https://slack.com/api/chat.postMessage",
                 headers={"Authorization": f"Bearer {settings.SLACK_BOT_TOKEN}"},
                 json={
                     "channel": channel_id,
-                    "text": f"❌ ジョブ #{job.id} 解析エラー: {e}",
+                    "text": f"✅ ジョブ #{job.id} 解析完了:\n{summary}\n\n全{len(records)}項目",
+                    "blocks": [
+                        {"type": "section", "text": {"type": "mrkdwn", "text": f"✅ *ジョブ #{job.id} 解析完了*\n{summary}\n\n全{len(records)}項目"}},
+                        {"type": "actions", "elements": [
+                            {"type": "button", "text": {"type": "plain_text", "text": "承認"}, "style": "primary", "action_id": f"approve_job_{job.id}"},
+                            {"type": "button", "text": {"type": "plain_text", "text": "却下"}, "style": "danger", "action_id": f"reject_job_{job.id}"},
+                        ]},
+                    ],
                 },
             )
     finally:
         db.close()
 
 
+def _parse_upload(db, job, file_path: str) -> dict:
+    """受信したExcelを解析し、親ジョブの結果と子ジョブを1つのトランザクションで保存する
+
+    途中で失敗した場合や一覧の全行が検証エラーの場合はロールバックして作成途中の子ジョブを残さず、
+    親ジョブを失敗にしてデッドレターに記録する。戻り値は Slack に送る内容 ("error" / "children" / "records")。
+    """
+    from app.models.automation import ProcessingLog, JobStatus
+    from app.services.dead_letter import record_failure
+    from app.services.routing import determine_target
+    from app.services.step_timing import STEP_PARSE, STEP_TO_APPROVAL, record_timings, timing_row, utcnow
+    from workers.excel_parser import ExcelParseError
+    from workers.parse_cache import open_parsed
+    from workers.validation import to_json_value
+
+    parse_started = utcnow()
+    validation = None
+    try:
+        with open_parsed(db, file_path) as parsed:
+            if parsed.format == "table":
+                outcome = _create_child_jobs_from_table(db, job, parsed)
+            elif parsed.format == "multi_sheet":
+                outcome = _create_child_jobs_from_sheets(db, job, parsed)
+            else:
+                outcome = None
+                result = parsed.data
+                if parsed.report["invalid_rows"]:
+                    # 検証エラーの仕様書は承認に回さず、ここで差し戻す
+                    validation = parsed.report
+                    raise ExcelParseError("検証エラー: " + " / ".join(parsed.errors[:5]))
+        if outcome is not None and not outcome["children"] and outcome["validation"]["invalid_rows"]:
+            # 一覧の全行が検証エラーの場合は子ジョブがないため、完了にせず差し戻す
+            validation = outcome["validation"]
+            raise ExcelParseError("検証エラー: " + " / ".join(outcome["errors"][:5]))
+        if outcome is not None:
+            db.commit()
+            return outcome
+
+        records = {k: to_json_value(v) for k, v in result.items()}
+        job.result = records
+        job.assigned_system = determine_target(db, result)
+        job.status = JobStatus.pending_approval
+        db.add(ProcessingLog(job_id=job.id, step_name="解析", status="completed", message=f"全{len(records)}項目を読み取り"))
+        now = utcnow()
+        record_timings(db, [
+            timing_row(job.id, STEP_PARSE, parse_started, now),
+            timing_row(job.id, STEP_TO_APPROVAL, job.created_at, now),
+        ])
+        db.commit()
+        return {"records": records}
+    except Exception as e:
+        db.rollback()
+        job.status = JobStatus.failed
+        job.error_message = str(e)
+        if validation is not None:
+            job.result = {"validation": validation}
+        db.add(ProcessingLog(job_id=job.id, step_name="解析", status="failed", message=str(e)))
+        record_failure(db, job, STEP_PARSE, e, error_class="ValidationError" if validation is not None else None)
+        db.commit()
+        return {"error": str(e)}
+
+
+def _create_child_jobs_from_table(db, job, parsed) -> dict:
+    """テーブル形式（一覧Excel）: 行を逐次読みながら行ごとに個別ジョブを作成する (コミットは呼び出し側で行う)。
+
+    全行をメモリに載せずに処理するため、件数は読み終えた時点で親ジョブに記録する。
+    """
+    from app.models.automation import ProcessingLog, JobStatus
+    from app.services.routing import ROUTING_BATCH_SIZE, RoutingBatch
+    from workers.fanout import create_children_from
+
+    # 振り分け先の判定と子ジョブの作成は ROUTING_BATCH_SIZE 件ずつまとめて行う
+    routing = RoutingBatch(targets=[])
+    items = ((record, f"一覧 {n}行目") for n, record in enumerate(parsed.iter_records(), start=1))
+    children = create_children_from(db, job, items, routing=routing, chunk_size=ROUTING_BATCH_SIZE)
+    child_count = len(children)
+
+    # 親ジョブは完了扱いにする (検証エラーの行はジョブを作らず、レポートを残す)
+    report = parsed.report
+    job.result = {"format": "table", "child_count": child_count, "validation": report, "routing": routing.to_dict()}
+    job.status = JobStatus.completed
+    db.add(ProcessingLog(job_id=job.id, step_name="解析", status="completed", message=f"一覧形式: {child_count}件を検出、個別ジョブを作成"))
+    skipped = ""
+    if report["invalid_rows"]:
+        errors = " / ".join(parsed.errors[:5])
+        db.add(ProcessingLog(job_id=job.id, step_name="解析", status="warning", message=f"検証エラーのため{report['invalid_rows']}行をスキップ: {errors}"))
+        skipped = f"\n⚠️ 検証エラーのため{report['invalid_rows']}行をスキップしました: {errors}"
+
+    return {
+        "children": [(child_id, f"{n}件目") for n, (child_id, _) in enumerate(children, start=1)],
+        "message": f"📋 一覧形式のExcel: 全{child_count}件の承認リクエストを送信しました。{skipped}",
+        "validation": report,
+        "errors": parsed.errors,
+    }
+
+
+def _create_child_jobs_from_sheets(db, job, parsed) -> dict:
+    """複数シートのExcel: シートごとに形式を判定し、一覧シートは行ごと、仕様書シートはシートごとに個別ジョブを作成する
+    (コミットは呼び出し側で行う)。
+
+    API プロセスではプロセスプールを起動せず、シートを順に読みながら子ジョブにする
+    (並列解析は Celery の process_order でのみ行う)。
+    """
+    from app.models.automation import ProcessingLog, JobStatus
+    from app.services.routing import ROUTING_BATCH_SIZE, RoutingBatch
+    from workers.fanout import create_children_from
+    from workers.multi_sheet import iter_sheet_records
+
+    summary = {}
+    routing = RoutingBatch(targets=[])
+    children = create_children_from(db, job, iter_sheet_records(parsed.iter_sheets(max_workers=1), summary), routing=routing,
+                                    chunk_size=ROUTING_BATCH_SIZE)
+    child_count = len(children)
+    for error in summary["errors"]:
+        db.add(ProcessingLog(job_id=job.id, step_name="解析", status="warning", message=error))
+
+    # 親ジョブは完了扱いにする
+    sheet_counts = summary["sheets"]
+    job.result = {"format": "multi_sheet", "child_count": child_count, "sheets": sheet_counts, "validation": summary["validation"], "routing": routing.to_dict()}
+    job.status = JobStatus.completed
+    db.add(ProcessingLog(job_id=job.id, step_name="解析", status="completed", message=f"{len(sheet_counts)}シート: {child_count}件を検出、個別ジョブを作成"))
+
+    return {
+        "children": children,
+        "message": f"📋 {len(sheet_counts)}シートのExcel: 全{child_count}件の承認リクエストを送信しました。",
+        "validation": {"invalid_rows": sum(r["invalid_rows"] for r in summary["validation"].values())},
+        "errors": summary["errors"],
+    }
+
+
+async def _notify_child_jobs(db, children: list[tuple[int, str]], channel_id: str):
+    """作成済みの子ジョブに承認メッセージを送信する (解析内容は ROUTING_BATCH_SIZE 件ずつDBから読む)"""
+    from app.models.automation import ProcessingJob
+    from app.services.routing import ROUTING_BATCH_SIZE
+
+    for start in range(0, len(children), ROUTING_BATCH_SIZE):
+        page = children[start:start + ROUTING_BATCH_SIZE]
+        rows = dict(
+            db.query(ProcessingJob.id, ProcessingJob.result).filter(ProcessingJob.id.in_([child_id for child_id, _ in page]))
+        )
+        for child_id, label in page:
+            await _notify_child_job(child_id, rows.get(child_id) or {}, channel_id, label)
+
+
+async def _notify_child_job(child_id: int, row: dict, channel_id: str, label: str):
+    """子ジョブの解析内容と承認ボタンを送信する"""
+    import httpx
+    from workers.validation import to_json_value
+
+    row_data = {k: to_json_value(v) for k, v in row.items()}
+    # 解析内容を表示
+    summary = "\n".join(f"  • {k}: {v}" for k, v in list(row_data.items())[:10])
+    async with httpx.AsyncClient() as client:
+        await client.post(
+            "https://slack.com/api/chat.postMessage",
+            headers={"Authorization": f"Bearer {settings.SLACK_BOT_TOKEN}"},
+            json={
+                "channel": channel_id,
+                "text": f"✅ ジョブ #{child_id} ({label}):\n{summary}",
+                "blocks": [
+                    {"type": "section", "text": {"type": "mrkdwn", "text": f"✅ *ジョブ #{child_id}* ({label})\n{summary}"}},
+                    {"type": "actions", "elements": [
+                        {"type": "button", "text": {"type": "plain_text", "text": "承認"}, "style": "primary", "action_id": f"approve_job_{child_id}"},
+                        {"type": "button", "text": {"type": "plain_text", "text": "却下"}, "style": "danger", "action_id": f"reject_job_{child_id}"},
+                    ]},
+                ],
+            },
+        )
+
+
 async def _handle_file_shared(event: dict):
     """ファイル共有イベントを処理してジョブを作成"""
     from workers.slack_listener import SlackService
@@ -291,7 +422,7 @@ async def _handle_file_shared(event: dict):
 
     for file_info in files:
         filename = file_info.get("name", "")
-        if filename.endswith((".xlsx", ".xls")):
+        if filename.endswith((".xlsx", ".xls", ".csv", ".tsv")):
             # ファイルパスはダウンロード後のパスを設定
             file_path = f"/app/uploads/{filename}"
             job_id = slack_service.create_job_from_file(channel_id, message_id, file_path)
@@ -306,8 +437,10 @@ async def _handle_job_approval(job_id: int, approved: bool, slack_user: str) ->
     from datetime import datetime, timezone
     from app.database import SessionLocal
     from app.models.automation import ProcessingJob, ProcessingLog, JobStatus
-    from app.services.order_registration import register_order_from_job
-    from app.services.mcp_executor import execute_mcp_input
+    from app.services.dead_letter import record_failure
+    from starlette.concurrency import run_in_threadpool
+    from app.services.job_steps import ORDER_REGISTRATION, WEB_INPUT, defer_to_worker, pending_step, run_steps
+    from app.services.web_input_limiter import WebInputThrottled
 
     db = SessionLocal()
     result_message = ""
@@ -324,10 +457,17 @@ async def _handle_job_approval(job_id: int, approved: bool, slack_user: str) ->
 
             try:
                 # Step 1: Excel解析結果から実データを自動登録
-                created = register_order_from_job(db, job)
-
                 # Step 2: MCPモック経由でWebシステムに自動入力
-                mcp_result = execute_mcp_input(db, job)
+                # イベントループを塞がないようスレッドプールで実行し、流量制限の枠は待たない
+                try:
+                    results = await run_in_threadpool(run_steps, db, job, max_wait=0)
+                except WebInputThrottled as e:
+                    # 枠が空いていなければWeb入力はワーカーに任せる (発注登録は完了済みのためやり直さない)
+                    message = defer_to_worker(db, job, pending_step(job), e)
+                    db.commit()
+                    return message
+                created = results[ORDER_REGISTRATION]
+                mcp_result = results[WEB_INPUT]
 
                 job.status = JobStatus.completed
                 db.commit()
@@ -357,6 +497,7 @@ async def _handle_job_approval(job_id: int, approved: bool, slack_user: str) ->
                     status="failed",
                     message=str(e),
                 ))
+                record_failure(db, job, pending_step(job), e)
                 db.commit()
                 result_message = f"処理エラー: {e}"
         else:
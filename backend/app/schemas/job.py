@@ -1,6 +1,6 @@
 from datetime import datetime
 from typing import Any
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class ProcessingLogResponse(BaseModel):
@@ -17,6 +17,7 @@ class ProcessingLogResponse(BaseModel):
 
 class JobResponse(BaseModel):
     id: int
+    parent_job_id: int | None = None
     slack_message_id: str | None = None
     slack_channel_id: str | None = None
     excel_file_path: str | None = None
@@ -25,6 +26,7 @@ class JobResponse(BaseModel):
     approved_by: int | None = None
     approved_at: datetime | None = None
     result: dict[str, Any] | None = None
+    checkpoints: dict[str, Any] | None = None
     error_message: str | None = None
     logs: list[ProcessingLogResponse] = []
     created_at: datetime
@@ -35,3 +37,58 @@ class JobResponse(BaseModel):
 
 class JobApproveRequest(BaseModel):
     approved: bool
+
+
+class StepLatency(BaseModel):
+    step: str
+    count: int
+    avg_ms: float
+    max_ms: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+
+
+class JobMetricsResponse(BaseModel):
+    since: datetime
+    steps: list[StepLatency]
+
+
+class StreamTicketResponse(BaseModel):
+    ticket: str
+    expires_in: int
+
+
+class DeadLetterResponse(BaseModel):
+    id: int
+    job_id: int
+    step: str
+    error_class: str
+    error_message: str | None = None
+    assigned_system: str | None = None
+    input_snapshot: dict[str, Any] | None = None
+    status: str
+    replayed_at: datetime | None = None
+    created_at: datetime
+
+    model_config = {"from_attributes": True}
+
+
+class DeadLetterReplayRequest(BaseModel):
+    """再実行する記録の条件 (指定した条件すべてに一致する未処理の記録が対象)"""
+    ids: list[int] | None = None
+    error_class: str | None = None
+    assigned_system: str | None = None
+    step: str | None = None
+    since: datetime | None = None
+    until: datetime | None = None
+    limit: int = Field(default=1000, ge=1, le=1000)
+    batch_size: int = Field(default=20, ge=1, le=100)
+    # ブローカーの visibility_timeout (既定1時間) より短く (dead_letter.REPLAY_MAX_INTERVAL_SECONDS)
+    interval_seconds: float = Field(default=60, ge=0, le=3000)
+
+
+class DeadLetterReplayResponse(BaseModel):
+    selected: int
+    batches: int
+    job_ids: list[int]
@@ -0,0 +1,43 @@
+from typing import Literal
+
+from pydantic import BaseModel, Field
+
+
+class RoutingRuleInput(BaseModel):
+    id: int | None = None
+    name: str = ""
+    condition_type: Literal["vendor_name", "vendor_name_contains", "category", "amount_gte", "amount_lt", "keyword"]
+    condition_value: str
+    target_system: Literal["system_a", "system_b"]
+    priority: int
+    is_active: bool = True
+
+
+class RoutingSimulationRequest(BaseModel):
+    rules: list[RoutingRuleInput]
+    limit: int = Field(default=10000, ge=1, le=200000)
+    statuses: list[str] | None = None
+
+
+class RoutingChange(BaseModel):
+    job_id: int
+    current: str | None = None
+    proposed: str | None = None
+    current_rule_id: int | None = None
+    proposed_rule_id: int | None = None
+
+
+class RoutingHits(BaseModel):
+    hits: dict[str, int]
+    unmatched: int
+
+
+class RoutingSimulationResponse(BaseModel):
+    jobs: int
+    changed: int
+    transitions: dict[str, int]
+    current: RoutingHits
+    proposed: RoutingHits
+    changes: list[RoutingChange]
+    elapsed_seconds: float
+    jobs_per_second: int | None = None
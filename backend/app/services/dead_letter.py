@@ -0,0 +1,146 @@
+"""失敗したジョブの記録 (dead_letter_jobs) と、条件を指定したまとめての再実行
+
+再実行は REPLAY_BATCH_SIZE 件ずつ投入し、次のバッチは REPLAY_INTERVAL_SECONDS 秒後に
+replay_dead_letters タスクが続けて投入する (障害から復旧した直後のWebシステムに再送が集中しないようにする)。
+ジョブのタスクは遅延なしで投入するため、ブローカーやワーカーに長い ETA のタスクが溜まることはない。
+記録されたステップに合うタスクで再開する: 解析で失敗したジョブは解析から、承認後のステップで
+失敗したジョブはそのステップから (完了済みの発注登録をやり直さずに) 再開する。
+"""
+from datetime import datetime, timezone
+
+from sqlalchemy.orm import Query, Session
+
+from app.models.automation import DeadLetterJob, JobStatus, ProcessingJob
+from app.services.job_steps import STEPS
+from app.services.step_timing import STEP_PARSE
+
+REPLAY_BATCH_SIZE = 20
+REPLAY_INTERVAL_SECONDS = 60
+# 次のバッチまでの待ちの上限。Redis ブローカーは visibility_timeout (既定1時間) を超える ETA のタスクを
+# 再配送するため、それより短くする
+REPLAY_MAX_INTERVAL_SECONDS = 50 * 60
+
+
+def record_failure(db: Session, job: ProcessingJob, step: str, error: BaseException | str,
+                   error_class: str | None = None) -> DeadLetterJob:
+    """失敗したステップ・例外・その時点の入力を記録する (コミットは呼び出し側で行う)"""
+    if isinstance(error, BaseException):
+        error_class = error_class or type(error).__name__
+    dead_letter = DeadLetterJob(
+        job_id=job.id,
+        step=step,
+        error_class=error_class or "Error",
+        error_message=str(error),
+        assigned_system=job.assigned_system,
+        input_snapshot={
+            "excel_file_path": job.excel_file_path,
+            "result": job.result,
+            "checkpoints": job.checkpoints,
+        },
+        status="pending",
+    )
+    db.add(dead_letter)
+    return dead_letter
+
+
+def query_dead_letters(
+    db: Session,
+    ids: list[int] | None = None,
+    error_class: str | None = None,
+    assigned_system: str | None = None,
+    step: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    status: str | None = "pending",
+) -> Query:
+    query = db.query(DeadLetterJob)
+    if ids:
+        query = query.filter(DeadLetterJob.id.in_(ids))
+    if error_class:
+        query = query.filter(DeadLetterJob.error_class == error_class)
+    if assigned_system:
+        query = query.filter(DeadLetterJob.assigned_system == assigned_system)
+    if step:
+        query = query.filter(DeadLetterJob.step == step)
+    if since:
+        query = query.filter(DeadLetterJob.created_at >= since)
+    if until:
+        query = query.filter(DeadLetterJob.created_at < until)
+    if status:
+        query = query.filter(DeadLetterJob.status == status)
+    return query.order_by(DeadLetterJob.created_at, DeadLetterJob.id)
+
+
+def replay(db: Session, dead_letters: list[DeadLetterJob], batch_size: int = REPLAY_BATCH_SIZE,
+           interval_seconds: float = REPLAY_INTERVAL_SECONDS) -> dict:
+    """最初の batch_size 件のジョブを再実行のキューに投入し、残りは interval_seconds 秒後に続ける
+
+    同じジョブの記録が複数ある場合はジョブ1件として、最も手前のステップから投入する。
+    再開方法の分からないステップの記録は未処理のまま残す。
+    ジョブは1件ずつ投入し、投入できたものから記録を replayed にしてコミットする。キューに投入できない
+    場合はそのジョブの変更をロールバックして例外を送出する (そのジョブ以降の記録は未処理のまま残る)。
+    残りのジョブは記録のIDを replay_dead_letters タスクに渡し、その時点でまだ未処理のものだけを投入する。
+    """
+    from workers.tasks import replay_dead_letters_task
+
+    plan = _replay_plan(dead_letters)
+    for job_id, step, records in plan[:batch_size]:
+        _enqueue(db, job_id, step, records)
+
+    rest = [record.id for _, _, records in plan[batch_size:] for record in records]
+    if rest:
+        replay_dead_letters_task.apply_async(
+            (rest, batch_size, interval_seconds),
+            countdown=min(interval_seconds, REPLAY_MAX_INTERVAL_SECONDS),
+        )
+
+    return {
+        "selected": len(dead_letters),
+        "batches": (len(plan) + batch_size - 1) // batch_size,
+        "job_ids": [job_id for job_id, _, _ in plan],
+    }
+
+
+def _replay_plan(dead_letters: list[DeadLetterJob]) -> list[tuple[int, str, list[DeadLetterJob]]]:
+    """(ジョブID, 再開するステップ, 記録) のリスト。ジョブの順は記録の順"""
+    by_job: dict[int, list[DeadLetterJob]] = {}
+    for dead_letter in dead_letters:
+        by_job.setdefault(dead_letter.job_id, []).append(dead_letter)
+
+    # 再開できるステップ (パイプラインの順)
+    order = [STEP_PARSE, *(step for step, _ in STEPS)]
+
+    plan = []
+    for job_id, records in by_job.items():
+        steps = [record.step for record in records if record.step in order]
+        if steps:
+            plan.append((job_id, min(steps, key=order.index), records))
+    return plan
+
+
+def _enqueue(db: Session, job_id: int, step: str, records: list[DeadLetterJob]) -> None:
+    """1件のジョブを遅延なしで投入し、記録を replayed にしてコミットする"""
+    from workers.job_processor import process_order
+    from workers.tasks import process_order_async
+
+    job = records[0].job
+    if step == STEP_PARSE:
+        job.status = JobStatus.received
+        task, args = process_order, (job_id,)
+    else:
+        # 承認後のステップは失敗したステップから再開する
+        job.status = JobStatus.executing
+        task, args = process_order_async, (job_id, step)
+    job.error_message = None
+    now = datetime.now(timezone.utc)
+    for record in records:
+        record.status = "replayed"
+        record.replayed_at = now
+    db.flush()
+
+    try:
+        task.apply_async(args)
+    except Exception:
+        db.rollback()
+        raise
+    db.commit()
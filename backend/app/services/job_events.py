@@ -0,0 +1,255 @@
+"""ジョブの進捗の配信: ステータス変更とログ1行ごとの差分を購読者 (GET /jobs/stream) に送る
+
+ワーカーと API が別プロセスのため、Redis の pub/sub (チャネル JOB_EVENTS_CHANNEL) で中継する。
+Redis に接続できない環境 (テスト・ローカル) ではプロセス内のブローカー (local_broker) で配信する。
+配信は失敗してもパイプラインを止めない (画面は GET /jobs の再取得で追いつける)。
+購読側は redis.asyncio で待つため、配信中の接続がイベントループを止めることはない。
+
+EventSource はヘッダーを付けられないため、配信の接続には POST /jobs/stream-ticket で発行した
+使い捨てのチケットを使う (アクセストークンを URL に載せてアクセスログに残さないため)。
+
+イベントは次の2種類:
+    {"type": "status", "job_id", "parent_job_id", "status", "error_message", "assigned_system"}
+    {"type": "log", "job_id", "step_name", "status", "message", "created_at"}
+"""
+import asyncio
+import json
+import queue
+import secrets
+import threading
+import time
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, Iterable
+
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.models.automation import ProcessingJob
+
+JOB_EVENTS_CHANNEL = "jobs:events"
+# 購読者ごとに溜めるイベントの上限 (超えた分は捨てる。遅い購読者で API のメモリを使い切らないため)
+MAX_PENDING_EVENTS = 1000
+# 接続を保つためのコメント行を送る間隔 (秒)
+HEARTBEAT_INTERVAL = 15.0
+# 新しいイベントを待つ時間の上限 (秒)。この間隔で切断を確認する
+POLL_INTERVAL = 0.5
+# 配信用チケットの有効期限 (秒)。発行してから EventSource で接続するまでの間だけ使えればよい
+STREAM_TICKET_TTL = 30
+STREAM_TICKET_PREFIX = "jobs:stream_ticket:"
+
+
+def status_event(job: ProcessingJob) -> dict:
+    status = job.status.value if hasattr(job.status, "value") else job.status
+    return {
+        "type": "status",
+        "job_id": job.id,
+        "parent_job_id": job.parent_job_id,
+        "status": status,
+        "error_message": job.error_message,
+        "assigned_system": job.assigned_system,
+    }
+
+
+def log_event(entry: dict) -> dict:
+    created_at = entry.get("created_at")
+    return {
+        "type": "log",
+        "job_id": entry["job_id"],
+        "step_name": entry["step_name"],
+        "status": entry["status"],
+        "message": entry["message"],
+        "created_at": created_at.isoformat() if isinstance(created_at, datetime) else created_at,
+    }
+
+
+class LocalBroker:
+    """プロセス内の pub/sub (Redis がない場合の配信先)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: set[queue.Queue] = set()
+
+    def publish(self, event: dict):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                pass
+
+    def subscribe(self) -> "LocalSubscription":
+        q: queue.Queue = queue.Queue(maxsize=MAX_PENDING_EVENTS)
+        with self._lock:
+            self._subscribers.add(q)
+        return LocalSubscription(self, q)
+
+    def _unsubscribe(self, q: queue.Queue):
+        with self._lock:
+            self._subscribers.discard(q)
+
+
+class LocalSubscription:
+    def __init__(self, broker: LocalBroker, q: queue.Queue):
+        self._broker = broker
+        self._queue = q
+
+    def get_nowait(self) -> dict | None:
+        try:
+            return self._queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    async def get(self, timeout: float) -> dict | None:
+        event = self.get_nowait()
+        if event is None and timeout > 0:
+            await asyncio.sleep(timeout)
+            event = self.get_nowait()
+        return event
+
+    async def close(self):
+        self._broker._unsubscribe(self._queue)
+
+
+class RedisSubscription:
+    def __init__(self, client, pubsub):
+        self._client = client
+        self._pubsub = pubsub
+
+    async def get(self, timeout: float) -> dict | None:
+        message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+        if not message:
+            return None
+        return json.loads(message["data"])
+
+    async def close(self):
+        try:
+            await self._pubsub.aclose()
+            await self._client.aclose()
+        except Exception:
+            pass
+
+
+class LocalTickets:
+    """プロセス内の配信用チケット (Redis がない場合の保存先)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tickets: dict[str, tuple[int, float]] = {}
+
+    def issue(self, ticket: str, user_id: int):
+        now = time.monotonic()
+        with self._lock:
+            self._tickets = {t: v for t, v in self._tickets.items() if v[1] > now}
+            self._tickets[ticket] = (user_id, now + STREAM_TICKET_TTL)
+
+    def redeem(self, ticket: str) -> int | None:
+        with self._lock:
+            user_id, expires_at = self._tickets.pop(ticket, (None, 0.0))
+        return user_id if expires_at > time.monotonic() else None
+
+
+local_broker = LocalBroker()
+local_tickets = LocalTickets()
+
+
+def publish(events: Iterable[dict]):
+    """イベントを配信する (Redis に送れなければプロセス内で配信する)"""
+    from app.utils.redis_client import get_redis
+
+    events = list(events)
+    if not events:
+        return
+    client = get_redis()
+    if client is not None:
+        try:
+            pipe = client.pipeline(transaction=False)
+            for event in events:
+                pipe.publish(JOB_EVENTS_CHANNEL, json.dumps(event, ensure_ascii=False, default=str))
+            pipe.execute()
+            return
+        except Exception:
+            pass
+    for event in events:
+        local_broker.publish(event)
+
+
+async def subscribe():
+    """購読を開始する。await get(timeout) で次のイベント (timeout 秒待ってなければ None)、await close() で終了"""
+    from app.utils.redis_client import get_redis
+
+    # 共有クライアントの接続確認はブロックするため、スレッドで行う
+    if await run_in_threadpool(get_redis) is not None:
+        try:
+            import redis.asyncio
+
+            client = redis.asyncio.Redis.from_url(settings.REDIS_URL, socket_connect_timeout=0.5)
+            pubsub = client.pubsub()
+            await pubsub.subscribe(JOB_EVENTS_CHANNEL)
+            return RedisSubscription(client, pubsub)
+        except Exception:
+            pass
+    return local_broker.subscribe()
+
+
+def issue_stream_ticket(user_id: int) -> str:
+    """配信の接続に使う使い捨てのチケットを発行する (有効期限 STREAM_TICKET_TTL 秒)"""
+    from app.utils.redis_client import get_redis
+
+    ticket = secrets.token_urlsafe(32)
+    client = get_redis()
+    if client is not None:
+        try:
+            client.set(STREAM_TICKET_PREFIX + ticket, user_id, ex=STREAM_TICKET_TTL)
+            return ticket
+        except Exception:
+            pass
+    local_tickets.issue(ticket, user_id)
+    return ticket
+
+
+def redeem_stream_ticket(ticket: str) -> int | None:
+    """チケットを使用済みにしてユーザーIDを返す。無効・期限切れ・使用済みなら None"""
+    from app.utils.redis_client import get_redis
+
+    client = get_redis()
+    if client is not None:
+        try:
+            user_id = client.getdel(STREAM_TICKET_PREFIX + ticket)
+            if user_id is not None:
+                return int(user_id)
+        except Exception:
+            pass
+    return local_tickets.redeem(ticket)
+
+
+def _matches(event: dict, job_id: int | None) -> bool:
+    return job_id is None or event["job_id"] == job_id or event.get("parent_job_id") == job_id
+
+
+async def stream_events(
+    subscription,
+    is_disconnected: Callable[[], Awaitable[bool]],
+    job_id: int | None = None,
+    heartbeat_interval: float = HEARTBEAT_INTERVAL,
+    poll_interval: float = POLL_INTERVAL,
+) -> AsyncIterator[str]:
+    """購読したイベントを Server-Sent Events の形式で返す
+
+    job_id を指定するとそのジョブのイベントと、子ジョブのステータス変更だけを返す。
+    """
+    try:
+        yield "retry: 3000\n\n"
+        last_sent = time.monotonic()
+        while not await is_disconnected():
+            event = await subscription.get(poll_interval)
+            if event is None:
+                if time.monotonic() - last_sent >= heartbeat_interval:
+                    yield ": keepalive\n\n"
+                    last_sent = time.monotonic()
+                continue
+            if _matches(event, job_id):
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+                last_sent = time.monotonic()
+    finally:
+        await subscription.close()
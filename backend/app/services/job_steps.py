@@ -0,0 +1,143 @@
+"""承認後の実行ステップ (発注登録 → Web入力) と、ステップごとの完了記録 (チェックポイント)
+
+各ステップの結果は ProcessingJob.checkpoints に記録し、ステップで作ったデータと同じトランザクションで
+コミットする。再試行では完了済みのステップを飛ばし、最初の未完了のステップから再開する。
+Web入力にはジョブとステップから決まる冪等キーを渡し、完了の記録前に失敗した場合も入力が重複しないようにする。
+
+リクエストの処理中に流量制限で開始できなかったステップは失敗にせず、ワーカーに任せる (defer_to_worker)。
+キューに投入できない場合も、ジョブは実行中のまま resume_deferred_jobs タスクが後で投入する。
+"""
+from datetime import datetime, timezone
+from typing import Callable
+
+from sqlalchemy import exists
+from sqlalchemy.orm import Session, aliased
+
+from app.models.automation import JobStatus, ProcessingJob, ProcessingLog
+from app.services.step_timing import STEP_REGISTER, STEP_WEB_INPUT, observe, record_timings, timing_row, utcnow
+from app.services.web_input_limiter import WebInputThrottled
+
+ORDER_REGISTRATION = "order_registration"
+WEB_INPUT = "web_input"
+# ワーカーでの再開を待っているジョブのログの status
+DEFERRED = "deferred"
+# 所要時間の記録 (processing_step_timings) でのステップ名
+TIMING_STEPS = {ORDER_REGISTRATION: STEP_REGISTER, WEB_INPUT: STEP_WEB_INPUT}
+
+
+def _register(db: Session, job: ProcessingJob, key: str, max_wait: float | None) -> dict:
+    from app.services.order_registration import register_order_from_job
+
+    return register_order_from_job(db, job)
+
+
+def _web_input(db: Session, job: ProcessingJob, key: str, max_wait: float | None) -> dict:
+    from app.services.mcp_executor import execute_mcp_input
+
+    return execute_mcp_input(db, job, idempotency_key=key, max_wait=max_wait)
+
+
+# 実行順のステップ
+STEPS: tuple[tuple[str, Callable[[Session, ProcessingJob, str, float | None], dict]], ...] = (
+    (ORDER_REGISTRATION, _register),
+    (WEB_INPUT, _web_input),
+)
+
+
+def idempotency_key(job: ProcessingJob, step: str) -> str:
+    return f"job-{job.id}:{step}"
+
+
+def completed_result(job: ProcessingJob, step: str) -> dict | None:
+    """完了済みのステップの結果 (未完了なら None)"""
+    checkpoint = (job.checkpoints or {}).get(step)
+    return checkpoint["result"] if checkpoint else None
+
+
+def pending_step(job: ProcessingJob) -> str | None:
+    """最初の未完了のステップ (全ステップ完了済みなら None)"""
+    for step, _ in STEPS:
+        if completed_result(job, step) is None:
+            return step
+    return None
+
+
+def run_step(db: Session, job: ProcessingJob, step: str, max_wait: float | None = None) -> dict:
+    """ステップを実行し、完了と所要時間を記録する (コミットは呼び出し側で行う)
+
+    失敗した場合の所要時間はヒストグラムにだけ加算する (DB の変更はロールバックされるため)。
+    max_wait はWeb入力で流量制限の枠を待つ秒数 (既定は WEB_INPUT_MAX_WAIT_SECONDS)。
+    """
+    runner = dict(STEPS)[step]
+    key = idempotency_key(job, step)
+    started_at = utcnow()
+    try:
+        result = runner(db, job, key, max_wait)
+    except Exception:
+        observe(TIMING_STEPS[step], started_at, utcnow(), status="failed")
+        raise
+    record_timings(db, [timing_row(job.id, TIMING_STEPS[step], started_at, utcnow())])
+    job.checkpoints = {
+        **(job.checkpoints or {}),
+        step: {"key": key, "completed_at": datetime.now(timezone.utc).isoformat(), "result": result},
+    }
+    return result
+
+
+def run_steps(db: Session, job: ProcessingJob, max_wait: float | None = None) -> dict[str, dict]:
+    """未完了のステップを順に実行し、ステップごとにコミットする。全ステップの結果を返す
+
+    失敗したステップの変更はロールバックして例外を送出する (完了済みのステップは残る)。
+    リクエストの処理中に実行する場合は max_wait=0 にして流量制限の枠を待たない
+    (枠がなければ WebInputThrottled)。
+    """
+    results = {}
+    for step, _ in STEPS:
+        result = completed_result(job, step)
+        if result is None:
+            try:
+                result = run_step(db, job, step, max_wait)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+        results[step] = result
+    return results
+
+
+def defer_to_worker(db: Session, job: ProcessingJob, step: str, error: WebInputThrottled, enqueue: bool = True) -> str:
+    """流量制限で開始できなかったステップをワーカーに任せる (ジョブは実行中のまま。コミットは呼び出し側で行う)
+
+    すぐにキューに投入できればそのまま任せ、できなければ (またはブローカーに繋がらないと分かっていて
+    enqueue=False の場合は) resume_deferred_jobs が後で投入する。戻り値は利用者に返すメッセージ。
+    """
+    retry_after = error.retry_after
+    if enqueue:
+        from workers.tasks import process_order_async
+
+        try:
+            process_order_async.apply_async((job.id,), countdown=retry_after)
+        except Exception:
+            pass
+        else:
+            db.add(ProcessingLog(job_id=job.id, step_name=step, status="throttled", message=str(error)))
+            return f"流量制限のため、Web入力は{retry_after:.0f}秒後に実行します"
+    db.add(ProcessingLog(job_id=job.id, step_name=step, status=DEFERRED, message=f"{error} (ワーカーで後ほど実行します)"))
+    return "流量制限のため、Web入力はワーカーで後ほど実行します"
+
+
+def deferred_job_ids(db: Session) -> list[int]:
+    """ワーカーでの再開を待っている (最後のログが DEFERRED の実行中の) ジョブ"""
+    later = aliased(ProcessingLog)
+    rows = (
+        db.query(ProcessingLog.job_id)
+        .join(ProcessingJob, ProcessingJob.id == ProcessingLog.job_id)
+        .filter(
+            ProcessingLog.status == DEFERRED,
+            ProcessingJob.status == JobStatus.executing,
+            ~exists().where(later.job_id == ProcessingLog.job_id, later.id > ProcessingLog.id),
+        )
+        .order_by(ProcessingLog.job_id)
+        .distinct()
+    )
+    return [job_id for (job_id,) in rows]
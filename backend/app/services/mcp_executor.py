@@ -5,43 +5,35 @@ import os
 
 from sqlalchemy.orm import Session
 
-from app.models.automation import ProcessingJob, ProcessingLog, RoutingRule
+from app.models.automation import ProcessingJob, ProcessingLog
+from app.services.routing import determine_target
+from app.services.web_input_limiter import web_input_slot
 
 # mcp_servers パッケージへのパスを追加（Docker: /app/mcp_servers、ローカル: 3階層上）
 _mcp_parent = os.path.join(os.path.dirname(__file__), "..", "..")  # /app
 if _mcp_parent not in sys.path:
     sys.path.insert(0, _mcp_parent)
 
+# 振り分け先ごとのMCPクライアント (再試行で同じ冪等キーの入力結果を引けるようプロセス内で使い回す)
+_clients: dict = {}
+
 
 def determine_target_system(db: Session, order_data: dict) -> str:
     """振り分けルールに基づいてターゲットシステムを判定する。デフォルトは system_a。"""
-    rules = (
-        db.query(RoutingRule)
-        .filter(RoutingRule.is_active.is_(True))
-        .order_by(RoutingRule.priority.asc())
-        .all()
-    )
-
-    for rule in rules:
-        ctype = rule.condition_type
-        cval = rule.condition_value
-
-        if ctype == "vendor_name" and order_data.get("company_name", "") == cval:
-            return rule.target_system.value
-        elif ctype == "vendor_name_contains" and cval in order_data.get("company_name", ""):
-            return rule.target_system.value
-        elif ctype == "category" and order_data.get("project_description", "") == cval:
-            return rule.target_system.value
-        elif ctype == "keyword" and cval in str(order_data):
-            return rule.target_system.value
-
-    return "system_a"
-
-
-def execute_mcp_input(db: Session, job: ProcessingJob) -> dict:
+    # ジョブ処理で保存した結果は解析データを order_data の下に持つ
+    if isinstance(order_data.get("order_data"), dict):
+        order_data = order_data["order_data"]
+    return determine_target(db, order_data) or "system_a"
+
+
+def execute_mcp_input(db: Session, job: ProcessingJob, idempotency_key: str | None = None,
+                      max_wait: float | None = None) -> dict:
     """
     MCPモックサーバー経由でWebシステムに発注データを入力する。
 
+    idempotency_key を渡すと、同じキーでの再実行ではWebシステムへの入力が重複しない。
+    振り分け先ごとの流量制限を超える場合は枠が空くまで最大 max_wait 秒待つ (0 なら待たない)。
+
     Returns:
         MCP実行結果の辞書
     """
@@ -49,7 +41,8 @@ def execute_mcp_input(db: Session, job: ProcessingJob) -> dict:
 
     # 振り分け判定
     order_data = job.result or {}
-    target = determine_target_system(db, order_data)
+    # 解析時に振り分け済み (または手動で割り当て済み) ならルールを評価し直さない
+    target = job.assigned_system or determine_target_system(db, order_data)
     job.assigned_system = target
 
     db.add(ProcessingLog(
@@ -69,8 +62,12 @@ def execute_mcp_input(db: Session, job: ProcessingJob) -> dict:
     ))
     db.flush()
 
-    client = MockMCPClient(target)
-    mcp_result = client.execute_order_input(order_data)
+    # 振り分け先ごとの流量制限の枠が空くまで待つ (待ちきれなければ WebInputThrottled)
+    with web_input_slot(target, max_wait=max_wait):
+        client = _clients.get(target)
+        if client is None:
+            client = _clients.setdefault(target, MockMCPClient(target))
+        mcp_result = client.execute_order_input(order_data, idempotency_key)
 
     # 結果をjobに保存
     job.result = {**(job.result or {}), "mcp_result": mcp_result}
@@ -0,0 +1,134 @@
+"""プロセス内メトリクス: カウンタとレイテンシのヒストグラムを集計し、JSON / Prometheus 形式で出力する
+
+Celeryワーカーなど HTTP を持たないプロセスの値も見られるよう、Redis に接続できる場合は
+FLUSH_INTERVAL 秒ごとに差分を Redis のハッシュへ加算し、出力時は全プロセスの合計を返す。
+Redis がない環境ではこのプロセスの値だけを返す。
+"""
+import json
+import threading
+import time
+
+# 差分を Redis に書き出す間隔 (秒)
+FLUSH_INTERVAL = 10.0
+REDIS_METRICS_KEY = "metrics:counters"
+# レイテンシのヒストグラムの上限値 (秒)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+def _series_key(name: str, labels: dict) -> str:
+    return json.dumps([name, sorted((k, str(v)) for k, v in labels.items())], ensure_ascii=False)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _parse_key(key: str) -> tuple[str, dict]:
+    name, labels = json.loads(key)
+    return name, dict(labels)
+
+
+class MetricsRegistry:
+    """カウンタの集合。ヒストグラムも _bucket / _sum / _count のカウンタとして持つ"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: dict[str, float] = {}
+        self._pending: dict[str, float] = {}
+        self._flushed_at = time.monotonic()
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        self._add(_series_key(name, labels), value)
+        self._maybe_flush()
+
+    def inc_many(self, name: str, values: dict, label: str):
+        """同じ名前のカウンタをラベル値ごとにまとめて加算する ({ラベル値: 加算値})"""
+        for label_value, value in values.items():
+            self._add(_series_key(name, {label: label_value}), value)
+        self._maybe_flush()
+
+    def observe(self, name: str, seconds: float, buckets: tuple[float, ...] = LATENCY_BUCKETS, **labels):
+        """レイテンシを記録する (累積ヒストグラム)"""
+        for bound in buckets:
+            if seconds <= bound:
+                self._add(_series_key(f"{name}_bucket", {**labels, "le": bound}), 1)
+        self._add(_series_key(f"{name}_bucket", {**labels, "le": "+Inf"}), 1)
+        self._add(_series_key(f"{name}_sum", labels), seconds)
+        self._add(_series_key(f"{name}_count", labels), 1)
+        self._maybe_flush()
+
+    def _add(self, key: str, value: float):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+            self._pending[key] = self._pending.get(key, 0.0) + value
+
+    def _maybe_flush(self):
+        if time.monotonic() - self._flushed_at >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self) -> bool:
+        """未送信の差分を Redis に加算する。Redis に繋がらない場合は False (差分は手元に残す)"""
+        from app.utils.redis_client import get_redis
+
+        self._flushed_at = time.monotonic()
+        client = get_redis()
+        if client is None:
+            return False
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return True
+        try:
+            pipe = client.pipeline()
+            for key, value in pending.items():
+                pipe.hincrbyfloat(REDIS_METRICS_KEY, key, value)
+            pipe.execute()
+        except Exception:
+            with self._lock:
+                for key, value in pending.items():
+                    self._pending[key] = self._pending.get(key, 0.0) + value
+            return False
+        return True
+
+    def values(self) -> dict[str, float]:
+        """全プロセスの合計 (Redis がなければこのプロセスの値)"""
+        if self.flush():
+            from app.utils.redis_client import get_redis
+
+            try:
+                raw = get_redis().hgetall(REDIS_METRICS_KEY)
+                return {
+                    (k.decode() if isinstance(k, bytes) else k): float(v)
+                    for k, v in raw.items()
+                }
+            except Exception:
+                pass
+        with self._lock:
+            return dict(self._values)
+
+    def snapshot(self) -> list[dict]:
+        """[{name, labels, value}] の一覧 (名前・ラベル順)"""
+        series = []
+        for key, value in self.values().items():
+            name, labels = _parse_key(key)
+            series.append({"name": name, "labels": labels, "value": value})
+        series.sort(key=lambda s: (s["name"], sorted(s["labels"].items())))
+        return series
+
+    def render_prometheus(self) -> str:
+        """Prometheus のテキスト形式"""
+        lines = []
+        for series in self.snapshot():
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(series["labels"].items()))
+            value = series["value"]
+            text = str(int(value)) if float(value).is_integer() else repr(value)
+            lines.append(f"{series['name']}{{{labels}}} {text}" if labels else f"{series['name']} {text}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+            self._pending.clear()
+
+
+metrics = MetricsRegistry()
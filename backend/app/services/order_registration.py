@@ -89,6 +89,9 @@ FIELD_MAPPING = {
     "再委託": "subcontracting_tier_limit",
 }
 
+# テンプレートで直接指定できるDB用フィールド名
+CANONICAL_FIELDS = frozenset(FIELD_MAPPING.values())
+
 
 def _parse_date(value: str) -> date | None:
     """日付文字列をパースする。複数フォーマットに対応。"""
@@ -117,14 +120,18 @@ def _parse_int(value: str) -> int | None:
 
 
 def _normalize_fields(raw: dict[str, str]) -> dict[str, str]:
-    """Excel解析結果のキーをDB用フィールド名に正規化する。"""
+    """Excel解析結果のキーをDB用フィールド名に正規化する。
+
+    テンプレートのマッピングで既にDB用フィールド名になっているキーはそのまま使う。
+    """
     normalized = {}
     for key, value in raw.items():
-        field_name = FIELD_MAPPING.get(key.strip())
+        key = key.strip()
+        field_name = key if key in CANONICAL_FIELDS else FIELD_MAPPING.get(key)
         if field_name and value:
             # 同じフィールドが複数マッチした場合は先勝ち
             if field_name not in normalized:
-                normalized[field_name] = value.strip()
+                normalized[field_name] = str(value).strip()
     return normalized
 
 
@@ -149,6 +156,8 @@ def register_order_from_job(db: Session, job: ProcessingJob) -> dict:
     """
     承認済みジョブのExcel解析結果から案件・見積・発注を自動登録する。
 
+    コミットはしない (呼び出し側がステップの完了記録と同じトランザクションでコミットする)。
+
     Returns:
         作成されたレコードの情報を含む辞書
     """
@@ -257,7 +266,7 @@ def register_order_from_job(db: Session, job: ProcessingJob) -> dict:
             status="completed",
             message=f"案件を作成しました（エンジニア未割当のため見積・発注はスキップ）: {project.name}",
         ))
-        db.commit()
+        db.flush()
         created["quotation"] = None
         created["order"] = None
         return created
@@ -299,6 +308,6 @@ def register_order_from_job(db: Session, job: ProcessingJob) -> dict:
             f"見積(ID:{quotation.id}), 発注({order_number})"
         ),
     ))
-    db.commit()
+    db.flush()
 
     return created
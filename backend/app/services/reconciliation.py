@@ -2,13 +2,15 @@
 import csv
 import io
 import re
+import time
 import unicodedata
 from datetime import date, datetime
 
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, literal, or_
+from sqlalchemy.orm import Session, joinedload
 
 from app.models.invoice import Invoice, InvoiceStatus
-from app.models.payment import Payment, PaymentStatus
+from app.models.payment import Payment, PaymentAllocation, PaymentStatus
 
 
 # ---------------------------------------------------------------------------
@@ -50,6 +52,12 @@ _COMPANY_PREFIXES = [
     "合同会社",
 ]
 
+# 組み合わせ照合 (一括入金・分割入金) の探索上限
+_COMBINATION_MAX_ITEMS = 6  # 1つの組み合わせに含める最大件数
+_COMBINATION_MAX_CANDIDATES = 40  # 取引先ごとに探索対象とする最大件数
+_COMBINATION_SEARCH_BUDGET = 0.05  # 秒: 1回の部分和探索の時間予算
+_COMBINATION_TOTAL_BUDGET = 2.0  # 秒: 1回の自動消込における組み合わせ照合全体の時間予算
+
 
 def _levenshtein_distance(s1: str, s2: str) -> int:
     """Calculate the Levenshtein (edit) distance between two strings."""
@@ -152,14 +160,18 @@ def parse_bank_csv(content: str) -> list[dict]:
 
 def auto_match_payments(db: Session, payments: list[Payment]) -> list[dict]:
     """未消込の入金を請求書に自動マッチングする。"""
-    from sqlalchemy.orm import joinedload
-
+    # 別の入金と照合済み(未確定)の請求書は候補から外す。
+    # イベント単位で呼ばれるため、前回までの照合結果をここで考慮する必要がある。
     unpaid_invoices = (
         db.query(Invoice)
         .options(
             joinedload(Invoice.contract),
         )
-        .filter(Invoice.status.in_([InvoiceStatus.sent, InvoiceStatus.overdue]))
+        .filter(
+            Invoice.status.in_([InvoiceStatus.sent, InvoiceStatus.overdue]),
+            ~Invoice.payments.any(Payment.status == PaymentStatus.matched),
+            ~Invoice.allocations.any(PaymentAllocation.payment.has(Payment.status == PaymentStatus.matched)),
+        )
         .all()
     )
 
@@ -200,10 +212,371 @@ def auto_match_payments(db: Session, payments: list[Payment]) -> list[dict]:
                 "status": "unmatched",
             })
 
+    if any(r["status"] == "unmatched" for r in results):
+        _match_combinations(db, payments, unpaid_invoices, matched_invoice_ids, results)
+
     db.commit()
     return results
 
 
+def _match_combinations(
+    db: Session,
+    payments: list[Payment],
+    invoices: list[Invoice],
+    matched_invoice_ids: set[int],
+    results: list[dict],
+) -> None:
+    """1:1で照合できなかった入金を、同一取引先内の組み合わせで照合する。
+
+    - 一括入金: 1件の入金 = 複数の未入金請求書の合計
+    - 分割入金: 複数の未消込入金の合計 = 1件の請求書
+
+    取引先は振込人名から推定し、探索は取引先ごとの候補に限定する。
+    結果は results を更新して返す。
+    """
+    deadline = time.monotonic() + _COMBINATION_TOTAL_BUDGET
+
+    invoices_by_company: dict[int, list[Invoice]] = {}
+    company_names: dict[int, str] = {}
+    for invoice in invoices:
+        if invoice.id in matched_invoice_ids:
+            continue
+        company = _invoice_client_company(invoice)
+        if company is None:
+            continue
+        invoices_by_company.setdefault(company.id, []).append(invoice)
+        company_names[company.id] = company.name
+    if not invoices_by_company:
+        return
+
+    result_by_payment = {r["payment_id"]: r for r in results}
+    resolved_payers: dict[str, int | None] = {}
+
+    for payment in payments:
+        if time.monotonic() > deadline:
+            break
+        result = result_by_payment.get(payment.id)
+        if result is None or result["status"] != "unmatched" or payment.status != PaymentStatus.unmatched:
+            continue
+
+        company_id = _resolve_payer_company(payment.payer_name, company_names)
+        if company_id is None:
+            continue
+        name_score = _name_match_score(payment.payer_name, company_names[company_id])
+        open_invoices = sorted(
+            (inv for inv in invoices_by_company[company_id] if inv.id not in matched_invoice_ids),
+            key=lambda inv: (inv.billing_month, inv.id),
+        )[:_COMBINATION_MAX_CANDIDATES]
+
+        # 一括入金: 入金額 = 複数請求書の合計
+        invoice_ids = _search_subset(
+            payment.amount,
+            [(inv.id, inv.total_amount) for inv in open_invoices],
+            min_items=2,
+            max_items=_COMBINATION_MAX_ITEMS,
+            deadline=deadline,
+        )
+        if invoice_ids:
+            chosen = [inv for inv in open_invoices if inv.id in set(invoice_ids)]
+            payment.invoice_id = chosen[0].id
+            payment.status = PaymentStatus.matched
+            for inv in chosen:
+                db.add(PaymentAllocation(payment_id=payment.id, invoice_id=inv.id, amount=inv.total_amount))
+                matched_invoice_ids.add(inv.id)
+            result.update({
+                "invoice_id": chosen[0].id,
+                "invoice_number": chosen[0].invoice_number,
+                "invoice_ids": [inv.id for inv in chosen],
+                "score": min(50 + name_score, 100),
+                "status": "matched",
+                "match_type": "combination",
+            })
+            continue
+
+        # 分割入金: 請求額 = この入金 + 同じ取引先からの他の未消込入金の合計
+        ceiling = max((inv.total_amount for inv in open_invoices), default=0) - payment.amount
+        if ceiling <= 0:
+            continue
+        partners = _outstanding_partners(db, payment, company_id, company_names, ceiling, resolved_payers)
+        if not partners:
+            continue
+
+        for invoice in open_invoices:
+            if invoice.total_amount <= payment.amount:
+                continue
+            partner_ids = _search_subset(
+                invoice.total_amount - payment.amount,
+                [(p.id, p.amount) for p in partners],
+                min_items=1,
+                max_items=_COMBINATION_MAX_ITEMS - 1,
+                deadline=deadline,
+            )
+            if not partner_ids:
+                continue
+
+            group = [payment] + [p for p in partners if p.id in set(partner_ids)]
+            group.sort(key=lambda p: (p.payment_date, p.id))
+            for i, p in enumerate(group, start=1):
+                p.invoice_id = invoice.id
+                p.status = PaymentStatus.matched
+                if not p.notes:
+                    p.notes = f"分割入金 {i}/{len(group)}: {invoice.invoice_number}"
+            matched_invoice_ids.add(invoice.id)
+
+            payment_ids = [p.id for p in group]
+            for p in group:
+                split_result = result_by_payment.get(p.id)
+                if split_result is None:
+                    continue
+                split_result.update({
+                    "invoice_id": invoice.id,
+                    "invoice_number": invoice.invoice_number,
+                    "payment_ids": payment_ids,
+                    "score": min(50 + name_score, 100),
+                    "status": "matched",
+                    "match_type": "split",
+                })
+            break
+
+
+def _search_subset(
+    target: int,
+    items: list[tuple[int, int]],
+    min_items: int,
+    max_items: int,
+    deadline: float,
+) -> list[int] | None:
+    """時間予算付きで部分和探索を行う。予算超過・曖昧な場合は None。"""
+    search_deadline = min(time.monotonic() + _COMBINATION_SEARCH_BUDGET, deadline)
+    try:
+        return _find_subset_sum(target, items, min_items=min_items, max_items=max_items, deadline=search_deadline)
+    except _SearchBudgetExceeded:
+        return None
+
+
+class _SearchBudgetExceeded(Exception):
+    pass
+
+
+def _find_subset_sum(
+    target: int,
+    items: list[tuple[int, int]],
+    min_items: int = 2,
+    max_items: int = _COMBINATION_MAX_ITEMS,
+    deadline: float | None = None,
+) -> list[int] | None:
+    """合計が target と一致する (key, amount) の組み合わせを探し、key のリストを返す。
+
+    Meet-in-the-middle: 候補を前半・後半に分け、それぞれで件数 max_items 以下かつ
+    合計 target 以下の部分和を列挙 (昇順ソート済みなので超過した時点で枝刈り) し、
+    後半の部分和 s ごとに前半の target - s を辞書で引く。
+    件数が最小の解が一意に決まらない場合は誤消込を避けるため None を返す。
+    deadline (time.monotonic) を超えると _SearchBudgetExceeded を送出する。
+    """
+    candidates = sorted(((key, amount) for key, amount in items if 0 < amount <= target), key=lambda x: x[1])
+    if len(candidates) < min_items:
+        return None
+
+    steps = 0
+
+    def enumerate_sums(half: list[tuple[int, int]]) -> dict[int, list[tuple[int, ...]]]:
+        # 部分和 → その和になる組み合わせ (件数の少ない順に最大2つ)
+        sums: dict[int, list[tuple[int, ...]]] = {}
+
+        def walk(start: int, total: int, chosen: tuple[int, ...]) -> None:
+            nonlocal steps
+            steps += 1
+            if deadline is not None and steps % 1024 == 0 and time.monotonic() > deadline:
+                raise _SearchBudgetExceeded()
+            bucket = sums.setdefault(total, [])
+            if len(bucket) < 2 or len(chosen) < len(bucket[-1]):
+                bucket.append(chosen)
+                bucket.sort(key=len)
+                del bucket[2:]
+            if len(chosen) >= max_items:
+                return
+            for i in range(start, len(half)):
+                key, amount = half[i]
+                if total + amount > target:
+                    break
+                walk(i + 1, total + amount, chosen + (key,))
+
+        walk(0, 0, ())
+        return sums
+
+    mid = len(candidates) // 2
+    left_sums = enumerate_sums(candidates[:mid])
+    right_sums = enumerate_sums(candidates[mid:])
+
+    solutions: list[tuple[int, ...]] = []
+    for right_total, right_subsets in right_sums.items():
+        left_subsets = left_sums.get(target - right_total)
+        if not left_subsets:
+            continue
+        for right in right_subsets:
+            for left in left_subsets:
+                combo = left + right
+                if min_items <= len(combo) <= max_items:
+                    solutions.append(combo)
+
+    if not solutions:
+        return None
+    solutions.sort(key=len)
+    if len(solutions) > 1 and len(solutions[1]) == len(solutions[0]):
+        return None
+    return list(solutions[0])
+
+
+def _invoice_client_company(invoice: Invoice):
+    """請求書の請求先 (案件のクライアント企業) を返す。"""
+    contract = invoice.contract
+    if contract and contract.project and contract.project.client_company:
+        return contract.project.client_company
+    return None
+
+
+def _resolve_payer_company(payer_name: str | None, company_names: dict[int, str]) -> int | None:
+    """振込人名から取引先を推定する。スコア20点以上で一意に決まる場合のみ企業IDを返す。"""
+    if not payer_name:
+        return None
+    best_id = None
+    best_score = 0
+    tie = False
+    for company_id, company_name in company_names.items():
+        score = _name_match_score(payer_name, company_name)
+        if score > best_score:
+            best_id, best_score, tie = company_id, score, False
+        elif score == best_score and score > 0:
+            tie = True
+    if best_score < 20 or tie:
+        return None
+    return best_id
+
+
+def _outstanding_partners(
+    db: Session,
+    payment: Payment,
+    company_id: int,
+    company_names: dict[int, str],
+    ceiling: int,
+    resolved_payers: dict[str, int | None],
+) -> list[Payment]:
+    """分割入金の相方になり得る、同じ取引先からの未消込入金を返す。
+
+    未消込の入金全体は読まず、金額が ceiling 以下のものに DB 側で絞る
+    (payments.status, amount のインデックスを使用)。振込人名の推定 (あいまい一致) は
+    その範囲の振込人名ごとに1回だけ行い、取引先が一致した振込人名で入金を取得する。
+    """
+    # この回の照合で消込済みにした入金を DB 側の絞り込みに反映する
+    db.flush()
+    in_range = and_(
+        Payment.status == PaymentStatus.unmatched,
+        Payment.amount > 0,
+        Payment.amount <= ceiling,
+        Payment.id != payment.id,
+    )
+    payer_names = [
+        name for (name,) in (
+            db.query(Payment.payer_name)
+            .filter(in_range, Payment.payer_name.isnot(None))
+            .distinct()
+        )
+    ]
+    for name in payer_names:
+        if name not in resolved_payers:
+            resolved_payers[name] = _resolve_payer_company(name, company_names)
+    names = [name for name in payer_names if resolved_payers[name] == company_id]
+    if not names:
+        return []
+    return (
+        db.query(Payment)
+        .filter(in_range, Payment.payer_name.in_(names))
+        .order_by(Payment.payment_date, Payment.id)
+        .limit(_COMBINATION_MAX_CANDIDATES)
+        .all()
+    )
+
+
+def match_new_payments(db: Session, payment_ids: list[int]) -> list[dict]:
+    """取り込まれた入金だけを対象に自動マッチングする。
+
+    未消込の入金全体を再処理せず、イベントで渡された入金IDのみを照合する。
+    """
+    if not payment_ids:
+        return []
+
+    payments = (
+        db.query(Payment)
+        .filter(Payment.id.in_(payment_ids), Payment.status == PaymentStatus.unmatched)
+        .order_by(Payment.id)
+        .all()
+    )
+    if not payments:
+        return []
+    return auto_match_payments(db, payments)
+
+
+def match_sent_invoice(db: Session, invoice_id: int) -> dict | None:
+    """送付済みになった請求書を、未消込の入金と照合する。
+
+    スコア50点以上になり得るのは「金額が1%以内」または「参照番号が一致」する入金のみのため、
+    その条件で候補をDB側で絞り込み (payments.status, amount のインデックスを使用)、
+    候補の入金だけをスコアリングする。
+    """
+    invoice = (
+        db.query(Invoice)
+        .options(joinedload(Invoice.contract))
+        .filter(Invoice.id == invoice_id)
+        .first()
+    )
+    if not invoice or invoice.status not in (InvoiceStatus.sent, InvoiceStatus.overdue):
+        return None
+    if any(p.status == PaymentStatus.matched for p in invoice.payments):
+        return None
+    if any(a.payment.status == PaymentStatus.matched for a in invoice.allocations):
+        return None
+
+    tolerance = int(invoice.total_amount * 0.01)
+    conditions = [
+        Payment.amount.between(invoice.total_amount - tolerance, invoice.total_amount + tolerance),
+    ]
+    if invoice.invoice_number:
+        conditions.append(Payment.reference_number.contains(invoice.invoice_number, autoescape=True))
+        conditions.append(and_(
+            Payment.reference_number != "",
+            literal(invoice.invoice_number).contains(Payment.reference_number),
+        ))
+
+    candidates = (
+        db.query(Payment)
+        .filter(Payment.status == PaymentStatus.unmatched, or_(*conditions))
+        .order_by(Payment.payment_date, Payment.id)
+        .all()
+    )
+
+    best_match = None
+    best_score = 0
+    for payment in candidates:
+        score = _calculate_match_score(payment, invoice)
+        if score > best_score:
+            best_score = score
+            best_match = payment
+
+    if not best_match or best_score < 50:
+        return None
+
+    best_match.invoice_id = invoice.id
+    best_match.status = PaymentStatus.matched
+    db.commit()
+    return {
+        "payment_id": best_match.id,
+        "invoice_id": invoice.id,
+        "invoice_number": invoice.invoice_number,
+        "score": best_score,
+        "status": "matched",
+    }
+
+
 def confirm_match(db: Session, payment_id: int) -> Payment:
     """マッチングを確定し、請求書を入金済みにする。"""
     payment = db.query(Payment).filter(Payment.id == payment_id).first()
@@ -214,8 +587,10 @@ def confirm_match(db: Session, payment_id: int) -> Payment:
 
     payment.status = PaymentStatus.confirmed
 
-    invoice = db.query(Invoice).filter(Invoice.id == payment.invoice_id).first()
-    if invoice:
+    # 一括入金の場合は割当先の請求書すべてを入金済みにする
+    invoice_ids = {payment.invoice_id} | {a.invoice_id for a in payment.allocations}
+    invoices = db.query(Invoice).filter(Invoice.id.in_(invoice_ids)).all()
+    for invoice in invoices:
         invoice.status = InvoiceStatus.paid
         invoice.paid_at = datetime.utcnow()
 
@@ -283,37 +658,10 @@ def _calculate_match_score(payment: Payment, invoice: Invoice) -> int:
         score += 30  # 1%以内の誤差
 
     # 振込人名に企業名が含まれる (30点)
-    name_score = 0
-    if payment.payer_name and invoice.contract:
-        company_name = None
-        if invoice.contract.project and invoice.contract.project.client_company:
-            company_name = invoice.contract.project.client_company.name
-
-        if company_name:
-            payer = payment.payer_name.upper()
-
-            # Exact / substring match (best: 30 points)
-            if company_name in payer or company_name.upper() in payer:
-                name_score = 30
-            elif any(part in payer for part in company_name.split()):
-                name_score = 15
-
-            # Fuzzy match on normalized names (if no exact match yet)
-            if name_score < 30:
-                norm_payer = _normalize_company_name(payment.payer_name)
-                norm_company = _normalize_company_name(company_name)
-                if norm_payer and norm_company:
-                    # Exact match after normalization
-                    if norm_payer == norm_company:
-                        name_score = 30
-                    else:
-                        ratio = _similarity_ratio(norm_payer, norm_company)
-                        if ratio >= 0.7:
-                            name_score = max(name_score, 20)
-                        elif ratio >= 0.5:
-                            name_score = max(name_score, 10)
-
-    score += min(name_score, 30)
+    if payment.payer_name:
+        company = _invoice_client_company(invoice)
+        if company and company.name:
+            score += _name_match_score(payment.payer_name, company.name)
 
     # 参照番号に請求番号が含まれる (20点)
     if payment.reference_number and invoice.invoice_number:
@@ -323,3 +671,32 @@ def _calculate_match_score(payment: Payment, invoice: Invoice) -> int:
             score += 20
 
     return min(score, 100)
+
+
+def _name_match_score(payer_name: str, company_name: str) -> int:
+    """振込人名と企業名の一致度スコアを計算(0-30)。"""
+    name_score = 0
+    payer = payer_name.upper()
+
+    # Exact / substring match (best: 30 points)
+    if company_name in payer or company_name.upper() in payer:
+        name_score = 30
+    elif any(part in payer for part in company_name.split()):
+        name_score = 15
+
+    # Fuzzy match on normalized names (if no exact match yet)
+    if name_score < 30:
+        norm_payer = _normalize_company_name(payer_name)
+        norm_company = _normalize_company_name(company_name)
+        if norm_payer and norm_company:
+            # Exact match after normalization
+            if norm_payer == norm_company:
+                name_score = 30
+            else:
+                ratio = _similarity_ratio(norm_payer, norm_company)
+                if ratio >= 0.7:
+                    name_score = max(name_score, 20)
+                elif ratio >= 0.5:
+                    name_score = max(name_score, 10)
+
+    return min(name_score, 30)
@@ -0,0 +1,545 @@
+"""振り分けルール: RoutingRule をコンパイルして発注データの振り分け先を判定する
+
+workers.routing_engine (解析後の振り分け) と mcp_executor (承認後のWeb入力) で共有する。
+有効な RoutingRule はプロセス内で判定用の構造にコンパイルしてキャッシュし、
+ジョブごとにルールをDBから読み直さない。ルールが変更されるとバージョンカウンタが進み、
+次の判定時にコンパイルし直す。
+"""
+import math
+import time
+from bisect import bisect_right
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Callable, Iterable
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.models.automation import RoutingRule
+from app.services.metrics import metrics
+from app.services.order_registration import CANONICAL_FIELDS, FIELD_MAPPING
+
+# ルール変更のたびに INCR する Redis のキー (他プロセスでの変更を検知するため)
+RULES_VERSION_KEY = "routing_rules:version"
+# バージョンの変化を検知できない変更 (一括UPDATEなど) に備え、この秒数でコンパイルし直す
+RULES_MAX_AGE = 60.0
+# 他プロセスでの変更 (Redis上のバージョン) を確認する間隔 (秒)
+RULES_VERSION_CHECK_INTERVAL = 1.0
+
+# 振り分け条件が参照するフィールドと、発注データ側で探すキー (先に見つかったものを使う)
+# 日本語の列名は FIELD_MAPPING でDB用フィールド名にしてから探す
+ROUTING_FIELDS = {
+    "vendor_name": ("vendor_name", "company_name"),
+    "category": ("category", "project_description"),
+    "amount": ("amount", "unit_price", "budget"),
+    "description": ("description", "project_description", "project_name"),
+}
+_ROUTING_KEYS = frozenset(key for keys in ROUTING_FIELDS.values() for key in keys)
+
+# 一覧を一括振り分けするときに1度に判定する件数
+ROUTING_BATCH_SIZE = 500
+
+# このプロセス内で検知したルール変更の回数
+_local_version = 0
+# コンパイル済みルールのプロセス内キャッシュ
+_cache: dict = {"version": None, "compiled": None, "loaded_at": 0.0, "checked_at": 0.0}
+
+
+@dataclass(frozen=True)
+class CompiledRule:
+    id: int
+    name: str
+    condition_type: str
+    condition_value: str
+    target_system: str
+    priority: int
+
+
+class _PatternAutomaton:
+    """複数の部分文字列パターンを1回の走査で照合する Aho-Corasick オートマトン
+
+    各パターンにはルールの順位 (小さいほど優先) を持たせ、テキストに含まれる
+    パターンのうち最も優先度の高い順位を返す。
+    """
+
+    def __init__(self, patterns: list[tuple[str, int]]):
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail: list[int] = [0]
+        self.best: list[int | None] = [None]
+        self.always: int | None = None
+
+        for pattern, rank in patterns:
+            if not pattern:
+                # 空文字列はどのテキストにも含まれる
+                self.always = rank if self.always is None else min(self.always, rank)
+                continue
+            node = 0
+            for char in pattern:
+                nxt = self.goto[node].get(char)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][char] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.best.append(None)
+                node = nxt
+            self.best[node] = rank if self.best[node] is None else min(self.best[node], rank)
+
+        # 幅優先で失敗遷移を張り、失敗先で一致するパターンの順位も引き継ぐ
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                inherited = self.best[self.fail[child]]
+                if inherited is not None and (self.best[child] is None or inherited < self.best[child]):
+                    self.best[child] = inherited
+
+    def __bool__(self) -> bool:
+        return self.always is not None or len(self.goto) > 1
+
+    def first_match(self, text: str) -> int | None:
+        """テキストに含まれるパターンのうち最も優先度の高い順位"""
+        best = self.always
+        goto, fail, ranks = self.goto, self.fail, self.best
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            rank = ranks[node]
+            if rank is not None and (best is None or rank < best):
+                best = rank
+                if best == 0:
+                    break
+        return best
+
+
+class _Thresholds:
+    """amount_gte / amount_lt の閾値を昇順に並べ、二分探索で一致するルールの最高順位を求める"""
+
+    def __init__(self, thresholds: list[tuple[float, int]], greater_equal: bool):
+        thresholds = sorted(thresholds)
+        self.values = [value for value, _ in thresholds]
+        self.greater_equal = greater_equal
+        # gte: 閾値 <= 金額 のルール (先頭からの区間) → 累積最小
+        # lt : 閾値 >  金額 のルール (末尾までの区間) → 末尾からの累積最小
+        ranks = [rank for _, rank in thresholds]
+        self.best: list[int] = []
+        if greater_equal:
+            for rank in ranks:
+                self.best.append(rank if not self.best else min(self.best[-1], rank))
+        else:
+            for rank in reversed(ranks):
+                self.best.append(rank if not self.best else min(self.best[-1], rank))
+            self.best.reverse()
+
+    def __bool__(self) -> bool:
+        return bool(self.values)
+
+    def first_match(self, amount: float) -> int | None:
+        if self.greater_equal:
+            idx = bisect_right(self.values, amount)
+            return self.best[idx - 1] if idx else None
+        idx = bisect_right(self.values, amount)
+        return self.best[idx] if idx < len(self.values) else None
+
+
+class CompiledRuleSet:
+    """優先度順のルールを条件種別ごとの判定構造にまとめたもの
+
+    - vendor_name / category: 値 → 最高順位 の辞書
+    - amount_gte / amount_lt: 閾値の昇順配列と累積最小順位 (二分探索)
+    - vendor_name_contains / keyword: 部分文字列の Aho-Corasick オートマトン
+    各構造で一致した順位の最小値 (= 優先度順に評価して最初に一致するルール) を採用する。
+    """
+
+    def __init__(self, rules: list[CompiledRule]):
+        self.rules = rules
+        self.vendor_names: dict[str, int] = {}
+        self.categories: dict[str, int] = {}
+        gte: list[tuple[float, int]] = []
+        lt: list[tuple[float, int]] = []
+        vendor_patterns: list[tuple[str, int]] = []
+        keyword_patterns: list[tuple[str, int]] = []
+
+        for rank, rule in enumerate(rules):
+            ctype, cval = rule.condition_type, rule.condition_value
+            if ctype == "vendor_name":
+                self.vendor_names.setdefault(cval, rank)
+            elif ctype == "category":
+                self.categories.setdefault(cval, rank)
+            elif ctype in ("amount_gte", "amount_lt"):
+                try:
+                    threshold = float(cval)
+                except (TypeError, ValueError):
+                    continue  # 数値でない閾値のルールは一致しない
+                (gte if ctype == "amount_gte" else lt).append((threshold, rank))
+            elif ctype == "vendor_name_contains":
+                vendor_patterns.append((cval, rank))
+            elif ctype == "keyword":
+                keyword_patterns.append((cval, rank))
+
+        self.amount_gte = _Thresholds(gte, greater_equal=True)
+        self.amount_lt = _Thresholds(lt, greater_equal=False)
+        self.vendor_contains = _PatternAutomaton(vendor_patterns)
+        self.keywords = _PatternAutomaton(keyword_patterns)
+
+    def match(self, fields: dict) -> CompiledRule | None:
+        """正規化済みのフィールド (routing_fields の戻り値) に最初に一致するルール (優先度順)"""
+        candidates = []
+        vendor = fields["vendor_name"]
+        candidates.append(self.vendor_names.get(vendor))
+        if self.vendor_contains:
+            candidates.append(self.vendor_contains.first_match(vendor))
+        candidates.append(self.categories.get(fields["category"]))
+        amount = fields["amount"]
+        if amount is not None:
+            if self.amount_gte:
+                candidates.append(self.amount_gte.first_match(amount))
+            if self.amount_lt:
+                candidates.append(self.amount_lt.first_match(amount))
+        if self.keywords:
+            candidates.append(self.keywords.first_match(fields["description"]))
+
+        ranks = [rank for rank in candidates if rank is not None]
+        return self.rules[min(ranks)] if ranks else None
+
+    def match_batch(self, fields_list: list[dict]) -> list[CompiledRule | None]:
+        """複数件の正規化済みフィールドをまとめて判定する
+
+        列 (フィールド) ごとに各判定構造を1回ずつ適用し、同じ値は1度だけ評価する
+        (一覧では発注先や単価が繰り返し現れるため)。結果は match を1件ずつ呼んだ場合と同じ。
+        """
+        ranks: list[int | None] = [None] * len(fields_list)
+
+        def merge(column: Iterable[int | None]):
+            for idx, rank in enumerate(column):
+                if rank is not None and (ranks[idx] is None or rank < ranks[idx]):
+                    ranks[idx] = rank
+
+        vendors = [f["vendor_name"] for f in fields_list]
+        if self.vendor_names:
+            merge(map(self.vendor_names.get, vendors))
+        if self.vendor_contains:
+            merge(_memoized(self.vendor_contains.first_match, vendors))
+        if self.categories:
+            merge(map(self.categories.get, (f["category"] for f in fields_list)))
+        if self.amount_gte or self.amount_lt:
+            amounts = [f["amount"] for f in fields_list]
+            for thresholds in (self.amount_gte, self.amount_lt):
+                if thresholds:
+                    merge(_memoized(thresholds.first_match, amounts))
+        if self.keywords:
+            merge(_memoized(self.keywords.first_match, [f["description"] for f in fields_list]))
+
+        return [self.rules[rank] if rank is not None else None for rank in ranks]
+
+
+def _memoized(func: Callable, values: list) -> list:
+    """値ごとに1度だけ func を呼ぶ (None はどのルールにも一致しない)"""
+    cache = {None: None}
+    results = []
+    for value in values:
+        if value in cache:
+            results.append(cache[value])
+        else:
+            results.append(cache.setdefault(value, func(value)))
+    return results
+
+
+@dataclass
+class RoutingBatch:
+    """一括振り分けの結果"""
+
+    targets: list[str | None]
+    hits: Counter = field(default_factory=Counter)  # ルールID → 一致件数
+
+    @property
+    def unmatched(self) -> int:
+        return sum(1 for target in self.targets if target is None)
+
+    def extend(self, other: "RoutingBatch"):
+        self.targets.extend(other.targets)
+        self.hits.update(other.hits)
+
+    def to_dict(self) -> dict:
+        return {"hits": {str(rule_id): count for rule_id, count in self.hits.items()}, "unmatched": self.unmatched}
+
+
+def _to_amount(value) -> float | int | None:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        cleaned = value.replace(",", "").replace("¥", "").replace("￥", "").replace("円", "").strip()
+        try:
+            value = float(cleaned)
+        except ValueError:
+            return None
+    if isinstance(value, float):
+        # "nan" / "inf" はどの金額条件とも比較できないため、数値にできない金額と同じ扱いにする
+        return value if math.isfinite(value) else None
+    return None
+
+
+def routing_fields(order_data: dict) -> dict:
+    """発注データを振り分け条件のフィールド (vendor_name / category / amount / description) に正規化する
+
+    英語のフィールド名・DB用フィールド名・日本語の列名のいずれで渡されても同じ結果になる。
+    金額がない場合は 0 とみなす (金額未満のルールに一致する)。数値にできない金額は None。
+    """
+    canonical = {}
+    for key, value in order_data.items():
+        key = str(key).strip()
+        name = key if key in _ROUTING_KEYS or key in CANONICAL_FIELDS else FIELD_MAPPING.get(key)
+        if name is not None and value is not None and name not in canonical:
+            canonical[name] = value
+
+    fields = {}
+    for field, keys in ROUTING_FIELDS.items():
+        fields[field] = next((canonical[key] for key in keys if key in canonical), None)
+    fields["amount"] = _to_amount(fields["amount"]) if fields["amount"] is not None else 0
+    for field in ("vendor_name", "category", "description"):
+        value = fields[field]
+        fields[field] = "" if value is None else value.strip() if isinstance(value, str) else str(value)
+    return fields
+
+
+def _load_rules(db: Session) -> list[CompiledRule]:
+    rules = (
+        db.query(RoutingRule)
+        .filter(RoutingRule.is_active.is_(True))
+        .order_by(RoutingRule.priority.asc(), RoutingRule.id.asc())
+        .all()
+    )
+    return [
+        CompiledRule(r.id, r.name, r.condition_type, r.condition_value, r.target_system.value, r.priority)
+        for r in rules
+    ]
+
+
+def rules_version() -> tuple[int, int | None]:
+    """ルールのバージョン (このプロセスでの変更回数, Redis上の変更回数)。Redisに繋がらない場合は後者が None"""
+    from app.utils.redis_client import get_redis
+
+    client = get_redis()
+    remote = None
+    if client is not None:
+        try:
+            remote = int(client.get(RULES_VERSION_KEY) or 0)
+        except Exception:
+            remote = None
+    return _local_version, remote
+
+
+def invalidate_rules() -> None:
+    """ルールの変更を通知し、全プロセスのコンパイル済みルールを無効にする"""
+    global _local_version
+    _local_version += 1
+    from app.utils.redis_client import get_redis
+
+    client = get_redis()
+    if client is not None:
+        try:
+            client.incr(RULES_VERSION_KEY)
+        except Exception:
+            pass
+
+
+def get_compiled_rules(db: Session) -> CompiledRuleSet:
+    """コンパイル済みルールを返す。バージョンが変わったか RULES_MAX_AGE を過ぎた場合のみDBから読み直す
+
+    このプロセスでの変更はすぐに反映し、Redis上のバージョンは RULES_VERSION_CHECK_INTERVAL 秒に1回だけ確認する
+    (1件ずつの振り分けが続いても、そのたびに Redis へ問い合わせない)。
+    """
+    now = time.monotonic()
+    if (
+        _cache["compiled"] is not None
+        and _cache["version"][0] == _local_version
+        and now - _cache["checked_at"] < RULES_VERSION_CHECK_INTERVAL
+        and now - _cache["loaded_at"] <= RULES_MAX_AGE
+    ):
+        return _cache["compiled"]
+    version = rules_version()
+    if _cache["compiled"] is None or _cache["version"] != version or now - _cache["loaded_at"] > RULES_MAX_AGE:
+        _cache["compiled"] = CompiledRuleSet(_load_rules(db))
+        _cache["version"] = version
+        _cache["loaded_at"] = now
+    _cache["checked_at"] = now
+    return _cache["compiled"]
+
+
+# --- ルール変更の検知 (コミットされた時点でバージョンを進める) ---
+
+@event.listens_for(Session, "before_flush")
+def _track_rule_changes(session, flush_context, instances):
+    if any(isinstance(obj, RoutingRule) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info["routing_rules_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_version_on_commit(session):
+    if session.info.pop("routing_rules_changed", False):
+        invalidate_rules()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rule_changes(session):
+    session.info.pop("routing_rules_changed", None)
+
+
+def _record_metrics(compiled: CompiledRuleSet, matched: list[CompiledRule | None], elapsed: float, mode: str):
+    """振り分けのメトリクス: 評価件数、ルールごとの一致 (hit) / 不一致 (miss) 件数、評価時間
+
+    hit は振り分け先を決めたルール。条件に合っても優先度の高いルールに先を越された場合は miss に数える。
+    """
+    hits = Counter(rule.id for rule in matched if rule is not None)
+    total = len(matched)
+    metrics.inc("routing_evaluations_total", total)
+    metrics.inc("routing_unmatched_total", total - sum(hits.values()))
+    metrics.inc_many("routing_rule_hits_total", hits, "rule_id")
+    metrics.inc_many("routing_rule_misses_total", {rule.id: total - hits.get(rule.id, 0) for rule in compiled.rules}, "rule_id")
+    metrics.observe("routing_evaluation_seconds", elapsed, mode=mode)
+    return hits
+
+
+def match_rule(db: Session, order_data: dict) -> CompiledRule | None:
+    """発注データに最初に一致する有効なルール"""
+    compiled = get_compiled_rules(db)
+    started = time.perf_counter()
+    rule = compiled.match(routing_fields(order_data))
+    _record_metrics(compiled, [rule], time.perf_counter() - started, "single")
+    return rule
+
+
+def determine_target(db: Session, order_data: dict) -> str | None:
+    """発注データの振り分け先 ("system_a" / "system_b")。一致するルールがなければ None"""
+    rule = match_rule(db, order_data)
+    return rule.target_system if rule is not None else None
+
+
+def route_batch(db: Session, records: Iterable[dict]) -> RoutingBatch:
+    """複数件の発注データの振り分け先をまとめて判定し、ルールごとの一致件数も返す"""
+    compiled = get_compiled_rules(db)
+    started = time.perf_counter()
+    matched = compiled.match_batch([routing_fields(record) for record in records])
+    hits = _record_metrics(compiled, matched, time.perf_counter() - started, "batch")
+    return RoutingBatch(
+        targets=[rule.target_system if rule is not None else None for rule in matched],
+        hits=hits,
+    )
+
+
+# --- ルール変更のシミュレーション ---
+
+# シミュレーション結果に載せる振り分け先が変わったジョブの件数の上限
+SIMULATION_MAX_CHANGES = 100
+_SIMULATION_CHUNK = 1000
+
+
+def compile_rule_set(rules: Iterable[dict]) -> CompiledRuleSet:
+    """DBに保存していないルール定義 (RoutingRule と同じ項目の辞書) をコンパイルする
+
+    id のないルールには負の仮IDを振る。is_active が偽のルールは除く。
+    """
+    compiled = []
+    for idx, rule in enumerate(rules):
+        if not rule.get("is_active", True):
+            continue
+        rule_id = rule.get("id") if rule.get("id") is not None else -(idx + 1)
+        compiled.append(CompiledRule(
+            rule_id, rule.get("name", ""), rule["condition_type"], rule["condition_value"],
+            str(getattr(rule["target_system"], "value", rule["target_system"])), rule["priority"],
+        ))
+    compiled.sort(key=lambda r: (r.priority, r.id))
+    return CompiledRuleSet(compiled)
+
+
+def _job_order_data(result) -> dict | None:
+    """ジョブの結果から振り分け対象の発注データを取り出す (一覧の親ジョブなどは対象外)"""
+    if not isinstance(result, dict):
+        return None
+    if isinstance(result.get("order_data"), dict):
+        return result["order_data"]
+    if "child_count" in result:
+        return None
+    return result
+
+
+def simulate_routing(db: Session, proposed: CompiledRuleSet, limit: int = 10000,
+                     statuses: list[str] | None = None) -> dict:
+    """過去のジョブ (新しい順に limit 件) を現行ルールと proposed で振り分け、差分を返す"""
+    from app.models.automation import ProcessingJob
+
+    current = get_compiled_rules(db)
+    started = time.perf_counter()
+    query = db.query(ProcessingJob.id, ProcessingJob.result).filter(ProcessingJob.result.isnot(None))
+    if statuses:
+        query = query.filter(ProcessingJob.status.in_(statuses))
+    query = query.order_by(ProcessingJob.id.desc()).limit(limit)
+
+    jobs = 0
+    transitions: Counter = Counter()
+    current_hits: Counter = Counter()
+    proposed_hits: Counter = Counter()
+    current_unmatched = proposed_unmatched = 0
+    changes = []
+
+    def replay(chunk: list[tuple[int, dict]]):
+        nonlocal current_unmatched, proposed_unmatched
+        fields_list = [routing_fields(data) for _, data in chunk]
+        before = current.match_batch(fields_list)
+        after = proposed.match_batch(fields_list)
+        for (job_id, _), old, new in zip(chunk, before, after):
+            old_target = old.target_system if old is not None else None
+            new_target = new.target_system if new is not None else None
+            if old is None:
+                current_unmatched += 1
+            else:
+                current_hits[old.id] += 1
+            if new is None:
+                proposed_unmatched += 1
+            else:
+                proposed_hits[new.id] += 1
+            if old_target != new_target:
+                transitions[f"{old_target or 'manual'} -> {new_target or 'manual'}"] += 1
+                if len(changes) < SIMULATION_MAX_CHANGES:
+                    changes.append({
+                        "job_id": job_id,
+                        "current": old_target,
+                        "proposed": new_target,
+                        "current_rule_id": old.id if old is not None else None,
+                        "proposed_rule_id": new.id if new is not None else None,
+                    })
+
+    chunk = []
+    for job_id, result in query.yield_per(_SIMULATION_CHUNK):
+        data = _job_order_data(result)
+        if data is None:
+            continue
+        jobs += 1
+        chunk.append((job_id, data))
+        if len(chunk) >= _SIMULATION_CHUNK:
+            replay(chunk)
+            chunk = []
+    if chunk:
+        replay(chunk)
+
+    elapsed = time.perf_counter() - started
+    return {
+        "jobs": jobs,
+        "changed": sum(transitions.values()),
+        "transitions": dict(transitions),
+        "current": {"hits": {str(k): v for k, v in current_hits.items()}, "unmatched": current_unmatched},
+        "proposed": {"hits": {str(k): v for k, v in proposed_hits.items()}, "unmatched": proposed_unmatched},
+        "changes": changes,
+        "elapsed_seconds": round(elapsed, 4),
+        "jobs_per_second": round(jobs / elapsed) if elapsed > 0 else None,
+    }
@@ -0,0 +1,99 @@
+"""パイプラインのステップごとの所要時間: processing_step_timings への記録、ヒストグラム、パーセンタイルの集計
+
+ステップの所要時間は1行ずつ DB に残し (GET /jobs/metrics で期間を指定して集計する)、
+同時にプロセス内のヒストグラム job_step_seconds{step, status} にも加算する (/api/metrics)。
+"""
+import math
+from datetime import datetime, timezone
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import Session
+
+from app.models.automation import ProcessingStepTiming
+from app.services.metrics import metrics
+
+STEP_PARSE = "parse"
+STEP_ROUTE = "route"
+STEP_REGISTER = "register"
+STEP_WEB_INPUT = "web_input"
+# 受信 (ジョブ作成) から承認待ちになるまで
+STEP_TO_APPROVAL = "to_pending_approval"
+
+# ステップの所要時間のヒストグラムの上限値 (秒)
+STEP_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0)
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def observe(step: str, started_at: datetime, finished_at: datetime, status: str = "completed") -> float:
+    """ヒストグラム job_step_seconds に加算し、所要時間 (秒) を返す"""
+    seconds = max((finished_at - started_at).total_seconds(), 0.0)
+    metrics.observe("job_step_seconds", seconds, buckets=STEP_BUCKETS, step=step, status=status)
+    return seconds
+
+
+def timing_row(job_id: int, step: str, started_at: datetime, finished_at: datetime,
+               status: str = "completed") -> dict:
+    """processing_step_timings の1行を作り、ヒストグラムに加算する"""
+    seconds = observe(step, started_at, finished_at, status)
+    return {
+        "job_id": job_id,
+        "step": step,
+        "status": status,
+        "started_at": started_at,
+        "finished_at": finished_at,
+        "duration_ms": seconds * 1000,
+    }
+
+
+def record_timings(db: Session, rows: list[dict]):
+    """まとめて INSERT する (コミットは呼び出し側で行う)"""
+    if rows:
+        db.execute(insert(ProcessingStepTiming), rows)
+
+
+def _percentile(values: list[float], p: float) -> float:
+    """percentile_cont と同じ線形補間 (values は昇順)"""
+    position = p * (len(values) - 1)
+    lower, upper = math.floor(position), math.ceil(position)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def step_percentiles(db: Session, since: datetime | None = None) -> list[dict]:
+    """完了したステップの所要時間をステップごとに集計する (件数・平均・最大・PERCENTILES)
+
+    PostgreSQL では percentile_cont を使った1回の集計クエリで求める。
+    percentile_cont のない SQLite ではステップ・所要時間順に読み出して同じ補間で計算する。
+    """
+    t = ProcessingStepTiming
+    conditions = [t.status == "completed"]
+    if since is not None:
+        conditions.append(t.finished_at >= since)
+
+    def _entry(step, count, avg, maximum, values) -> dict:
+        entry = {"step": step, "count": count, "avg_ms": round(avg, 1), "max_ms": round(maximum, 1)}
+        for p, value in zip(PERCENTILES, values):
+            entry[f"p{round(p * 100)}_ms"] = round(value, 1)
+        return entry
+
+    if db.get_bind().dialect.name == "postgresql":
+        rows = db.execute(
+            select(
+                t.step, func.count(), func.avg(t.duration_ms), func.max(t.duration_ms),
+                *[func.percentile_cont(p).within_group(t.duration_ms) for p in PERCENTILES],
+            ).where(*conditions).group_by(t.step).order_by(t.step)
+        ).all()
+        return [_entry(row[0], row[1], float(row[2]), row[3], row[4:]) for row in rows]
+
+    durations: dict[str, list[float]] = {}
+    for step, duration in db.execute(
+        select(t.step, t.duration_ms).where(*conditions).order_by(t.step, t.duration_ms)
+    ):
+        durations.setdefault(step, []).append(duration)
+    return [
+        _entry(step, len(values), sum(values) / len(values), values[-1], [_percentile(values, p) for p in PERCENTILES])
+        for step, values in durations.items()
+    ]
@@ -0,0 +1,191 @@
+"""Webシステムへの入力の流量制限: 振り分け先 (TargetSystem) ごとのトークンバケットと同時実行数の上限
+
+複数のワーカー・API プロセスで上限を共有するため、Redis 上で Lua スクリプトを使って判定する
+(トークンの補充・消費と同時実行枠の確保を1回の呼び出しで原子的に行う)。
+Redis に接続できない環境 (テスト・ローカル) ではプロセス内の LocalLimiter で判定する。
+
+上限を超えた入力は失敗にせず、枠が空くまで WEB_INPUT_MAX_WAIT_SECONDS まで待つ。
+それでも空かない場合は WebInputThrottled を送出し、Celery タスクは時間を置いて再投入する。
+待つのはワーカーだけで、API・Slack のリクエスト処理中は max_wait=0 で確保を試みるだけにし、
+確保できなければジョブを失敗にせずワーカーに任せる (job_steps.defer_to_worker)。
+"""
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator
+
+from app.config import settings
+from app.services.metrics import metrics
+
+# 同時実行枠の有効期限 (秒)。解放されずに終了したプロセスの枠はこの時間で自動的に空く
+LEASE_TTL = 300
+# 同時実行数の上限で待つ場合の確認間隔 (秒)
+CONCURRENCY_POLL_INTERVAL = 0.25
+WAIT_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0)
+
+# KEYS: トークンバケット (hash), 実行中の枠 (sorted set: 有効期限をスコアに持つ)
+# ARGV: rate_per_second, burst, max_concurrency, lease_ttl, lease_id, poll_interval
+# 戻り値: {1, "0"} (確保した) / {0, 待つべき秒数}
+_ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local max_concurrency = tonumber(ARGV[3])
+local ttl = tonumber(ARGV[4])
+
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+if redis.call('ZCARD', KEYS[2]) >= max_concurrency then
+  return {0, ARGV[6]}
+end
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(now - ts, 0) * rate)
+if tokens < 1 then
+  redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+  return {0, tostring((1 - tokens) / rate)}
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens - 1), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 60)
+redis.call('ZADD', KEYS[2], now + ttl, ARGV[5])
+redis.call('EXPIRE', KEYS[2], ttl + 60)
+return {1, '0'}
+"""
+
+
+class WebInputThrottled(Exception):
+    """流量制限のため待ち時間内に入力を開始できなかった"""
+
+    def __init__(self, system: str, retry_after: float):
+        super().__init__(f"{system} の流量制限のため入力を開始できません ({retry_after:.1f}秒後に再実行)")
+        self.system = system
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class Limit:
+    rate_per_second: float
+    burst: int
+    max_concurrency: int
+
+
+def limit_for(system: str) -> Limit:
+    """振り分け先の上限 (WEB_INPUT_LIMITS で上書きされていなければ共通の設定値)"""
+    override = settings.WEB_INPUT_LIMITS.get(system, {})
+    return Limit(
+        rate_per_second=float(override.get("rate_per_second", settings.WEB_INPUT_RATE_PER_SECOND)),
+        burst=int(override.get("burst", settings.WEB_INPUT_BURST)),
+        max_concurrency=int(override.get("max_concurrency", settings.WEB_INPUT_MAX_CONCURRENCY)),
+    )
+
+
+class LocalLimiter:
+    """プロセス内のトークンバケットと同時実行数 (Redis がない場合)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._leases: dict[str, dict[str, float]] = {}
+
+    def try_acquire(self, system: str, limit: Limit, lease_id: str) -> float:
+        """枠を確保できれば 0、できなければ待つべき秒数を返す"""
+        now = time.monotonic()
+        with self._lock:
+            leases = {k: v for k, v in self._leases.get(system, {}).items() if v > now}
+            self._leases[system] = leases
+            if len(leases) >= limit.max_concurrency:
+                return CONCURRENCY_POLL_INTERVAL
+            tokens, ts = self._buckets.get(system, (float(limit.burst), now))
+            tokens = min(limit.burst, tokens + (now - ts) * limit.rate_per_second)
+            if tokens < 1:
+                self._buckets[system] = (tokens, now)
+                return (1 - tokens) / limit.rate_per_second
+            self._buckets[system] = (tokens - 1, now)
+            leases[lease_id] = now + LEASE_TTL
+            return 0.0
+
+    def release(self, system: str, lease_id: str):
+        with self._lock:
+            self._leases.get(system, {}).pop(lease_id, None)
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+            self._leases.clear()
+
+
+class RedisLimiter:
+    def __init__(self, client):
+        self._client = client
+        self._script = client.register_script(_ACQUIRE_SCRIPT)
+
+    @staticmethod
+    def _keys(system: str) -> list[str]:
+        return [f"web_input_limit:{system}:bucket", f"web_input_limit:{system}:leases"]
+
+    def try_acquire(self, system: str, limit: Limit, lease_id: str) -> float:
+        acquired, wait = self._script(keys=self._keys(system), args=[
+            limit.rate_per_second, limit.burst, limit.max_concurrency, LEASE_TTL, lease_id,
+            CONCURRENCY_POLL_INTERVAL,
+        ])
+        return 0.0 if int(acquired) else float(wait)
+
+    def release(self, system: str, lease_id: str):
+        self._client.zrem(self._keys(system)[1], lease_id)
+
+
+local_limiter = LocalLimiter()
+
+
+def _limiter():
+    from app.utils.redis_client import get_redis
+
+    client = get_redis()
+    return RedisLimiter(client) if client is not None else local_limiter
+
+
+def _try_acquire(system: str, limit: Limit, lease_id: str):
+    limiter = _limiter()
+    try:
+        return limiter, limiter.try_acquire(system, limit, lease_id)
+    except Exception:
+        # Redis の障害中はプロセス内の上限で続行する
+        return local_limiter, local_limiter.try_acquire(system, limit, lease_id)
+
+
+@contextmanager
+def web_input_slot(system: str, max_wait: float | None = None) -> Iterator[None]:
+    """振り分け先への入力枠を確保して with ブロックを実行する
+
+    枠が空くまで最大 max_wait 秒 (既定は WEB_INPUT_MAX_WAIT_SECONDS) 待ち、
+    それでも確保できなければ WebInputThrottled を送出する。
+    """
+    limit = limit_for(system)
+    max_wait = settings.WEB_INPUT_MAX_WAIT_SECONDS if max_wait is None else max_wait
+    lease_id = uuid.uuid4().hex
+    started = time.monotonic()
+    while True:
+        limiter, wait = _try_acquire(system, limit, lease_id)
+        if wait <= 0:
+            break
+        remaining = max_wait - (time.monotonic() - started)
+        if remaining <= 0:
+            metrics.inc("web_input_throttled_total", system=system)
+            raise WebInputThrottled(system, wait)
+        # 同時に待っている入力が一斉に再試行しないよう少しずらす
+        time.sleep(min(wait * random.uniform(1.0, 1.2), remaining))
+    metrics.observe("web_input_wait_seconds", time.monotonic() - started, buckets=WAIT_BUCKETS, system=system)
+    try:
+        yield
+    finally:
+        try:
+            limiter.release(system, lease_id)
+        except Exception:
+            # 解放できなかった枠は LEASE_TTL で自動的に空く
+            pass
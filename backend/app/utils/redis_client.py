@@ -0,0 +1,30 @@
+"""Redisクライアント: 接続できない環境 (テスト・ローカル) では None を返して呼び出し側でフォールバックさせる"""
+import time
+
+from app.config import settings
+
+# 接続失敗後、この秒数は再接続を試みない
+RETRY_INTERVAL = 30.0
+
+_client = None
+_failed_at: float | None = None
+
+
+def get_redis():
+    """共有のRedisクライアントを返す。接続できない場合は None"""
+    global _client, _failed_at
+    if _client is not None:
+        return _client
+    if _failed_at is not None and time.monotonic() - _failed_at < RETRY_INTERVAL:
+        return None
+    try:
+        import redis
+
+        client = redis.Redis.from_url(settings.REDIS_URL, socket_connect_timeout=0.5, socket_timeout=1.0)
+        client.ping()
+    except Exception:
+        _failed_at = time.monotonic()
+        return None
+    _client = client
+    _failed_at = None
+    return _client
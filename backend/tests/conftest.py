@@ -1,9 +1,17 @@
+import os
+import sys
+
 import pytest
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 from starlette.testclient import TestClient
 
+# workers / mcp_servers パッケージへのパスを追加 (Docker では /app 直下、ローカルでは backend と同じ階層にある)
+_project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if _project_root not in sys.path:
+    sys.path.insert(0, _project_root)
+
 from app.auth.utils import create_access_token, get_password_hash
 from app.database import Base, get_db
 from app.main import app
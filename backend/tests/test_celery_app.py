@@ -0,0 +1,31 @@
+"""Tests for the Celery queue routing in app.celery_app."""
+
+import pytest
+
+from app.celery_app import PRIORITY_HIGH, PRIORITY_LOW, QUEUES, TASK_ROUTES, celery
+
+
+@pytest.fixture(scope="module")
+def worker_tasks():
+    import workers.job_processor  # noqa: F401
+    import workers.tasks  # noqa: F401
+
+    return sorted(name for name in celery.tasks if name.startswith("workers."))
+
+
+def test_every_worker_task_is_routed(worker_tasks):
+    assert worker_tasks
+    assert set(worker_tasks) == set(TASK_ROUTES)
+    for name in worker_tasks:
+        route = celery.amqp.router.route({}, name)
+        assert route["queue"].name in QUEUES
+        assert PRIORITY_HIGH <= route["priority"] <= PRIORITY_LOW
+
+
+def test_reports_do_not_share_a_queue_with_orders():
+    def queue(name):
+        return celery.amqp.router.route({}, name)["queue"].name
+
+    assert queue("workers.generate_report") != queue("workers.process_order")
+    assert queue("workers.generate_report") != queue("workers.process_order_async")
+    assert queue("workers.auto_reconcile") != queue("workers.process_order_async")
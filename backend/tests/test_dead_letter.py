@@ -0,0 +1,219 @@
+"""Tests for app.services.dead_letter and the /jobs/dead-letters endpoints."""
+
+from unittest.mock import patch
+
+import pytest
+
+from app.models.automation import DeadLetterJob, JobStatus, ProcessingJob
+from app.services.job_steps import ORDER_REGISTRATION, WEB_INPUT
+from mcp_servers.common.mcp_base import MockMCPClient
+from workers import job_processor, tasks
+
+
+@pytest.fixture(autouse=True)
+def worker_session(monkeypatch):
+    from tests.conftest import TestingSessionLocal
+
+    monkeypatch.setattr(job_processor, "SessionLocal", TestingSessionLocal)
+    monkeypatch.setattr(tasks, "SessionLocal", TestingSessionLocal)
+
+
+def _approved_job(db, system="system_a"):
+    job = ProcessingJob(
+        status=JobStatus.executing,
+        assigned_system=system,
+        result={"発注元": "株式会社クライアント", "案件名": "保守案件", "月額単価": "800000"},
+    )
+    db.add(job)
+    db.commit()
+    return job
+
+
+def _dead_letter(db, job, step=WEB_INPUT, error_class="ConnectionError"):
+    dead_letter = DeadLetterJob(
+        job_id=job.id, step=step, error_class=error_class, error_message="タイムアウト",
+        assigned_system=job.assigned_system,
+    )
+    job.status = JobStatus.failed
+    db.add(dead_letter)
+    db.commit()
+    return dead_letter
+
+
+def test_parse_failure_is_recorded(db, tmp_path):
+    path = tmp_path / "header_only.csv"
+    path.write_text("発注先,業務内容,月額単価\n", encoding="utf-8")
+    job = ProcessingJob(status=JobStatus.received, excel_file_path=str(path))
+    db.add(job)
+    db.commit()
+
+    assert "error" in job_processor.process_order(job.id)
+
+    db.expire_all()
+    dead_letter = db.query(DeadLetterJob).one()
+    assert dead_letter.job_id == job.id
+    assert dead_letter.step == "parse"
+    assert dead_letter.error_class == "ExcelParseError"
+    assert dead_letter.status == "pending"
+    assert dead_letter.input_snapshot["excel_file_path"] == job.excel_file_path
+
+
+def test_exhausted_retries_are_recorded_at_failed_step(db):
+    job = _approved_job(db, "system_b")
+    with patch.object(MockMCPClient, "execute_order_input", side_effect=ConnectionError("タイムアウト")):
+        result = tasks.process_order_async.apply(args=(job.id,), retries=tasks.process_order_async.max_retries)
+
+    assert result.result["job_id"] == job.id
+    db.expire_all()
+    dead_letter = db.query(DeadLetterJob).one()
+    assert dead_letter.step == WEB_INPUT
+    assert dead_letter.error_class == "ConnectionError"
+    assert dead_letter.assigned_system == "system_b"
+    assert set(dead_letter.input_snapshot["checkpoints"]) == {ORDER_REGISTRATION}
+
+
+def test_replay_filters_and_staggers_batches(auth_client, db):
+    jobs = [_approved_job(db, "system_a") for _ in range(5)]
+    for job in jobs:
+        _dead_letter(db, job)
+    other = _approved_job(db, "system_b")
+    _dead_letter(db, other)
+
+    enqueued, scheduled = [], []
+    with patch.object(tasks.process_order_async, "apply_async", side_effect=lambda args: enqueued.append(args[0])), \
+            patch.object(tasks.replay_dead_letters_task, "apply_async",
+                         side_effect=lambda args, countdown: scheduled.append((args, countdown))):
+        resp = auth_client.post("/api/v1/jobs/dead-letters/replay", json={
+            "assigned_system": "system_a", "batch_size": 2, "interval_seconds": 30,
+        })
+        assert resp.status_code == 200
+        body = resp.json()
+        assert body["selected"] == 5
+        assert body["batches"] == 3
+        assert body["job_ids"] == [job.id for job in jobs]
+
+        # 最初のバッチだけをすぐに投入し、次のバッチは interval_seconds 後のタスクに任せる
+        batches = [list(enqueued)]
+        while scheduled:
+            args, countdown = scheduled.pop()
+            assert countdown == 30
+            enqueued.clear()
+            tasks.replay_dead_letters_task(*args)
+            batches.append(list(enqueued))
+
+    assert batches == [[jobs[0].id, jobs[1].id], [jobs[2].id, jobs[3].id], [jobs[4].id]]
+    db.expire_all()
+    assert {job.status for job in db.query(ProcessingJob).filter(ProcessingJob.assigned_system == "system_a")} \
+        == {JobStatus.executing}
+    pending = auth_client.get("/api/v1/jobs/dead-letters").json()
+    assert [item["job_id"] for item in pending] == [other.id]
+
+
+def test_replay_interval_stays_below_visibility_timeout(db):
+    from app.services.dead_letter import REPLAY_MAX_INTERVAL_SECONDS, query_dead_letters, replay
+
+    for _ in range(2):
+        _dead_letter(db, _approved_job(db))
+
+    with patch.object(tasks.process_order_async, "apply_async"), \
+            patch.object(tasks.replay_dead_letters_task, "apply_async") as schedule:
+        replay(db, query_dead_letters(db).all(), batch_size=1, interval_seconds=3600)
+
+    assert schedule.call_args.kwargs["countdown"] == REPLAY_MAX_INTERVAL_SECONDS < 3600
+
+
+def test_redelivered_replay_batch_does_not_enqueue_twice(db):
+    dead_letter = _dead_letter(db, _approved_job(db))
+
+    with patch.object(tasks.process_order_async, "apply_async") as apply_async:
+        tasks.replay_dead_letters_task([dead_letter.id], 1, 30)
+        tasks.replay_dead_letters_task([dead_letter.id], 1, 30)
+
+    apply_async.assert_called_once()
+
+
+def test_replay_failure_midway_keeps_enqueued_records(auth_client, db):
+    first = _dead_letter(db, _approved_job(db))
+    second = _dead_letter(db, _approved_job(db))
+
+    with patch.object(tasks.process_order_async, "apply_async",
+                      side_effect=[None, ConnectionError("broker unavailable")]):
+        resp = auth_client.post("/api/v1/jobs/dead-letters/replay", json={"ids": [first.id, second.id]})
+
+    assert resp.status_code == 503
+    db.expire_all()
+    # 投入できたジョブの記録だけが replayed になる
+    assert db.get(DeadLetterJob, first.id).status == "replayed"
+    assert db.get(DeadLetterJob, second.id).status == "pending"
+    assert db.get(ProcessingJob, second.job_id).status == JobStatus.failed
+
+
+def test_replay_parse_failure_restarts_from_parse(auth_client, db):
+    job = ProcessingJob(status=JobStatus.failed, excel_file_path="/tmp/orders.xlsx")
+    db.add(job)
+    db.commit()
+    _dead_letter(db, job, step="parse", error_class="ExcelParseError")
+
+    with patch.object(job_processor.process_order, "apply_async") as apply_async:
+        resp = auth_client.post("/api/v1/jobs/dead-letters/replay", json={"error_class": "ExcelParseError"})
+
+    assert resp.status_code == 200
+    apply_async.assert_called_once_with((job.id,))
+    db.expire_all()
+    assert db.get(ProcessingJob, job.id).status == JobStatus.received
+
+
+def test_replay_resumes_from_failed_step(auth_client, db):
+    registered = _approved_job(db)
+    registered.checkpoints = {ORDER_REGISTRATION: {"key": "k", "completed_at": "", "result": {"order": {"id": 1}}}}
+    db.commit()
+    _dead_letter(db, registered, step=WEB_INPUT)
+    unregistered = _approved_job(db)
+    _dead_letter(db, unregistered, step=ORDER_REGISTRATION)
+
+    with patch.object(tasks.process_order_async, "apply_async") as apply_async:
+        resp = auth_client.post("/api/v1/jobs/dead-letters/replay", json={})
+
+    assert resp.status_code == 200
+    assert [call.args[0] for call in apply_async.call_args_list] == [
+        (registered.id, WEB_INPUT), (unregistered.id, ORDER_REGISTRATION),
+    ]
+
+
+def test_resume_from_web_input_does_not_register_again(db):
+    job = _approved_job(db)
+    with patch("app.services.order_registration.register_order_from_job") as register:
+        result = tasks.process_order_async(job.id, WEB_INPUT)
+
+    register.assert_not_called()
+    assert job.id == result["job_id"] and "order_registration" in result["error"]
+    db.expire_all()
+    assert db.get(ProcessingJob, job.id).status == JobStatus.failed
+
+
+def test_replay_without_broker_keeps_records(auth_client, db):
+    dead_letter = _dead_letter(db, _approved_job(db))
+
+    with patch.object(tasks.process_order_async, "apply_async", side_effect=ConnectionError("broker unavailable")):
+        resp = auth_client.post("/api/v1/jobs/dead-letters/replay", json={"ids": [dead_letter.id]})
+
+    assert resp.status_code == 503
+    db.expire_all()
+    assert db.get(DeadLetterJob, dead_letter.id).status == "pending"
+    assert db.get(ProcessingJob, dead_letter.job_id).status == JobStatus.failed
+
+
+def test_replay_does_not_hide_other_errors(auth_client, db):
+    dead_letter = _dead_letter(db, _approved_job(db))
+
+    with patch.object(tasks.process_order_async, "apply_async", side_effect=ValueError("不正な引数")):
+        with pytest.raises(ValueError):
+            auth_client.post("/api/v1/jobs/dead-letters/replay", json={"ids": [dead_letter.id]})
+
+    db.expire_all()
+    assert db.get(DeadLetterJob, dead_letter.id).status == "pending"
+
+
+def test_replay_requires_admin(sales_client):
+    resp = sales_client.post("/api/v1/jobs/dead-letters/replay", json={})
+    assert resp.status_code == 403
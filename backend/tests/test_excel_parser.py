@@ -0,0 +1,573 @@
+"""Tests for workers.excel_parser."""
+
+import importlib.util
+import zipfile
+from dataclasses import replace
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from openpyxl import Workbook
+from openpyxl.utils.datetime import CALENDAR_MAC_1904
+
+from app.models.automation import ExcelTemplate
+from app.services.order_registration import _normalize_fields
+from workers import excel_parser, excel_templates, multi_sheet
+from workers.excel_parser import ExcelParseError, ExcelParser
+from workers.excel_templates import TemplateRegistry
+
+
+HEADERS = ["発注番号", "案件名", "発注元企業", "月額単価"]
+
+
+def _save(wb, path):
+    wb.save(str(path))
+    return str(path)
+
+
+@pytest.fixture()
+def table_xlsx(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(HEADERS)
+    ws.append(["PO-001", "決済システム改修", "株式会社ペイメントテック", 750000])
+    ws.append(["PO-002", "社内DX", "株式会社デジタルワークス", 850000])
+    return _save(wb, tmp_path / "list.xlsx")
+
+
+@pytest.fixture()
+def key_value_xlsx(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws["A1"] = "発注仕様書"
+    ws["A3"] = "案件名"
+    ws["B3"] = "ECサイトリニューアル"
+    ws["A4"] = "月額単価"
+    ws["B4"] = 800000
+    return _save(wb, tmp_path / "spec.xlsx")
+
+
+def test_smart_parse_table(table_xlsx):
+    records = ExcelParser().smart_parse(table_xlsx)
+    assert len(records) == 2
+    assert records[0]["案件名"] == "決済システム改修"
+    assert records[1]["月額単価"] == 850000
+
+
+def test_smart_parse_key_value(key_value_xlsx):
+    data = ExcelParser().smart_parse(key_value_xlsx)
+    assert data["案件名"] == "ECサイトリニューアル"
+    assert data["月額単価"] == 800000
+
+
+def test_smart_parse_opens_workbook_once(table_xlsx):
+    with patch.object(excel_parser, "FastXlsxReader", wraps=excel_parser.FastXlsxReader) as mock_open, \
+            patch.object(excel_parser, "load_workbook", wraps=excel_parser.load_workbook) as mock_load:
+        ExcelParser().smart_parse(table_xlsx)
+    assert mock_open.call_count == 1
+    mock_load.assert_not_called()
+
+
+def test_smart_parse_opens_workbook_once_with_openpyxl(table_xlsx):
+    with patch.object(excel_parser, "FAST_READER", False), \
+            patch.object(excel_parser, "load_workbook", wraps=excel_parser.load_workbook) as mock_load:
+        ExcelParser().smart_parse(table_xlsx)
+    assert mock_load.call_count == 1
+
+
+def test_parse_missing_file(tmp_path):
+    with pytest.raises(ExcelParseError):
+        ExcelParser().parse(str(tmp_path / "missing.xlsx"))
+
+
+def test_parse_header_only(tmp_path):
+    wb = Workbook()
+    wb.active.append(HEADERS)
+    path = _save(wb, tmp_path / "header_only.xlsx")
+    with pytest.raises(ExcelParseError):
+        ExcelParser().parse(path)
+
+
+def test_iter_records_is_lazy(table_xlsx):
+    records = ExcelParser().iter_records(table_xlsx)
+    first = next(records)
+    assert first["発注番号"] == "PO-001"
+    assert [r["発注番号"] for r in records] == ["PO-002"]
+
+
+def test_iter_records_skips_invalid_rows(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(HEADERS)
+    ws.append(["PO-001", None, "A社", 1])
+    ws.append(["PO-002", "案件B", "B社", 2])
+    path = _save(wb, tmp_path / "invalid.xlsx")
+
+    parser = ExcelParser({"validation_rules": {"required": ["案件名"]}})
+    assert [r["発注番号"] for r in parser.iter_records(path)] == ["PO-002"]
+    assert parser.errors == ["行2: 必須項目 '案件名' が空です"]
+
+
+def test_iter_records_from_open_session(table_xlsx):
+    parser = ExcelParser()
+    with parser.open(table_xlsx) as session:
+        assert session.detect_format() == "table"
+        assert len(list(parser.iter_records(session))) == 2
+
+
+def test_key_value_layouts(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    # 右隣 (4列レイアウト)
+    ws.append(["発注番号", "PO-1", "担当者", "田中"])
+    # 項目名が結合セル (A:B) で値が C 列
+    ws.merge_cells("A2:B2")
+    ws["A2"] = "案件名"
+    ws["C2"] = "ECサイト"
+    # 見出し行 (右・下に値なし扱い) と下隣レイアウト
+    ws["A4"] = "■ 案件概要"
+    ws["A5"] = "業務内容"
+    ws["A6"] = "既存ECサイトのリニューアル"
+    path = _save(wb, tmp_path / "layouts.xlsx")
+
+    data = ExcelParser().parse_order_excel(path)
+    assert data["発注番号"] == "PO-1"
+    assert data["担当者"] == "田中"
+    assert data["案件名"] == "ECサイト"
+    assert data["業務内容"] == "既存ECサイトのリニューアル"
+    assert "■ 案件概要" not in data
+    # 値として使ったセルは項目名にならない
+    assert "PO-1" not in data
+    assert "既存ECサイトのリニューアル" not in data
+
+
+def test_key_value_sample_spec_keys(tmp_path, monkeypatch):
+    """test-files の発注仕様書サンプル: 表題と作成日を項目として拾わない"""
+    script = Path(__file__).resolve().parents[2] / "test-files" / "generate_test_files.py"
+    spec = importlib.util.spec_from_file_location("generate_test_files", script)
+    generator = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(generator)
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "test-files").mkdir()
+    path = generator.create_order_excel()
+
+    data = ExcelParser().smart_parse(str(path))
+    assert list(data) == [
+        "発注番号", "発注日", "発注元企業", "担当者", "案件名", "業務内容", "開始日", "終了日", "勤務地",
+        "契約形態", "月額単価", "精算幅下限（H）", "精算幅上限（H）", "想定工数", "予算", "必要人数",
+        "必須スキル", "備考",
+    ]
+    assert data["発注番号"] == "PO-2026-0215"
+
+
+def test_key_value_vertical_layout_from_first_row(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws["A1"] = "案件名"
+    ws["A2"] = "ECサイト"
+    ws["A4"] = "発注番号"
+    ws["B4"] = "PO-1"
+    path = _save(wb, tmp_path / "vertical.xlsx")
+
+    assert ExcelParser().parse_order_excel(path) == {"案件名": "ECサイト", "発注番号": "PO-1"}
+
+
+def test_key_value_ignores_cells_outside_region(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws["A1"] = "案件名"
+    ws["B1"] = "範囲内"
+    ws["A60"] = "備考"
+    ws["B60"] = "範囲外"
+    path = _save(wb, tmp_path / "region.xlsx")
+
+    data = ExcelParser().parse_order_excel(path)
+    assert data == {"案件名": "範囲内"}
+
+
+
+# --- 高速リーダー ---
+
+def _read_rows(path, fast):
+    with excel_parser.WorkbookSession(path, fast=fast) as session:
+        assert (session._reader is not None) is fast
+        return [tuple(row) for row in session.rows()]
+
+
+def test_fast_reader_matches_openpyxl(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["文字", "整数", "小数", "日時", "時刻", "真偽", "式"])
+    ws.append(["株式会社テスト", 750000, 1.5, datetime(2025, 4, 1, 9, 30), time(9, 30), True, "=B2*2"])
+    ws.append([None, None, None, date(2025, 5, 1), None, False, None])
+    ws["J8"] = "離れたセル"
+    ws["B10"] = 1e20
+    ws["D11"] = timedelta(hours=30)
+    ws.merge_cells("A12:C12")
+    ws["A12"] = "結合"
+    wb.create_sheet("別シート")["A1"] = "読まない"
+    path = _save(wb, tmp_path / "mixed.xlsx")
+
+    assert _read_rows(path, fast=True) == _read_rows(path, fast=False)
+
+
+def test_fast_reader_1904_epoch_and_active_sheet(tmp_path):
+    wb = Workbook()
+    wb.epoch = CALENDAR_MAC_1904
+    wb.create_sheet("発注一覧")
+    wb.active = 1
+    wb.active["B2"] = datetime(2025, 4, 1)
+    path = _save(wb, tmp_path / "1904.xlsx")
+
+    rows = _read_rows(path, fast=True)
+    assert rows == _read_rows(path, fast=False)
+    assert rows[1][1] == datetime(2025, 4, 1)
+
+
+XLSX_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+
+
+def _write_xlsx(path, shared_strings: str, sheet_data: str):
+    """共有文字列とシートのXMLを指定して最小構成の xlsx を書く"""
+    rel = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr("[Content_Types].xml", (
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+            '</Types>'
+        ))
+        z.writestr("xl/workbook.xml", (
+            f'<workbook xmlns="{XLSX_NS}" xmlns:r="{rel}"><sheets><sheet name="一覧" sheetId="1" r:id="rId1"/></sheets></workbook>'
+        ))
+        z.writestr("xl/_rels/workbook.xml.rels", (
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'<Relationship Id="rId1" Type="{rel}/worksheet" Target="worksheets/sheet1.xml"/></Relationships>'
+        ))
+        z.writestr("xl/sharedStrings.xml", f'<sst xmlns="{XLSX_NS}">{shared_strings}</sst>')
+        z.writestr("xl/worksheets/sheet1.xml", f'<worksheet xmlns="{XLSX_NS}">{sheet_data}</worksheet>')
+    return str(path)
+
+
+def test_fast_reader_shared_strings(tmp_path):
+    """Excel が書き出す共有文字列 (ふりがな付き・リッチテキスト) と dimension を読む"""
+    path = _write_xlsx(
+        tmp_path / "excel.xlsx",
+        '<si><t>案件名</t></si>'
+        '<si><r><t>株式会社</t></r><r><rPr><b/></rPr><t xml:space="preserve"> テスト</t></r>'
+        '<rPh sb="0" eb="4"><t>カブシキガイシャ</t></rPh></si>',
+        '<dimension ref="A1:C5"/><sheetData>'
+        '<row r="1"><c r="A1" t="s"><v>0</v></c><c r="C1" t="s"><v>1</v></c></row>'
+        '<row r="3"><c r="A3"><v>42</v></c><c r="B3" t="inlineStr"><is><t>インライン</t></is></c></row>'
+        '<row r="9"><c r="A9"><v>1</v></c></row>'
+        '</sheetData>',
+    )
+
+    rows = _read_rows(path, fast=True)
+    assert rows == _read_rows(path, fast=False)
+    assert rows[0] == ("案件名", None, "株式会社 テスト")
+    assert rows[2] == (42, "インライン", None)
+    assert len(rows) == 5
+
+
+def test_fast_reader_error_after_detection_rows(tmp_path):
+    """先頭 DETECT_ROWS 行より後の不正なセルも ExcelParseError になる"""
+    rows = "".join(
+        f'<row r="{n}"><c r="A{n}" t="s"><v>0</v></c><c r="B{n}"><v>{n}</v></c><c r="C{n}"><v>1</v></c></row>'
+        for n in range(1, 8)
+    )
+    broken = '<row r="8"><c r="A8" t="s"><v>99</v></c></row>'
+    path = _write_xlsx(tmp_path / "broken.xlsx", "<si><t>保守</t></si>", f"<sheetData>{rows}{broken}</sheetData>")
+
+    with excel_parser.WorkbookSession(path, fast=True) as session:
+        assert session._reader is not None
+        with pytest.raises(ExcelParseError, match="ファイルを読み取れません"):
+            list(ExcelParser().iter_records(session))
+
+
+def test_fast_reader_falls_back_to_openpyxl(tmp_path, table_xlsx):
+    with patch.object(excel_parser.FastXlsxReader, "_load_workbook", side_effect=excel_parser._UnsupportedWorkbook("x")):
+        with excel_parser.WorkbookSession(table_xlsx) as session:
+            assert session._reader is None
+            assert list(ExcelParser().iter_records(session))[0]["案件名"] == "決済システム改修"
+
+
+
+# --- 複数シート ---
+
+@pytest.fixture()
+def multi_sheet_xlsx(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "4月"
+    ws.append(HEADERS)
+    ws.append(["PO-001", "決済システム改修", "株式会社ペイメントテック", 750000])
+    wb.create_sheet("空シート")
+    ws = wb.create_sheet("5月")
+    ws.append(HEADERS)
+    ws.append(["PO-002", "社内DX", "株式会社デジタルワークス", 850000])
+    ws.append(["PO-003", "基幹刷新", "株式会社デジタルワークス", 900000])
+    ws = wb.create_sheet("仕様")
+    ws["A1"] = "案件名"
+    ws["B1"] = "ECサイトリニューアル"
+    hidden = wb.create_sheet("非表示")
+    hidden.append(HEADERS)
+    hidden.sheet_state = "hidden"
+    return _save(wb, tmp_path / "multi.xlsx")
+
+
+@pytest.mark.parametrize("fast", [True, False])
+def test_discover_sheets(multi_sheet_xlsx, fast):
+    with patch.object(excel_parser, "FAST_READER", fast):
+        sheets = multi_sheet.discover_sheets(multi_sheet_xlsx)
+    assert [(s.name, s.format) for s in sheets] == [("4月", "table"), ("5月", "table"), ("仕様", "key_value")]
+    assert sheets[0].header == tuple(HEADERS)
+
+
+def test_session_reads_named_sheet(multi_sheet_xlsx):
+    records = list(ExcelParser().iter_records(excel_parser.WorkbookSession(multi_sheet_xlsx, sheet="5月")))
+    assert [r["発注番号"] for r in records] == ["PO-002", "PO-003"]
+    with pytest.raises(ExcelParseError):
+        excel_parser.WorkbookSession(multi_sheet_xlsx, sheet="存在しない")
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_iter_sheets(multi_sheet_xlsx, max_workers):
+    # 各シートのレコードは次のシートを受け取る前に読む
+    results = []
+    for result in multi_sheet.iter_sheets(multi_sheet_xlsx, max_workers=max_workers):
+        results.append((result.name, result.format, [r["発注番号"] for r in result.iter_records()], result.data))
+    assert results == [
+        ("4月", "table", ["PO-001"], {}),
+        ("5月", "table", ["PO-002", "PO-003"], {}),
+        ("仕様", "key_value", [], {"案件名": "ECサイトリニューアル"}),
+    ]
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_iter_sheets_streams_in_chunks(tmp_path, monkeypatch, max_workers):
+    monkeypatch.setattr(multi_sheet, "STREAM_CHUNK_SIZE", 2)
+    wb = Workbook()
+    for name in ("A", "B"):
+        ws = wb.active if name == "A" else wb.create_sheet(name)
+        ws.title = name
+        ws.append(HEADERS)
+        for i in range(5):
+            ws.append([f"{name}-{i}", "保守", "株式会社テスト", 100000 + i])
+    path = _save(wb, tmp_path / "stream.xlsx")
+
+    summary = {}
+    items = list(multi_sheet.iter_sheet_records(multi_sheet.iter_sheets(path, max_workers=max_workers), summary))
+    assert [record["発注番号"] for record, _ in items] == [f"{n}-{i}" for n in "AB" for i in range(5)]
+    assert items[5][1] == "シート「B」 1行目"
+    assert summary["sheets"] == {"A": 5, "B": 5}
+    assert summary["errors"] == []
+
+
+# --- テンプレート (ExcelTemplate) ---
+
+
+CSV_ROWS = [
+    HEADERS,
+    ["PO-001", "決済システム改修", "株式会社ペイメントテック", "750000"],
+    ["PO-002", "社内DX", "", "850000"],
+]
+
+
+@pytest.mark.parametrize("suffix, delimiter, encoding", [
+    (".csv", ",", "utf-8"),
+    (".csv", ",", "utf-8-sig"),
+    (".csv", ",", "cp932"),
+    (".tsv", "\t", "utf-8"),
+    (".txt", "\t", "cp932"),
+])
+def test_csv_parse(tmp_path, suffix, delimiter, encoding):
+    path = tmp_path / f"list{suffix}"
+    path.write_text("\r\n".join(delimiter.join(row) for row in CSV_ROWS), encoding=encoding)
+
+    with excel_parser.WorkbookSession(str(path)) as session:
+        assert session.detect_format() == "table"
+        assert session.sheet_names() == ["list"]
+        records = list(ExcelParser().iter_records(session))
+
+    assert records[0]["発注元企業"] == "株式会社ペイメントテック"
+    assert records[0]["月額単価"] == 750000
+    assert records[1]["発注元企業"] is None
+
+
+def test_csv_keeps_codes_as_text(tmp_path):
+    path = tmp_path / "codes.csv"
+    path.write_text("コード,金額,率,備考\n0012,-300,1.5,\"a,b\"\n", encoding="utf-8")
+    assert ExcelParser().smart_parse(str(path)) == [{"コード": "0012", "金額": -300, "率": 1.5, "備考": "a,b"}]
+
+
+def test_csv_key_value_and_template(tmp_path):
+    path = tmp_path / "spec.csv"
+    path.write_text("発注仕様書\n\n案件名,ECサイトリニューアル\n月額単価,800000\n", encoding="cp932")
+    template = {"column_mappings": {"案件名": "project_name", "月額単価": "unit_price"},
+                "validation_rules": {"types": {"unit_price": "int"}}}
+    parser = ExcelParser(template)
+    with excel_parser.WorkbookSession(str(path)) as session:
+        assert session.detect_format() == "key_value"
+        data = parser.map_key_values(parser.extract_key_values(session))
+    assert data == {"project_name": "ECサイトリニューアル", "unit_price": 800000}
+
+
+def test_csv_discover_sheets(tmp_path):
+    path = tmp_path / "list.csv"
+    path.write_text("\n".join(",".join(row) for row in CSV_ROWS), encoding="utf-8")
+    sheets = multi_sheet.discover_sheets(str(path))
+    assert [(s.name, s.format) for s in sheets] == [("list", "table")]
+    [result] = multi_sheet.iter_sheets(str(path), sheets=sheets)
+    assert len(list(result.iter_records())) == 2
+
+
+def _limits(**kwargs):
+    return replace(excel_parser.ParseLimits.unlimited(), **kwargs)
+
+
+@pytest.mark.parametrize("fast", [True, False])
+def test_limits_max_rows(table_xlsx, fast):
+    # 見出しを除いたデータ行で数える: 2行の一覧は max_rows=2 でちょうど読める
+    with pytest.raises(ExcelParseError, match="行数が上限"):
+        with excel_parser.WorkbookSession(table_xlsx, fast=fast, limits=_limits(max_rows=1)) as session:
+            list(session.rows())
+    with excel_parser.WorkbookSession(table_xlsx, fast=fast, limits=_limits(max_rows=2)) as session:
+        assert len(list(ExcelParser().iter_records(session))) == 2
+
+
+def test_limits_max_rows_boundary_csv(tmp_path):
+    path = tmp_path / "list.csv"
+    path.write_text("発注番号,月額単価\n" + "".join(f"PO-{i},{i}\n" for i in range(10)), encoding="utf-8")
+    with excel_parser.WorkbookSession(str(path), limits=_limits(max_rows=10)) as session:
+        assert len(list(ExcelParser().iter_records(session))) == 10
+    with pytest.raises(ExcelParseError, match="見出しを除き9行"):
+        with excel_parser.WorkbookSession(str(path), limits=_limits(max_rows=9)) as session:
+            list(ExcelParser().iter_records(session))
+
+
+def test_limits_max_cols(tmp_path):
+    wb = Workbook()
+    wb.active.append(list(range(10)))
+    path = _save(wb, tmp_path / "wide.xlsx")
+    with pytest.raises(ExcelParseError, match="列数が上限"):
+        excel_parser.WorkbookSession(path, limits=_limits(max_cols=5))
+
+
+def test_limits_file_size_and_zip_bomb(tmp_path, table_xlsx):
+    with pytest.raises(ExcelParseError, match="ファイルサイズが上限"):
+        excel_parser.WorkbookSession(table_xlsx, limits=_limits(max_file_bytes=100))
+    with pytest.raises(ExcelParseError, match="展開後のサイズが上限"):
+        excel_parser.WorkbookSession(table_xlsx, limits=_limits(max_uncompressed_bytes=1000))
+
+    bomb = tmp_path / "bomb.xlsx"
+    with zipfile.ZipFile(bomb, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("xl/worksheets/sheet1.xml", b" " * 10_000_000)
+    with pytest.raises(ExcelParseError, match="圧縮率"):
+        excel_parser.WorkbookSession(str(bomb), limits=_limits(max_compression_ratio=100))
+
+
+def test_limits_timeout(tmp_path):
+    path = tmp_path / "many.csv"
+    path.write_text("a,b,c\n" * 1000, encoding="utf-8")
+    with patch.object(excel_parser.time, "monotonic", side_effect=[0.0] + [100.0] * 10):
+        with pytest.raises(ExcelParseError, match="解析時間が上限"):
+            with excel_parser.WorkbookSession(str(path), limits=_limits(timeout_seconds=10)) as session:
+                list(session.rows())
+
+
+def test_limits_default_from_settings(table_xlsx):
+    with excel_parser.WorkbookSession(table_xlsx) as session:
+        assert session.limits == excel_parser.ParseLimits.from_settings()
+        assert session.limits.max_rows is not None
+
+
+@pytest.fixture()
+def registry(db):
+    excel_templates._cache.update(stamp=None, templates=[], plans={}, selection={})
+    return TemplateRegistry(db)
+
+
+def _add_template(db, template_type, column_mappings, validation_rules=None, **kwargs):
+    template = ExcelTemplate(
+        name=kwargs.pop("name", "発注一覧"),
+        template_type=template_type,
+        column_mappings=column_mappings,
+        validation_rules=validation_rules or {},
+        **kwargs,
+    )
+    db.add(template)
+    db.commit()
+    return template
+
+
+def test_template_selected_by_header(db, registry, table_xlsx):
+    _add_template(db, "table", {"案件名": "project_name", "月額単価": "unit_price"}, {"types": {"unit_price": "int"}})
+    _add_template(db, "table", {"品名": "item", "数量": "quantity"}, name="別形式")
+
+    with excel_parser.WorkbookSession(table_xlsx) as session:
+        parser = registry.parser_for_table(session)
+        records = list(parser.iter_records(session))
+
+    assert records[0]["project_name"] == "決済システム改修"
+    assert records[0]["unit_price"] == 750000
+    # マッピング外の列は元の列名のまま残る
+    assert records[0]["発注番号"] == "PO-001"
+
+
+def test_template_not_selected_below_coverage(db, registry, table_xlsx):
+    _add_template(db, "table", {"案件名": "project_name", "品名": "item", "数量": "quantity"})
+    with excel_parser.WorkbookSession(table_xlsx) as session:
+        parser = registry.parser_for_table(session)
+    assert parser.template == {}
+
+
+def test_template_plan_compiled_once(db, registry, table_xlsx):
+    _add_template(db, "table", {"案件名": "project_name"})
+    with excel_parser.WorkbookSession(table_xlsx) as session:
+        first = registry.parser_for_table(session)
+        list(first.iter_records(session))
+    with excel_parser.WorkbookSession(table_xlsx) as session:
+        second = registry.parser_for_table(session)
+        assert first is not second
+        assert second.compile_plan(session.header) is first.compile_plan(session.header)
+
+
+def test_template_cache_invalidated_on_change(db, registry, table_xlsx):
+    template = _add_template(db, "table", {"案件名": "project_name"})
+    with excel_parser.WorkbookSession(table_xlsx) as session:
+        assert registry.parser_for_table(session).template["id"] == template.id
+
+    template.is_active = False
+    db.commit()
+    with excel_parser.WorkbookSession(table_xlsx) as session:
+        assert registry.parser_for_table(session).template == {}
+
+
+def test_template_conversion_failure_skips_row(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(HEADERS)
+    ws.append(["PO-001", "決済システム改修", "株式会社ペイメントテック", "75万"])
+    ws.append(["PO-002", "社内DX", "株式会社デジタルワークス", "850,000"])
+    path = _save(wb, tmp_path / "list.xlsx")
+
+    parser = ExcelParser({"column_mappings": {"月額単価": "unit_price"}, "validation_rules": {"types": {"unit_price": "int"}}})
+    records = parser.parse(path)
+    assert [r["unit_price"] for r in records] == [850000]
+    assert "行2" in parser.errors[0]
+
+
+def test_template_key_value_mapping(db, registry, key_value_xlsx):
+    _add_template(db, "key_value", {"案件名": "project_name", "月額単価": "unit_price"}, {"types": {"unit_price": "int"}})
+    with excel_parser.WorkbookSession(key_value_xlsx) as session:
+        data, parser = registry.extract_key_values(session)
+    assert data["project_name"] == "ECサイトリニューアル"
+    assert data["unit_price"] == 800000
+    assert parser.template["template_type"] == "key_value"
+
+
+def test_normalize_fields_accepts_canonical_names():
+    fields = _normalize_fields({"project_name": "決済システム改修", "月額単価": "750000", "unknown": "x"})
+    assert fields == {"project_name": "決済システム改修", "unit_price": "750000"}
@@ -0,0 +1,177 @@
+"""Tests for workers.fanout and the table-format fan-out in process_order."""
+
+import pytest
+
+from app.config import settings
+from app.models.automation import (
+    DeadLetterJob, JobStatus, ProcessingJob, ProcessingLog, ProcessingStepTiming, RoutingRule, TargetSystem,
+)
+from app.services import routing
+from workers import fanout, job_processor
+from workers.fanout import plan_chunks
+
+
+@pytest.fixture(autouse=True)
+def worker_session(monkeypatch):
+    from tests.conftest import TestingSessionLocal
+
+    monkeypatch.setattr(job_processor, "SessionLocal", TestingSessionLocal)
+    routing._cache.update({"version": None, "compiled": None, "loaded_at": 0.0})
+
+
+def _broker_down(*args, **kwargs):
+    raise ConnectionError("broker unavailable")
+
+
+def _list_job(db, tmp_path, rows: int):
+    path = tmp_path / "orders.csv"
+    lines = ["発注先,業務内容,月額単価"]
+    lines += [f"株式会社{'A' if i % 2 else 'B'},保守,{800000 + i}" for i in range(rows)]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    job = ProcessingJob(status=JobStatus.received, excel_file_path=str(path), slack_channel_id="C1")
+    db.add(job)
+    db.commit()
+    return job
+
+
+def test_plan_chunks_bounds_parallelism():
+    assert plan_chunks(list(range(5)), chunk_size=2, max_parallel=8) == [[0, 1], [2, 3], [4]]
+    chunks = plan_chunks(list(range(100)), chunk_size=2, max_parallel=4)
+    assert len(chunks) == 4
+    assert sum(chunks, []) == list(range(100))
+    assert plan_chunks([], chunk_size=2, max_parallel=4) == []
+
+
+def test_process_order_fans_out_table(db, tmp_path, monkeypatch):
+    rule = RoutingRule(name="A社", condition_type="vendor_name", condition_value="株式会社A",
+                       target_system=TargetSystem.system_b, priority=1)
+    db.add(rule)
+    db.commit()
+    parent = _list_job(db, tmp_path, rows=7)
+    monkeypatch.setattr(job_processor, "chord", _broker_down)
+    monkeypatch.setattr(fanout, "FANOUT_CHUNK_SIZE", 2)
+
+    result = job_processor.process_order(parent.id)
+    assert result == {"status": "routing", "job_id": parent.id, "child_count": 7}
+
+    db.expire_all()
+    children = (
+        db.query(ProcessingJob).filter(ProcessingJob.parent_job_id == parent.id).order_by(ProcessingJob.id).all()
+    )
+    assert len(children) == 7
+    assert all(child.status == JobStatus.pending_approval for child in children)
+    assert [child.assigned_system for child in children] == [None, "system_b"] * 3 + [None]
+    assert children[1].result == {"発注先": "株式会社A", "業務内容": "保守", "月額単価": 800001}
+    assert children[0].slack_channel_id == "C1"
+    steps = [(log.step_name, log.status) for log in
+             db.query(ProcessingLog).filter(ProcessingLog.job_id == children[1].id).order_by(ProcessingLog.id)]
+    assert steps == [("解析", "completed"), ("routing", "completed")]
+    timings = db.query(ProcessingStepTiming).filter(ProcessingStepTiming.job_id == children[1].id).all()
+    assert sorted(row.step for row in timings) == ["route", "to_pending_approval"]
+
+    parent = db.get(ProcessingJob, parent.id)
+    assert parent.status == JobStatus.completed
+    assert parent.result["child_count"] == 7
+    assert parent.result["routed"] == 7
+    assert parent.result["failed_chunks"] == 0
+    assert parent.result["routing"] == {"hits": {str(rule.id): 3}, "unmatched": 4}
+
+
+def test_row_limit_mid_fanout_leaves_no_children(db, tmp_path, monkeypatch):
+    # 上限を超えるのは子ジョブをいくつか作成した後: 作成済みの子ジョブも取り消される
+    parent = _list_job(db, tmp_path, rows=15)
+    monkeypatch.setattr(settings, "EXCEL_MAX_ROWS", 10)
+    monkeypatch.setattr(fanout, "FANOUT_CHUNK_SIZE", 3)
+    monkeypatch.setattr(job_processor, "dispatch_fanout", lambda *args: pytest.fail("should not fan out"))
+
+    result = job_processor.process_order(parent.id)
+    assert "行数が上限" in result["error"]
+
+    db.expire_all()
+    assert db.query(ProcessingJob).filter(ProcessingJob.parent_job_id == parent.id).count() == 0
+    parent = db.get(ProcessingJob, parent.id)
+    assert parent.status == JobStatus.failed
+    assert "行数が上限" in parent.error_message
+    assert db.query(DeadLetterJob).filter(DeadLetterJob.job_id == parent.id).count() == 1
+
+
+def test_row_limit_counts_data_rows_only(db, tmp_path, monkeypatch):
+    parent = _list_job(db, tmp_path, rows=10)
+    monkeypatch.setattr(settings, "EXCEL_MAX_ROWS", 10)
+    monkeypatch.setattr(fanout, "FANOUT_CHUNK_SIZE", 3)
+    monkeypatch.setattr(job_processor, "chord", _broker_down)
+
+    assert job_processor.process_order(parent.id)["child_count"] == 10
+
+
+def test_process_order_fans_out_multi_sheet(db, tmp_path, monkeypatch):
+    from openpyxl import Workbook
+
+    wb = Workbook()
+    for index, name in enumerate(("4月", "5月")):
+        ws = wb.active if index == 0 else wb.create_sheet()
+        ws.title = name
+        ws.append(["発注先", "業務内容", "月額単価"])
+        for n in range(index + 2):
+            ws.append([f"株式会社{name}", "保守", 800000 + n])
+    path = tmp_path / "multi.xlsx"
+    wb.save(str(path))
+    parent = ProcessingJob(status=JobStatus.received, excel_file_path=str(path))
+    db.add(parent)
+    db.commit()
+    monkeypatch.setattr(job_processor, "chord", _broker_down)
+
+    result = job_processor.process_order(parent.id)
+    assert result == {"status": "routing", "job_id": parent.id, "child_count": 5}
+
+    db.expire_all()
+    parent = db.get(ProcessingJob, parent.id)
+    assert parent.status == JobStatus.completed
+    assert parent.result["format"] == "multi_sheet"
+    assert parent.result["sheets"] == {"4月": 2, "5月": 3}
+    messages = [log.message for log in db.query(ProcessingLog).filter(
+        ProcessingLog.job_id != parent.id, ProcessingLog.step_name == "解析").order_by(ProcessingLog.id)]
+    assert messages[2] == "シート「5月」 1行目"
+
+
+def test_process_order_dispatches_chord(db, tmp_path, monkeypatch):
+    parent = _list_job(db, tmp_path, rows=5)
+    dispatched = {}
+
+    def fake_chord(header):
+        dispatched["header"] = header
+        return lambda callback: dispatched.setdefault("callback", callback)
+
+    monkeypatch.setattr(job_processor, "chord", fake_chord)
+    monkeypatch.setattr(fanout, "FANOUT_CHUNK_SIZE", 2)
+
+    job_processor.process_order(parent.id)
+
+    child_ids = [job.id for job in db.query(ProcessingJob).filter(ProcessingJob.parent_job_id == parent.id)]
+    chunks = [task.args[0] for task in dispatched["header"].tasks]
+    assert chunks == [child_ids[0:2], child_ids[2:4], child_ids[4:5]]
+    assert dispatched["callback"].args == (parent.id,)
+
+    # ワーカー側の実行を模して chord のコールバックまで流す
+    results = [job_processor.route_child_jobs(chunk) for chunk in chunks]
+    summary = job_processor.finalize_fanout(results, parent.id)
+    assert summary["routed"] == 5
+    db.expire_all()
+    assert db.get(ProcessingJob, parent.id).status == JobStatus.completed
+
+
+def test_finalize_fanout_reports_failed_chunks(db):
+    parent = ProcessingJob(status=JobStatus.routing, result={"format": "table", "child_count": 3})
+    db.add(parent)
+    db.commit()
+
+    summary = job_processor.finalize_fanout(
+        [{"count": 2, "hits": {"1": 2}, "unmatched": 0}, {"error": "DB接続エラー", "job_ids": [3]}], parent.id,
+    )
+    assert summary["failed_chunks"] == 1
+    db.expire_all()
+    parent = db.get(ProcessingJob, parent.id)
+    assert parent.status == JobStatus.completed
+    assert parent.result["routed"] == 2
+    warning = db.query(ProcessingLog).filter(ProcessingLog.job_id == parent.id, ProcessingLog.status == "warning").one()
+    assert "DB接続エラー" in warning.message
@@ -0,0 +1,129 @@
+"""Tests for app.services.job_events and GET /jobs/stream."""
+
+import asyncio
+import json
+
+import pytest
+
+from app.models.automation import JobStatus, ProcessingJob
+from app.services import job_events
+from workers.job_log import JobLogBuffer
+
+
+@pytest.fixture
+def subscription(monkeypatch):
+    # Redis がない環境と同じくプロセス内のブローカーで配信する
+    monkeypatch.setattr("app.utils.redis_client.get_redis", lambda: None)
+    sub = asyncio.run(job_events.subscribe())
+    yield sub
+    asyncio.run(sub.close())
+
+
+def _drain(sub) -> list[dict]:
+    events = []
+    while (event := sub.get_nowait()) is not None:
+        events.append(event)
+    return events
+
+
+def _job(db, **fields):
+    job = ProcessingJob(status=JobStatus.received, **fields)
+    db.add(job)
+    db.commit()
+    return job
+
+
+def test_buffer_publishes_after_commit(db, subscription):
+    job = _job(db)
+    log = JobLogBuffer(db, job.id)
+    log.transition(job, JobStatus.parsing)
+    log.log("excel_parse", "started", "Excel解析を開始")
+    assert _drain(subscription) == []
+
+    log.flush()
+    events = _drain(subscription)
+    assert [e["type"] for e in events] == ["log", "status"]
+    assert events[0]["message"] == "Excel解析を開始"
+    assert events[1] == {
+        "type": "status", "job_id": job.id, "parent_job_id": None, "status": "parsing",
+        "error_message": None, "assigned_system": None,
+    }
+
+
+def test_discarded_transition_is_not_published(db, subscription):
+    job = _job(db)
+    with pytest.raises(RuntimeError):
+        with JobLogBuffer(db, job.id) as log:
+            log.transition(job, JobStatus.routing)
+            log.log("routing", "started", "振り分けを開始")
+            raise RuntimeError("boom")
+
+    events = _drain(subscription)
+    assert [e["type"] for e in events] == ["log"]
+    db.expire_all()
+    assert db.get(ProcessingJob, job.id).status == JobStatus.received
+
+
+def test_stream_events_formats_and_filters(subscription):
+    job_events.publish([
+        {"type": "log", "job_id": 2, "step_name": "routing", "status": "started", "message": "他のジョブ", "created_at": None},
+        {"type": "status", "job_id": 3, "parent_job_id": 1, "status": "pending_approval",
+         "error_message": None, "assigned_system": "system_a"},
+        {"type": "log", "job_id": 1, "step_name": "routing", "status": "completed", "message": "振り分け完了", "created_at": None},
+    ])
+    polls = 0
+
+    async def is_disconnected():
+        nonlocal polls
+        polls += 1
+        return polls > 5
+
+    async def collect():
+        return [chunk async for chunk in job_events.stream_events(subscription, is_disconnected, job_id=1, poll_interval=0)]
+
+    chunks = asyncio.run(collect())
+    assert chunks[0] == "retry: 3000\n\n"
+    assert [c.split("\n")[0] for c in chunks[1:]] == ["event: status", "event: log"]
+    assert json.loads(chunks[2].split("\n")[1].removeprefix("data: "))["message"] == "振り分け完了"
+
+
+def test_stream_sends_keepalive_when_idle(subscription):
+    polls = 0
+
+    async def is_disconnected():
+        nonlocal polls
+        polls += 1
+        return polls > 2
+
+    async def collect():
+        return [chunk async for chunk in job_events.stream_events(
+            subscription, is_disconnected, heartbeat_interval=0, poll_interval=0,
+        )]
+
+    assert asyncio.run(collect())[1:] == [": keepalive\n\n", ": keepalive\n\n"]
+
+
+def test_stream_rejects_invalid_ticket(client, monkeypatch):
+    monkeypatch.setattr("app.utils.redis_client.get_redis", lambda: None)
+    assert client.get("/api/v1/jobs/stream", params={"ticket": "invalid"}).status_code == 401
+    assert client.get("/api/v1/jobs/stream").status_code == 422
+
+
+def test_stream_ticket_requires_login(client):
+    assert client.post("/api/v1/jobs/stream-ticket").status_code == 401
+
+
+def test_stream_ticket_is_single_use(auth_client, monkeypatch):
+    monkeypatch.setattr("app.utils.redis_client.get_redis", lambda: None)
+    body = auth_client.post("/api/v1/jobs/stream-ticket").json()
+    assert body["expires_in"] == job_events.STREAM_TICKET_TTL
+    user_id = job_events.redeem_stream_ticket(body["ticket"])
+    assert user_id is not None
+    assert job_events.redeem_stream_ticket(body["ticket"]) is None
+
+
+def test_stream_ticket_expires(monkeypatch):
+    monkeypatch.setattr("app.utils.redis_client.get_redis", lambda: None)
+    monkeypatch.setattr(job_events, "STREAM_TICKET_TTL", -1)
+    ticket = job_events.issue_stream_ticket(1)
+    assert job_events.redeem_stream_ticket(ticket) is None
@@ -0,0 +1,109 @@
+"""Tests for workers.job_log and the job pipeline's log batching."""
+
+import pytest
+from sqlalchemy import event
+
+from app.models.automation import JobStatus, ProcessingJob, ProcessingLog
+from workers import job_log, job_processor
+from workers.job_log import JobLogBuffer
+
+
+@pytest.fixture()
+def statements():
+    """実行されたINSERT文とコミットの回数を数える"""
+    from tests.conftest import engine
+
+    counts = {"insert_logs": 0, "commits": 0}
+
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT INTO processing_logs"):
+            counts["insert_logs"] += 1
+
+    def on_commit(conn):
+        counts["commits"] += 1
+
+    event.listen(engine, "before_cursor_execute", before_execute)
+    event.listen(engine, "commit", on_commit)
+    yield counts
+    event.remove(engine, "before_cursor_execute", before_execute)
+    event.remove(engine, "commit", on_commit)
+
+
+def _job(db, **kwargs):
+    job = ProcessingJob(status=JobStatus.received, **kwargs)
+    db.add(job)
+    db.commit()
+    return job
+
+
+def _logs(db, job_id):
+    return db.query(ProcessingLog).filter(ProcessingLog.job_id == job_id).order_by(ProcessingLog.id).all()
+
+
+def test_buffer_writes_logs_in_one_transaction(db, statements):
+    job = _job(db)
+    statements.update(insert_logs=0, commits=0)
+    buffer = JobLogBuffer(db, job.id, max_delay=60)
+    buffer.transition(job, JobStatus.parsing)
+    for i in range(5):
+        buffer.log("excel_parse", "progress", f"{i}")
+    assert buffer.pending == 5
+    assert statements == {"insert_logs": 0, "commits": 0}
+
+    buffer.flush()
+    assert buffer.pending == 0
+    assert statements["commits"] == 1
+    assert [log.message for log in _logs(db, job.id)] == ["0", "1", "2", "3", "4"]
+    db.refresh(job)
+    assert job.status == JobStatus.parsing
+
+
+def test_buffer_flushes_after_max_delay(db):
+    job = _job(db)
+    buffer = JobLogBuffer(db, job.id, max_delay=0)
+    buffer.log("routing", "started", "振り分け判定を開始")
+    assert buffer.pending == 0
+    assert len(_logs(db, job.id)) == 1
+
+
+def test_buffer_keeps_logs_on_failure(db):
+    job = _job(db)
+    with pytest.raises(RuntimeError):
+        with JobLogBuffer(db, job.id) as buffer:
+            buffer.transition(job, JobStatus.executing)
+            buffer.log("web_input", "failed", "接続エラー")
+            raise RuntimeError("接続エラー")
+
+    # ステータス変更は取り消し、ログは残す
+    db.refresh(job)
+    assert job.status == JobStatus.received
+    assert [(log.step_name, log.status) for log in _logs(db, job.id)] == [("web_input", "failed")]
+
+
+def test_process_order_batches_logs(db, tmp_path, monkeypatch, statements):
+    from tests.conftest import TestingSessionLocal
+
+    path = tmp_path / "spec.csv"
+    path.write_text("発注先,株式会社A\n業務内容,保守\n月額単価,800000\n", encoding="utf-8")
+    job = _job(db, excel_file_path=str(path))
+    monkeypatch.setattr(job_processor, "SessionLocal", TestingSessionLocal)
+    monkeypatch.setattr(job_log, "MAX_DELAY", 60)
+    statements.update(insert_logs=0, commits=0)
+
+    result = job_processor.process_order(job.id)
+
+    assert result["status"] == "pending_approval"
+    # 解析キャッシュがあれば "cached" のログが入る
+    logs = [log for log in _logs(db, job.id) if log.status != "cached"]
+    assert [(log.step_name, log.status) for log in logs] == [
+        ("excel_parse", "started"),
+        ("excel_parse", "completed"),
+        ("routing", "started"),
+        ("routing", "manual_required"),
+        ("approval", "waiting"),
+    ]
+    assert statements["insert_logs"] <= 3
+    assert statements["commits"] <= 4
+    db.refresh(job)
+    assert job.status == JobStatus.pending_approval
+    assert job.result["order_data"]["発注先"] == "株式会社A"
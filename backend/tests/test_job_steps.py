@@ -0,0 +1,103 @@
+"""Tests for app.services.job_steps and resumable process_order_async."""
+
+from unittest.mock import patch
+
+import pytest
+from celery.exceptions import Retry
+
+from app.models.automation import JobStatus, ProcessingJob, ProcessingLog, ProcessingStepTiming
+from app.models.project import Project
+from app.services.job_steps import ORDER_REGISTRATION, WEB_INPUT, idempotency_key, run_steps
+from mcp_servers.common.mcp_base import MockMCPClient
+from workers import tasks
+
+
+@pytest.fixture(autouse=True)
+def worker_session(monkeypatch):
+    from tests.conftest import TestingSessionLocal
+
+    monkeypatch.setattr(tasks, "SessionLocal", TestingSessionLocal)
+
+
+def _approved_job(db):
+    job = ProcessingJob(
+        status=JobStatus.executing,
+        assigned_system="system_b",
+        result={"発注元": "株式会社クライアント", "案件名": "保守案件", "月額単価": "800000"},
+    )
+    db.add(job)
+    db.commit()
+    return job
+
+
+def test_retry_resumes_from_failed_step(db):
+    job = _approved_job(db)
+    submit = MockMCPClient.execute_order_input
+
+    with patch.object(MockMCPClient, "execute_order_input", side_effect=ConnectionError("タイムアウト")):
+        with pytest.raises(Retry):
+            tasks.process_order_async(job.id)
+
+    db.expire_all()
+    job = db.get(ProcessingJob, job.id)
+    assert job.status == JobStatus.failed
+    assert set(job.checkpoints) == {ORDER_REGISTRATION}
+    assert db.query(Project).count() == 1
+
+    with patch.object(MockMCPClient, "execute_order_input", autospec=True, side_effect=submit) as mock_submit:
+        assert tasks.process_order_async(job.id)["status"] == "completed"
+        assert mock_submit.call_args.args[2] == idempotency_key(job, WEB_INPUT)
+
+    db.expire_all()
+    job = db.get(ProcessingJob, job.id)
+    assert job.status == JobStatus.completed
+    assert set(job.checkpoints) == {ORDER_REGISTRATION, WEB_INPUT}
+    assert db.query(Project).count() == 1
+    statuses = [
+        log.status for log in db.query(ProcessingLog)
+        .filter(ProcessingLog.job_id == job.id, ProcessingLog.step_name == ORDER_REGISTRATION)
+        .order_by(ProcessingLog.id)
+    ]
+    assert statuses == ["started", "completed", "skipped"]
+
+
+def test_run_steps_skips_completed_steps(db):
+    job = _approved_job(db)
+    first = run_steps(db, job)
+    with patch("app.services.order_registration.register_order_from_job") as register:
+        again = run_steps(db, job)
+    register.assert_not_called()
+    assert again == first
+    assert db.query(Project).count() == 1
+    steps = [row.step for row in db.query(ProcessingStepTiming).order_by(ProcessingStepTiming.id)]
+    assert steps == ["register", "web_input"]
+
+
+def test_failed_step_is_rolled_back(db):
+    job = _approved_job(db)
+    with patch("app.services.mcp_executor.execute_mcp_input", side_effect=RuntimeError("入力エラー")):
+        with pytest.raises(RuntimeError):
+            run_steps(db, job)
+    db.refresh(job)
+    assert list(job.checkpoints) == [ORDER_REGISTRATION]
+    # Web入力の途中で追加したログはロールバックされる
+    assert db.query(ProcessingLog).filter(ProcessingLog.step_name == "Web入力").count() == 0
+
+
+def test_mock_client_is_idempotent():
+    client = MockMCPClient("system_a")
+    first = client.execute_order_input({}, idempotency_key="job-1:web_input")
+    assert client.execute_order_input({}, idempotency_key="job-1:web_input") == first
+    assert client.execute_order_input({})["confirmation_id"] != first["confirmation_id"]
+
+
+def test_mock_client_keeps_recent_submissions_per_instance():
+    client = MockMCPClient("system_a", max_submissions=2)
+    first = client.execute_order_input({}, idempotency_key="job-1:web_input")
+    client.execute_order_input({}, idempotency_key="job-2:web_input")
+    assert client.execute_order_input({}, idempotency_key="job-1:web_input") == first
+    client.execute_order_input({}, idempotency_key="job-3:web_input")
+
+    # 直近に使ったキーは残り、最も古いキーから捨てる
+    assert list(client._submissions) == ["job-1:web_input", "job-3:web_input"]
+    assert MockMCPClient("system_a").execute_order_input({}, idempotency_key="job-1:web_input") != first
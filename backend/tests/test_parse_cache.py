@@ -0,0 +1,196 @@
+"""Tests for workers.parse_cache."""
+
+import os
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+from openpyxl import Workbook
+
+from app.config import settings
+from app.models.automation import ExcelTemplate
+from workers import excel_parser, excel_templates
+from workers.parse_cache import DiskCacheBackend, ParseCache, dumps, loads, open_parsed
+
+
+@pytest.fixture(autouse=True)
+def reset_template_cache():
+    excel_templates._cache.update(stamp=None, templates=[], plans={}, selection={})
+
+
+@pytest.fixture()
+def cache(tmp_path):
+    return ParseCache(DiskCacheBackend(str(tmp_path / "cache"), max_bytes=1024 * 1024), max_entry_bytes=64 * 1024)
+
+
+@pytest.fixture()
+def table_xlsx(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["発注番号", "案件名", "開始日", "月額単価"])
+    ws.append(["PO-001", "決済システム改修", datetime(2025, 4, 1), 750000])
+    ws.append(["PO-002", "社内DX", datetime(2025, 5, 1), 850000])
+    path = tmp_path / "list.xlsx"
+    wb.save(str(path))
+    return str(path)
+
+
+def _read_all(db, path, cache):
+    with open_parsed(db, path, cache=cache) as parsed:
+        return parsed.format, list(parsed.iter_records()), parsed.from_cache
+
+
+def test_second_parse_skips_workbook(db, cache, table_xlsx):
+    first = _read_all(db, table_xlsx, cache)
+    with patch.object(excel_parser, "load_workbook") as mock_load:
+        second = _read_all(db, table_xlsx, cache)
+    mock_load.assert_not_called()
+    assert first[2] is False and second[2] is True
+    assert second[:2] == first[:2]
+    assert second[1][0]["開始日"] == datetime(2025, 4, 1)
+
+
+def test_partial_read_is_not_cached(db, cache, table_xlsx):
+    with open_parsed(db, table_xlsx, cache=cache) as parsed:
+        next(parsed.iter_records())
+    assert _read_all(db, table_xlsx, cache)[2] is False
+
+
+def test_template_change_invalidates(db, cache, table_xlsx):
+    _read_all(db, table_xlsx, cache)
+    db.add(ExcelTemplate(name="一覧", template_type="table", column_mappings={"案件名": "project_name"}))
+    db.commit()
+
+    _, records, from_cache = _read_all(db, table_xlsx, cache)
+    assert from_cache is False
+    assert records[0]["project_name"] == "決済システム改修"
+
+
+def test_key_value_cached(db, cache, tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws["A1"] = "案件名"
+    ws["B1"] = "ECサイトリニューアル"
+    path = str(tmp_path / "spec.xlsx")
+    wb.save(path)
+
+    for expected_from_cache in (False, True):
+        with open_parsed(db, path, cache=cache) as parsed:
+            assert parsed.format == "key_value"
+            assert parsed.data == {"案件名": "ECサイトリニューアル"}
+            assert parsed.from_cache is expected_from_cache
+
+
+def _multi_sheet_xlsx(tmp_path):
+    wb = Workbook()
+    for index, name in enumerate(("4月", "5月")):
+        ws = wb.active if index == 0 else wb.create_sheet()
+        ws.title = name
+        ws.append(["発注番号", "案件名", "月額単価"])
+        for n in range(3):
+            ws.append([f"PO-{index}{n}", "保守", 700000 + n])
+    ws = wb.create_sheet("仕様")
+    ws["A1"] = "案件名"
+    ws["B1"] = "ECサイト"
+    path = str(tmp_path / "multi.xlsx")
+    wb.save(path)
+    return path
+
+
+def _read_sheets(db, path, cache):
+    with open_parsed(db, path, cache=cache) as parsed:
+        sheets = [
+            (sheet.name, sheet.format, list(sheet.iter_records()), sheet.data, sheet.report["valid_rows"])
+            for sheet in parsed.iter_sheets(max_workers=1)
+        ]
+        return parsed.format, sheets, parsed.from_cache
+
+
+def test_multi_sheet_results_are_cached(db, cache, tmp_path):
+    path = _multi_sheet_xlsx(tmp_path)
+
+    first = _read_sheets(db, path, cache)
+    assert first[0] == "multi_sheet" and first[2] is False
+    assert [(name, fmt, len(records), data) for name, fmt, records, data, _ in first[1]] == [
+        ("4月", "table", 3, {}), ("5月", "table", 3, {}), ("仕様", "key_value", 0, {"案件名": "ECサイト"}),
+    ]
+    with patch.object(excel_parser, "WorkbookSession") as mock_session, \
+            patch("workers.parse_cache.WorkbookSession", mock_session), \
+            patch("workers.multi_sheet.WorkbookSession", mock_session):
+        second = _read_sheets(db, path, cache)
+        with open_parsed(db, path, cache=cache) as parsed:
+            assert [(s.name, s.format) for s in parsed.sheets] == [("4月", "table"), ("5月", "table"), ("仕様", "key_value")]
+    mock_session.assert_not_called()
+    assert second[2] is True
+    assert second[1] == first[1]
+
+
+def test_partially_read_multi_sheet_is_not_cached(db, cache, tmp_path):
+    path = _multi_sheet_xlsx(tmp_path)
+    with open_parsed(db, path, cache=cache) as parsed:
+        sheet = next(parsed.iter_sheets(max_workers=1))
+        list(sheet.iter_records())
+    assert _read_sheets(db, path, cache)[2] is False
+
+
+def test_single_data_sheet_behind_empty_cover(db, cache, tmp_path):
+    wb = Workbook()
+    cover = wb.active
+    cover.title = "表紙"
+    ws = wb.create_sheet("一覧")
+    ws.append(["発注番号", "案件名", "月額単価"])
+    ws.append(["PO-001", "保守", 700000])
+    ws.append(["PO-002", "運用", 800000])
+    wb.active = 0
+    path = str(tmp_path / "cover.xlsx")
+    wb.save(path)
+
+    for expected_from_cache in (False, True):
+        fmt, records, from_cache = _read_all(db, path, cache)
+        assert (fmt, from_cache) == ("table", expected_from_cache)
+        assert [r["発注番号"] for r in records] == ["PO-001", "PO-002"]
+
+
+def test_oversized_file_is_rejected_before_hashing(db, cache, table_xlsx):
+    from workers import parse_cache
+    from workers.excel_parser import ExcelParseError
+
+    with patch.object(settings, "EXCEL_MAX_FILE_BYTES", 100), \
+            patch.object(parse_cache, "file_digest") as digest:
+        with pytest.raises(ExcelParseError, match="ファイルサイズ"):
+            _read_all(db, table_xlsx, cache)
+    digest.assert_not_called()
+
+
+def test_stricter_limits_do_not_use_cached_result(db, cache, table_xlsx):
+    from workers.excel_parser import ExcelParseError
+
+    _read_all(db, table_xlsx, cache)
+    with patch.object(settings, "EXCEL_MAX_ROWS", 1):
+        with pytest.raises(ExcelParseError, match="行数が上限"):
+            _read_all(db, table_xlsx, cache)
+    assert _read_all(db, table_xlsx, cache)[2] is True
+
+
+def test_disk_backend_evicts_least_recently_used(tmp_path):
+    backend = DiskCacheBackend(str(tmp_path), max_bytes=250)
+    backend.set("a", b"x" * 100)
+    backend.set("b", b"x" * 100)
+    # a を参照して b より新しくする
+    os.utime(tmp_path / "b.json", (0, 0))
+    assert backend.get("a") is not None
+    backend.set("c", b"x" * 100)
+    assert backend.get("b") is None
+    assert backend.get("a") is not None
+    assert backend.get("c") is not None
+
+
+def test_oversized_entry_is_skipped(tmp_path):
+    cache = ParseCache(DiskCacheBackend(str(tmp_path), max_bytes=1024), max_entry_bytes=10)
+    assert cache.set("k", {"format": "key_value", "data": {"案件名": "長い値" * 10}}) is False
+    assert cache.get("k") is None
+
+
+def test_serialization_keeps_types():
+    payload = {"records": [{"日付": datetime(2025, 4, 1, 9, 30), "金額": 1.5, "空": None}]}
+    assert loads(dumps(payload)) == payload
@@ -1,4 +1,6 @@
 import io
+from datetime import date
+from unittest.mock import patch
 
 import pytest
 
@@ -7,11 +9,17 @@ from app.models.project import Project
 from app.models.engineer import Engineer
 from app.models.quotation import Quotation
 from app.models.order import Order
+from app.models.contract import Contract, ContractType
+from app.models.invoice import Invoice, InvoiceStatus
 from app.models.payment import Payment, PaymentStatus
 from app.services.reconciliation import (
+    _SearchBudgetExceeded,
+    _find_subset_sum,
     _levenshtein_distance,
     _normalize_company_name,
     _similarity_ratio,
+    match_new_payments,
+    match_sent_invoice,
 )
 
 
@@ -206,6 +214,227 @@ def test_list_with_status_filter(auth_client):
     assert response.json()["total"] == 2
 
 
+# ---------------------------------------------------------------------------
+# Event-driven incremental matching
+# ---------------------------------------------------------------------------
+
+
+def test_import_enqueues_match_for_new_payments(auth_client):
+    csv_content = "入金日,金額,振込人\n2026-04-15,100000,A\n2026-04-16,200000,B\n"
+    files = {"file": ("payments.csv", io.BytesIO(csv_content.encode("utf-8")), "text/csv")}
+    with patch("workers.tasks.match_new_payments_task.delay") as mock_delay:
+        res = auth_client.post(f"{API}/import", files=files)
+    assert res.status_code == 200
+    ids = [p["id"] for p in res.json()["payments"]]
+    mock_delay.assert_called_once_with(ids)
+
+
+def test_send_invoice_enqueues_match(auth_client, db):
+    with patch("workers.tasks.match_sent_invoice_task.delay") as mock_delay:
+        invoice_id = _create_invoice_via_api(auth_client, db)
+    mock_delay.assert_called_once_with(invoice_id)
+
+
+def test_match_new_payments_only_touches_given_ids(auth_client, db):
+    invoice_id = _create_invoice_via_api(auth_client, db)
+    old = Payment(payment_date=date(2026, 4, 1), amount=550000, payer_name="Old")
+    new = Payment(payment_date=date(2026, 4, 15), amount=550000, payer_name="New", reference_number="INV-REC-001")
+    db.add_all([old, new])
+    db.commit()
+
+    results = match_new_payments(db, [new.id])
+    assert len(results) == 1
+    assert results[0]["payment_id"] == new.id
+    assert results[0]["invoice_id"] == invoice_id
+
+    db.refresh(old)
+    assert old.status == PaymentStatus.unmatched
+
+    # 照合済みの請求書は次のイベントで再度マッチしない
+    results = match_new_payments(db, [old.id])
+    assert results[0]["status"] == "unmatched"
+
+
+def test_match_sent_invoice_against_outstanding_payments(auth_client, db):
+    unrelated = Payment(payment_date=date(2026, 4, 10), amount=123456, payer_name="Other")
+    payment = Payment(payment_date=date(2026, 4, 15), amount=550000, payer_name="テスト", reference_number="INV-REC-001")
+    db.add_all([unrelated, payment])
+    db.commit()
+
+    invoice_id = _create_invoice_via_api(auth_client, db)
+    result = match_sent_invoice(db, invoice_id)
+    assert result["payment_id"] == payment.id
+    assert result["status"] == "matched"
+
+    db.refresh(unrelated)
+    assert unrelated.status == PaymentStatus.unmatched
+    # 既に照合済みの請求書は対象外
+    assert match_sent_invoice(db, invoice_id) is None
+
+
+# ---------------------------------------------------------------------------
+# Combination matching (one payment for several invoices / split payments)
+# ---------------------------------------------------------------------------
+
+
+def _create_sent_invoices(db, company_name, amounts):
+    """取引先1社分の送付済み請求書を金額ごとに作成して返す。"""
+    co = Company(name=company_name, company_type="client")
+    db.add(co)
+    db.flush()
+    p = Project(name=f"{company_name} Project", client_company_id=co.id)
+    e = Engineer(full_name="Combo Engineer", email=f"combo-{co.id}@test.com")
+    db.add_all([p, e])
+    db.flush()
+    q = Quotation(project_id=p.id, engineer_id=e.id, unit_price=500000, estimated_hours=160, total_amount=500000)
+    db.add(q)
+    db.flush()
+    o = Order(quotation_id=q.id, order_number=f"ORD-COMBO-{co.id}")
+    db.add(o)
+    db.flush()
+    c = Contract(
+        order_id=o.id, contract_number=f"CON-COMBO-{co.id}", contract_type=ContractType.quasi_delegation,
+        engineer_id=e.id, project_id=p.id, start_date=date(2026, 4, 1), end_date=date(2026, 9, 30),
+        monthly_rate=500000,
+    )
+    db.add(c)
+    db.flush()
+    invoices = []
+    for i, amount in enumerate(amounts, start=1):
+        inv = Invoice(
+            contract_id=c.id, invoice_number=f"INV-{co.id}-{i:02d}", billing_month=date(2026, i, 1),
+            working_hours=160, base_amount=amount, tax_amount=0, total_amount=amount,
+            status=InvoiceStatus.sent,
+        )
+        db.add(inv)
+        invoices.append(inv)
+    db.commit()
+    return invoices
+
+
+def test_auto_match_one_payment_for_several_invoices(auth_client, db):
+    invoices = _create_sent_invoices(db, "コンボ商事", [110000, 220000, 330000, 470000])
+    csv_content = "入金日,金額,振込人\n2026-04-15,580000,コンボ商事\n"
+    files = {"file": ("payments.csv", io.BytesIO(csv_content.encode("utf-8")), "text/csv")}
+    payment_id = auth_client.post(f"{API}/import", files=files).json()["payments"][0]["id"]
+
+    results = auth_client.post(f"{API}/match").json()["results"]
+    assert results[0]["status"] == "matched"
+    assert results[0]["match_type"] == "combination"
+    assert sorted(results[0]["invoice_ids"]) == sorted([invoices[0].id, invoices[3].id])
+
+    # 確定すると割当先の請求書がすべて入金済みになる
+    auth_client.post(f"{API}/{payment_id}/confirm")
+    paid = [i for i in invoices if auth_client.get(f"/api/v1/invoices/{i.id}").json()["status"] == "paid"]
+    assert len(paid) == 2
+
+
+def test_auto_match_split_payment(auth_client, db):
+    invoices = _create_sent_invoices(db, "スプリット工業", [550000])
+    csv_content = "入金日,金額,振込人\n2026-04-15,300000,スプリット工業\n2026-04-20,250000,スプリット工業\n"
+    files = {"file": ("payments.csv", io.BytesIO(csv_content.encode("utf-8")), "text/csv")}
+    auth_client.post(f"{API}/import", files=files)
+
+    results = auth_client.post(f"{API}/match").json()["results"]
+    assert [r["status"] for r in results] == ["matched", "matched"]
+    assert all(r["match_type"] == "split" for r in results)
+    assert all(r["invoice_id"] == invoices[0].id for r in results)
+
+
+def test_split_payment_partners_are_narrowed_in_sql(db):
+    invoices = _create_sent_invoices(db, "スプリット工業", [550000])
+    backlog = [
+        Payment(payment_date=date(2026, 3, 1), amount=900000 + i, payer_name=f"バックログ{i}")
+        for i in range(20)
+    ]
+    partner = Payment(payment_date=date(2026, 4, 15), amount=300000, payer_name="スプリット工業")
+    other = Payment(payment_date=date(2026, 4, 16), amount=100000, payer_name="別会社")
+    new = Payment(payment_date=date(2026, 4, 20), amount=250000, payer_name="スプリット工業")
+    db.add_all(backlog + [partner, other, new])
+    db.commit()
+
+    from app.services import reconciliation
+
+    resolved = []
+    original = reconciliation._resolve_payer_company
+
+    def spy(payer_name, company_names):
+        resolved.append(payer_name)
+        return original(payer_name, company_names)
+
+    with patch.object(reconciliation, "_resolve_payer_company", side_effect=spy):
+        results = match_new_payments(db, [new.id])
+
+    assert results[0]["match_type"] == "split"
+    assert results[0]["payment_ids"] == [partner.id, new.id]
+    assert results[0]["invoice_id"] == invoices[0].id
+    # 請求額を超える入金の振込人名はあいまい一致にかけない
+    assert not any(name.startswith("バックログ") for name in resolved)
+    assert resolved.count("別会社") == 1
+
+
+def test_unmatch_split_payment_releases_whole_group(auth_client, db):
+    invoices = _create_sent_invoices(db, "スプリット工業", [550000])
+    csv_content = "入金日,金額,振込人\n2026-04-15,300000,スプリット工業\n2026-04-20,250000,スプリット工業\n"
+    files = {"file": ("payments.csv", io.BytesIO(csv_content.encode("utf-8")), "text/csv")}
+    payment_ids = [p["id"] for p in auth_client.post(f"{API}/import", files=files).json()["payments"]]
+    auth_client.post(f"{API}/match")
+
+    resp = auth_client.post(f"{API}/{payment_ids[1]}/unmatch")
+    assert resp.status_code == 200
+    assert resp.json()["payment_ids"] == sorted(payment_ids)
+
+    db.expire_all()
+    payments = db.query(Payment).filter(Payment.id.in_(payment_ids)).all()
+    assert {(p.status, p.invoice_id, p.notes) for p in payments} == {(PaymentStatus.unmatched, None, None)}
+
+    # 請求書は再び照合できる
+    results = auth_client.post(f"{API}/match").json()["results"]
+    assert [(r["status"], r["invoice_id"]) for r in results] == [("matched", invoices[0].id)] * 2
+
+
+def test_auto_match_combination_requires_known_payer(auth_client, db):
+    _create_sent_invoices(db, "コンボ商事", [100000, 200000])
+    csv_content = "入金日,金額,振込人\n2026-04-15,300000,無関係な振込人\n"
+    files = {"file": ("payments.csv", io.BytesIO(csv_content.encode("utf-8")), "text/csv")}
+    auth_client.post(f"{API}/import", files=files)
+
+    results = auth_client.post(f"{API}/match").json()["results"]
+    assert results[0]["status"] == "unmatched"
+
+
+class TestFindSubsetSum:
+    """Tests for _find_subset_sum()."""
+
+    def test_finds_pair(self):
+        assert sorted(_find_subset_sum(300, [(1, 100), (2, 200), (3, 50)])) == [1, 2]
+
+    def test_prefers_fewest_items(self):
+        items = [(1, 100), (2, 200), (3, 300), (4, 600)]
+        assert sorted(_find_subset_sum(600, items, min_items=1)) == [4]
+
+    def test_ambiguous_returns_none(self):
+        assert _find_subset_sum(200, [(1, 100), (2, 100), (3, 100)]) is None
+
+    def test_no_solution(self):
+        assert _find_subset_sum(999, [(1, 100), (2, 200)]) is None
+
+    def test_respects_max_items(self):
+        items = [(i, 10) for i in range(1, 5)]
+        assert _find_subset_sum(40, items, max_items=3) is None
+        assert sorted(_find_subset_sum(40, items, max_items=4)) == [1, 2, 3, 4]
+
+    def test_many_candidates(self):
+        items = [(i, 2 ** i) for i in range(40)]
+        target = 2 ** 3 + 2 ** 17 + 2 ** 35
+        assert sorted(_find_subset_sum(target, items)) == [3, 17, 35]
+
+    def test_budget_exceeded(self):
+        items = [(i, 1000 + i) for i in range(40)]
+        with pytest.raises(_SearchBudgetExceeded):
+            _find_subset_sum(10 ** 9, items, deadline=0)
+
+
 # ---------------------------------------------------------------------------
 # Unit tests for fuzzy matching helpers
 # ---------------------------------------------------------------------------
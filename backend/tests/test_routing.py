@@ -0,0 +1,292 @@
+"""Tests for app.services.routing and workers.routing_engine."""
+
+import random
+
+import pytest
+from sqlalchemy import event
+
+from app.models.automation import RoutingRule, TargetSystem
+from app.services import routing
+from app.services.mcp_executor import determine_target_system
+from app.services.metrics import metrics
+from app.services.routing import CompiledRule, CompiledRuleSet, routing_fields
+from workers.routing_engine import RoutingEngine
+
+
+@pytest.fixture(autouse=True)
+def reset_rule_cache():
+    routing._cache.update({"version": None, "compiled": None, "loaded_at": 0.0})
+    metrics.reset()
+    yield
+    routing._cache.update({"version": None, "compiled": None, "loaded_at": 0.0})
+
+
+def _add_rule(db, condition_type, condition_value, target="system_a", priority=10, **kwargs):
+    rule = RoutingRule(
+        name=f"{condition_type}:{condition_value}",
+        condition_type=condition_type,
+        condition_value=condition_value,
+        target_system=TargetSystem(target),
+        priority=priority,
+        **kwargs,
+    )
+    db.add(rule)
+    db.commit()
+    return rule
+
+
+def _evaluate(rule: CompiledRule, data: dict) -> bool:
+    """ルールを1件ずつ評価する素朴な実装 (コンパイル済みの判定と突き合わせる)"""
+    ctype, cval = rule.condition_type, rule.condition_value
+    if ctype == "vendor_name":
+        return data.get("vendor_name", "") == cval
+    if ctype == "vendor_name_contains":
+        return cval in data.get("vendor_name", "")
+    if ctype == "category":
+        return data.get("category", "") == cval
+    if ctype in ("amount_gte", "amount_lt"):
+        amount = data.get("amount", 0)
+        if not isinstance(amount, (int, float)):
+            return False
+        return amount >= float(cval) if ctype == "amount_gte" else amount < float(cval)
+    if ctype == "keyword":
+        return cval in str(data.get("description", ""))
+    return False
+
+
+def test_compiled_rules_match_sequential_evaluation():
+    rng = random.Random(0)
+    words = ["ABC", "AB", "BC", "テック", "システム", "開発", "保守", ""]
+    rules = []
+    for i in range(60):
+        ctype = rng.choice(["vendor_name", "vendor_name_contains", "category", "amount_gte", "amount_lt", "keyword"])
+        if ctype.startswith("amount"):
+            value = str(rng.randrange(0, 2_000_000, 100_000))
+        else:
+            value = "".join(rng.sample(words, rng.randint(1, 2)))
+        rules.append(CompiledRule(i, f"r{i}", ctype, value, rng.choice(["system_a", "system_b"]), i))
+    compiled = CompiledRuleSet(rules)
+
+    for _ in range(500):
+        data = {
+            "vendor_name": "".join(rng.sample(words, rng.randint(0, 3))),
+            "category": "".join(rng.sample(words, rng.randint(1, 2))),
+            "amount": rng.choice([rng.randrange(0, 2_000_000, 50_000), "未定", 1_000_000.0]),
+            "description": "".join(rng.sample(words, rng.randint(0, 4))),
+        }
+        expected = next((rule for rule in rules if _evaluate(rule, data)), None)
+        assert compiled.match(routing_fields(data)) == expected
+
+
+def test_compiled_rules_prefer_priority_across_condition_types():
+    compiled = CompiledRuleSet([
+        CompiledRule(1, "keyword", "keyword", "保守", "system_b", 1),
+        CompiledRule(2, "vendor", "vendor_name", "株式会社A", "system_a", 2),
+        CompiledRule(3, "bad amount", "amount_gte", "abc", "system_a", 3),
+    ])
+    assert compiled.match(routing_fields({"vendor_name": "株式会社A", "description": "保守運用"})).id == 1
+    assert compiled.match(routing_fields({"vendor_name": "株式会社A", "description": "開発"})).id == 2
+    assert compiled.match(routing_fields({"amount": 100})) is None
+    assert compiled.match(routing_fields({"vendor_name": None})) is None
+
+
+def test_routing_engine_caches_compiled_rules(db):
+    from tests.conftest import engine
+
+    _add_rule(db, "vendor_name", "株式会社A", "system_b", priority=1)
+    routing_engine = RoutingEngine(db)
+    assert routing_engine.determine_target({"vendor_name": "株式会社A"}) == "system_b"
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])  # noqa: E731
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        for _ in range(5):
+            assert routing_engine.determine_target({"vendor_name": "株式会社A"}) == "system_b"
+            assert routing_engine.determine_target({"vendor_name": "株式会社B"}) is None
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert statements == []
+
+
+def test_routing_engine_recompiles_after_rule_change(db):
+    rule = _add_rule(db, "amount_gte", "1000000", "system_b", priority=1)
+    routing_engine = RoutingEngine(db)
+    assert routing_engine.determine_target({"amount": 1_500_000}) == "system_b"
+
+    rule.condition_value = "2000000"
+    db.commit()
+    assert routing_engine.determine_target({"amount": 1_500_000}) is None
+
+    _add_rule(db, "amount_lt", "2000000", "system_a", priority=2)
+    assert routing_engine.determine_target({"amount": 1_500_000}) == "system_a"
+
+    rule.is_active = False
+    db.rollback()
+    assert routing_engine.determine_target({"amount": 2_500_000}) == "system_b"
+
+
+def test_routing_engine_recompiles_after_max_age(db, monkeypatch):
+    routing_engine = RoutingEngine(db)
+    assert routing_engine.determine_target({"category": "保守"}) is None
+
+    # ORMを経由しない変更はバージョンに反映されないが、RULES_MAX_AGE を過ぎれば読み直す
+    db.execute(RoutingRule.__table__.insert().values(
+        name="cat", condition_type="category", condition_value="保守",
+        target_system=TargetSystem.system_b, priority=1, is_active=True,
+    ))
+    db.commit()
+    assert routing_engine.determine_target({"category": "保守"}) is None
+
+    monkeypatch.setattr(routing, "RULES_MAX_AGE", 0.0)
+    assert routing_engine.determine_target({"category": "保守"}) == "system_b"
+
+
+def test_routing_fields_accept_any_naming():
+    expected = {"vendor_name": "株式会社A", "category": "保守", "amount": 800000.0, "description": "保守"}
+    assert routing_fields({"発注先": " 株式会社A ", "業務内容": "保守", "月額単価": "¥800,000"}) == expected
+    assert routing_fields({"company_name": "株式会社A", "project_description": "保守", "unit_price": "800,000"}) == expected
+    assert routing_fields({}) == {"vendor_name": "", "category": "", "amount": 0, "description": ""}
+
+
+@pytest.mark.parametrize("amount", ["nan", "inf", "-Infinity", float("nan"), float("inf")])
+def test_non_finite_amount_is_not_a_number(amount):
+    assert routing_fields({"amount": amount})["amount"] is None
+
+
+def test_remote_version_is_checked_once_per_interval(db, monkeypatch):
+    class CountingRedis:
+        version = 0
+        gets = 0
+
+        def get(self, key):
+            self.gets += 1
+            return self.version
+
+    redis = CountingRedis()
+    monkeypatch.setattr("app.utils.redis_client.get_redis", lambda: redis)
+    _add_rule(db, "category", "保守", "system_b", priority=1)
+    routing_engine = RoutingEngine(db)
+    for _ in range(5):
+        assert routing_engine.determine_target({"category": "保守"}) == "system_b"
+    assert redis.gets == 1
+
+    # 他プロセスでの変更は確認の間隔を過ぎてから反映する
+    db.execute(RoutingRule.__table__.update().values(target_system=TargetSystem.system_a))
+    db.commit()
+    redis.version = 1
+    assert routing_engine.determine_target({"category": "保守"}) == "system_b"
+    monkeypatch.setattr(routing, "RULES_VERSION_CHECK_INTERVAL", 0.0)
+    assert routing_engine.determine_target({"category": "保守"}) == "system_a"
+
+
+def test_mcp_executor_shares_routing_rules(db):
+    _add_rule(db, "vendor_name_contains", "テック", "system_b", priority=1)
+    _add_rule(db, "amount_gte", "1000000", "system_b", priority=2)
+
+    assert determine_target_system(db, {"company_name": "株式会社テック"}) == "system_b"
+    assert determine_target_system(db, {"order_data": {"発注先": "株式会社テック"}, "record_count": 1}) == "system_b"
+    assert determine_target_system(db, {"月額単価": 1_200_000}) == "system_b"
+    assert determine_target_system(db, {"company_name": "株式会社A"}) == "system_a"
+
+
+def test_match_batch_equals_single_matches():
+    rng = random.Random(1)
+    rules = [
+        CompiledRule(1, "a", "vendor_name_contains", "テック", "system_b", 1),
+        CompiledRule(2, "b", "amount_gte", "1000000", "system_b", 2),
+        CompiledRule(3, "c", "amount_lt", "600000", "system_a", 3),
+        CompiledRule(4, "d", "category", "保守", "system_a", 4),
+        CompiledRule(5, "e", "keyword", "AI", "system_b", 5),
+    ]
+    compiled = CompiledRuleSet(rules)
+    fields_list = [
+        routing_fields({
+            "発注先": rng.choice(["株式会社テック", "株式会社A", None]),
+            "月額単価": rng.choice([500_000, 800_000, 1_200_000, "未定"]),
+            "業務内容": rng.choice(["保守", "AI開発", "開発"]),
+        })
+        for _ in range(300)
+    ]
+    assert compiled.match_batch(fields_list) == [compiled.match(fields) for fields in fields_list]
+    assert compiled.match_batch([]) == []
+
+
+def test_determine_targets_reports_hits(db):
+    vendor = _add_rule(db, "vendor_name", "株式会社A", "system_b", priority=1)
+    amount = _add_rule(db, "amount_gte", "1000000", "system_a", priority=2)
+
+    batch = RoutingEngine(db).determine_targets([
+        {"vendor_name": "株式会社A", "amount": 2_000_000},
+        {"vendor_name": "株式会社B", "amount": 2_000_000},
+        {"vendor_name": "株式会社A"},
+        {"vendor_name": "株式会社C", "amount": 10},
+    ])
+    assert batch.targets == ["system_b", "system_a", "system_b", None]
+    assert batch.hits == {vendor.id: 2, amount.id: 1}
+    assert batch.unmatched == 1
+    assert batch.to_dict() == {"hits": {str(vendor.id): 2, str(amount.id): 1}, "unmatched": 1}
+
+
+def test_routing_metrics(db, auth_client):
+    vendor = _add_rule(db, "vendor_name", "株式会社A", "system_b", priority=1)
+    amount = _add_rule(db, "amount_gte", "1000000", "system_a", priority=2)
+    routing_engine = RoutingEngine(db)
+    routing_engine.determine_targets([{"vendor_name": "株式会社A", "amount": 2_000_000}, {"amount": 10}])
+    routing_engine.determine_target({"amount": 2_000_000})
+
+    response = auth_client.get("/api/v1/routing/metrics")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["evaluations"] == 3
+    assert data["unmatched"] == 1
+    assert data["rules"] == {
+        str(vendor.id): {"hits": 1, "misses": 2},
+        str(amount.id): {"hits": 1, "misses": 2},
+    }
+    assert data["latency"]["batch"]["count"] == 1
+    assert data["latency"]["single"]["buckets"]["+Inf"] == 1
+
+    text = auth_client.get("/api/metrics").text
+    assert f'routing_rule_hits_total{{rule_id="{vendor.id}"}} 1' in text
+    assert "routing_evaluations_total 3" in text
+
+
+def test_simulate_routing_diff(db, auth_client):
+    from app.models.automation import JobStatus, ProcessingJob
+
+    rule = _add_rule(db, "amount_gte", "1000000", "system_b", priority=1)
+    jobs = [
+        ProcessingJob(status=JobStatus.completed, result={"月額単価": 1_200_000}),
+        ProcessingJob(status=JobStatus.completed, result={"record_count": 1, "order_data": {"月額単価": 800_000}}),
+        ProcessingJob(status=JobStatus.pending_approval, result={"発注先": "株式会社テック", "月額単価": 900_000}),
+        ProcessingJob(status=JobStatus.completed, result={"format": "table", "child_count": 2}),
+        ProcessingJob(status=JobStatus.failed, result=None),
+    ]
+    db.add_all(jobs)
+    db.commit()
+
+    response = auth_client.post("/api/v1/routing/simulate", json={"rules": [
+        {"id": rule.id, "name": "高額", "condition_type": "amount_gte", "condition_value": "850000",
+         "target_system": "system_b", "priority": 2},
+        {"name": "テック", "condition_type": "vendor_name_contains", "condition_value": "テック",
+         "target_system": "system_a", "priority": 1},
+    ]})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["jobs"] == 3
+    assert data["changed"] == 1
+    assert data["transitions"] == {"manual -> system_a": 1}
+    assert data["changes"] == [{"job_id": jobs[2].id, "current": None, "proposed": "system_a",
+                                "current_rule_id": None, "proposed_rule_id": -2}]
+    assert data["current"] == {"hits": {str(rule.id): 1}, "unmatched": 2}
+    assert data["proposed"] == {"hits": {str(rule.id): 1, "-2": 1}, "unmatched": 1}
+
+    filtered = auth_client.post("/api/v1/routing/simulate", json={"rules": [], "statuses": ["pending_approval"]})
+    assert filtered.json()["transitions"] == {}
+    assert filtered.json()["jobs"] == 1
+
+
+def test_simulate_routing_requires_admin(sales_client):
+    response = sales_client.post("/api/v1/routing/simulate", json={"rules": []})
+    assert response.status_code == 403
@@ -363,3 +363,122 @@ class TestHandleJobApproval:
             )
         assert response.status_code == 200
         mock_reg.assert_not_called()
+
+
+# ---------------------------------------------------------------------------
+# Child jobs from table-format Excel
+# ---------------------------------------------------------------------------
+
+
+class TestCreateChildJobsFromTable:
+    """Child jobs created from an order list should be routed in batches."""
+
+    def test_child_jobs_are_routed(self, db):
+        from app.models.automation import RoutingRule, TargetSystem
+        from app.routers import slack
+        from app.services import routing
+
+        routing._cache.update({"version": None, "compiled": None, "loaded_at": 0.0})
+        db.add(RoutingRule(name="A社", condition_type="vendor_name", condition_value="株式会社A",
+                           target_system=TargetSystem.system_b, priority=1))
+        parent = ProcessingJob(status=JobStatus.parsing)
+        db.add(parent)
+        db.commit()
+
+        parsed = MagicMock()
+        parsed.iter_records.return_value = iter([{"発注先": "株式会社A"}, {"発注先": "株式会社B"}])
+        parsed.report = {"valid_rows": 2, "invalid_rows": 0, "errors": [], "truncated": False}
+        with patch.object(routing, "ROUTING_BATCH_SIZE", 1):
+            outcome = slack._create_child_jobs_from_table(db, parent, parsed)
+        db.commit()
+
+        children = db.query(ProcessingJob).filter(ProcessingJob.id != parent.id).order_by(ProcessingJob.id).all()
+        assert [child.assigned_system for child in children] == ["system_b", None]
+        assert parent.result["child_count"] == 2
+        assert parent.result["routing"]["unmatched"] == 1
+        assert outcome["children"] == [(children[0].id, "1件目"), (children[1].id, "2件目")]
+
+
+class TestParseUpload:
+    """A failure while creating child jobs should leave no children behind."""
+
+    def test_row_limit_mid_stream_rolls_back_children(self, db, tmp_path, monkeypatch):
+        from app.config import settings
+        from app.models.automation import DeadLetterJob
+        from app.routers import slack
+        from app.services import routing
+
+        path = tmp_path / "list.csv"
+        path.write_text("発注先,業務内容\n" + "".join(f"株式会社{i},保守\n" for i in range(15)), encoding="utf-8")
+        monkeypatch.setattr(settings, "EXCEL_MAX_ROWS", 10)
+        monkeypatch.setattr(routing, "ROUTING_BATCH_SIZE", 3)
+        parent = ProcessingJob(status=JobStatus.parsing, excel_file_path=str(path))
+        db.add(parent)
+        db.commit()
+
+        outcome = slack._parse_upload(db, parent, str(path))
+
+        assert "行数が上限" in outcome["error"]
+        assert db.query(ProcessingJob).filter(ProcessingJob.parent_job_id == parent.id).count() == 0
+        db.refresh(parent)
+        assert parent.status == JobStatus.failed
+        dead_letter = db.query(DeadLetterJob).filter(DeadLetterJob.job_id == parent.id).one()
+        assert dead_letter.step == "parse"
+
+    def test_all_rows_invalid_fails_parent(self, db, tmp_path):
+        from app.models.automation import DeadLetterJob, ExcelTemplate
+        from app.routers import slack
+        from workers import excel_templates
+
+        excel_templates._cache.update(stamp=None, templates=[], plans={}, selection={})
+        db.add(ExcelTemplate(
+            name="一覧", template_type="table",
+            column_mappings={"発注先": "vendor", "業務内容": "description", "月額単価": "unit_price"},
+            validation_rules={"types": {"unit_price": "int"}},
+        ))
+        db.commit()
+        path = tmp_path / "list.csv"
+        path.write_text("発注先,業務内容,月額単価\n株式会社A,保守,未定\n株式会社B,保守,未定\n", encoding="utf-8")
+        parent = ProcessingJob(status=JobStatus.parsing, excel_file_path=str(path))
+        db.add(parent)
+        db.commit()
+
+        outcome = slack._parse_upload(db, parent, str(path))
+
+        assert outcome["error"].startswith("検証エラー: ")
+        assert db.query(ProcessingJob).filter(ProcessingJob.parent_job_id == parent.id).count() == 0
+        db.refresh(parent)
+        assert parent.status == JobStatus.failed
+        assert parent.result["validation"]["invalid_rows"] == 2
+        dead_letter = db.query(DeadLetterJob).filter(DeadLetterJob.job_id == parent.id).one()
+        assert dead_letter.error_class == "ValidationError"
+
+    def test_multi_sheet_is_parsed_without_process_pool(self, db, tmp_path, monkeypatch):
+        from openpyxl import Workbook
+
+        from app.routers import slack
+        from app.services import routing
+        from workers import multi_sheet
+
+        wb = Workbook()
+        for index, name in enumerate(("4月", "5月")):
+            ws = wb.active if index == 0 else wb.create_sheet()
+            ws.title = name
+            ws.append(["発注先", "業務内容", "月額単価"])
+            for n in range(3):
+                ws.append([f"株式会社{index}{n}", "保守", 700000])
+        path = tmp_path / "multi.xlsx"
+        wb.save(str(path))
+        monkeypatch.setattr(routing, "ROUTING_BATCH_SIZE", 2)
+        monkeypatch.setattr(multi_sheet, "MAX_WORKERS", 4)
+        monkeypatch.setattr(multi_sheet, "ProcessPoolExecutor", None)
+        parent = ProcessingJob(status=JobStatus.parsing, excel_file_path=str(path))
+        db.add(parent)
+        db.commit()
+
+        outcome = slack._parse_upload(db, parent, str(path))
+
+        assert len(outcome["children"]) == 6
+        db.refresh(parent)
+        assert parent.status == JobStatus.completed
+        assert parent.result["sheets"] == {"4月": 3, "5月": 3}
@@ -0,0 +1,94 @@
+"""Tests for app.services.step_timing and GET /jobs/metrics."""
+
+from datetime import timedelta
+
+import pytest
+
+from app.models.automation import JobStatus, ProcessingJob, ProcessingStepTiming
+from app.services import step_timing
+from app.services.metrics import metrics
+from app.services.step_timing import record_timings, step_percentiles, timing_row, utcnow
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+
+
+def _job(db):
+    job = ProcessingJob(status=JobStatus.received)
+    db.add(job)
+    db.commit()
+    return job
+
+
+def _record(db, job, step, durations_ms, status="completed", finished_at=None):
+    finished_at = finished_at or utcnow()
+    record_timings(db, [
+        timing_row(job.id, step, finished_at - timedelta(milliseconds=ms), finished_at, status)
+        for ms in durations_ms
+    ])
+    db.commit()
+
+
+def test_percentile_interpolates_like_percentile_cont():
+    assert step_timing._percentile([1.0, 2.0, 3.0, 4.0], 0.5) == 2.5
+    assert step_timing._percentile([10.0], 0.95) == 10.0
+    assert step_timing._percentile(list(map(float, range(101))), 0.95) == pytest.approx(95.0)
+
+
+def test_step_percentiles(db):
+    job = _job(db)
+    _record(db, job, "parse", [100, 200, 300, 400, 1000])
+    _record(db, job, "route", [5, 15])
+    _record(db, job, "parse", [99999], status="failed")
+    _record(db, job, "parse", [50000], finished_at=utcnow() - timedelta(days=2))
+
+    steps = {entry["step"]: entry for entry in step_percentiles(db, since=utcnow() - timedelta(days=1))}
+    assert set(steps) == {"parse", "route"}
+    assert steps["parse"]["count"] == 5
+    assert steps["parse"]["avg_ms"] == 400.0
+    assert steps["parse"]["max_ms"] == 1000.0
+    assert steps["parse"]["p50_ms"] == 300.0
+    assert steps["parse"]["p95_ms"] == 880.0
+    assert steps["route"]["p50_ms"] == 10.0
+
+    assert {entry["step"]: entry["count"] for entry in step_percentiles(db)} == {"parse": 6, "route": 2}
+
+
+def test_job_metrics_api(db, auth_client):
+    job = _job(db)
+    _record(db, job, "to_pending_approval", [1000, 3000])
+
+    response = auth_client.get("/api/v1/jobs/metrics", params={"since_hours": 1})
+    assert response.status_code == 200
+    [entry] = response.json()["steps"]
+    assert entry["step"] == "to_pending_approval"
+    assert entry["count"] == 2
+    assert entry["p50_ms"] == 2000.0
+
+    text = auth_client.get("/api/metrics").text
+    assert 'job_step_seconds_bucket{le="2.5",status="completed",step="to_pending_approval"} 1' in text
+    assert 'job_step_seconds_count{status="completed",step="to_pending_approval"} 2' in text
+
+
+def test_job_metrics_requires_auth(client):
+    assert client.get("/api/v1/jobs/metrics").status_code in (401, 403)
+
+
+def test_process_order_records_step_timings(db, tmp_path, monkeypatch):
+    from tests.conftest import TestingSessionLocal
+    from workers import job_processor
+
+    path = tmp_path / "spec.csv"
+    path.write_text("発注先,株式会社A\n月額単価,800000\n", encoding="utf-8")
+    job = ProcessingJob(status=JobStatus.received, excel_file_path=str(path))
+    db.add(job)
+    db.commit()
+    monkeypatch.setattr(job_processor, "SessionLocal", TestingSessionLocal)
+
+    job_processor.process_order(job.id)
+
+    steps = [row.step for row in db.query(ProcessingStepTiming).filter(ProcessingStepTiming.job_id == job.id)
+             .order_by(ProcessingStepTiming.id)]
+    assert steps == ["parse", "route", "to_pending_approval"]
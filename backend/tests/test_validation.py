@@ -0,0 +1,140 @@
+"""Tests for workers.validation."""
+
+from datetime import date, datetime
+
+import pytest
+from openpyxl import Workbook
+
+from workers.excel_parser import ExcelParseError, ExcelParser
+from workers.validation import RuleSet, ValidationReport, to_json_value
+
+
+RULES = {
+    "required": ["project_name"],
+    "types": {"unit_price": "int", "headcount": "int"},
+    "date_formats": {"start_date": ["%Y/%m/%d", "%Y年%m月%d日"]},
+    "ranges": {"unit_price": {"min": 100000, "max": 2000000}, "start_date": {"min": "2020/01/01"}},
+    "patterns": {"order_number": r"^PO-\d{3}$"},
+    "enums": {"contract_type": ["準委任", "請負"]},
+}
+
+
+def _record(**overrides):
+    record = {
+        "order_number": "PO-001",
+        "project_name": "決済システム改修",
+        "unit_price": "750,000",
+        "headcount": 2,
+        "start_date": "2025年4月1日",
+        "contract_type": "準委任",
+    }
+    record.update(overrides)
+    return record
+
+
+def test_valid_record_keeps_native_types():
+    converted, errors = RuleSet(RULES).validate(_record())
+    assert errors == []
+    assert converted["unit_price"] == 750000
+    assert converted["start_date"] == date(2025, 4, 1)
+
+
+@pytest.mark.parametrize("overrides, field, code", [
+    ({"project_name": " "}, "project_name", "required"),
+    ({"unit_price": "未定"}, "unit_price", "type"),
+    ({"unit_price": 50000}, "unit_price", "min"),
+    ({"unit_price": 3000000}, "unit_price", "max"),
+    ({"start_date": "2019/12/31"}, "start_date", "min"),
+    ({"start_date": "2025-04-01"}, "start_date", "type"),
+    ({"order_number": "PO-1"}, "order_number", "pattern"),
+    ({"contract_type": "派遣"}, "contract_type", "enum"),
+])
+def test_rule_violations(overrides, field, code):
+    _, errors = RuleSet(RULES).validate(_record(**overrides), row=5)
+    assert [(e.row, e.field, e.code) for e in errors] == [(5, field, code)]
+
+
+def test_all_errors_of_a_row_are_reported():
+    _, errors = RuleSet(RULES).validate(_record(project_name=None, unit_price="x", contract_type="派遣"))
+    assert {e.code for e in errors} == {"required", "type", "enum"}
+
+
+def test_validation_report():
+    rules = RuleSet(RULES)
+    report = ValidationReport()
+    for row, record in [(2, _record()), (3, _record(unit_price=1)), (4, _record(order_number="X", contract_type="派遣"))]:
+        report.add(row, rules.validate(record, row)[1])
+    data = report.to_dict()
+    assert data["valid_rows"] == 1
+    assert data["invalid_rows"] == 2
+    assert [r["row"] for r in data["errors"]] == [3, 4]
+    assert data["errors"][0]["errors"][0] == {
+        "row": 3, "field": "unit_price", "code": "min",
+        "message": "項目 'unit_price' は 100000 以上である必要があります", "value": 1,
+    }
+
+
+def test_validate_batch_report():
+    records = [(2, _record()), (3, _record(unit_price=1)), (4, _record(order_number="X", contract_type="派遣"))]
+    valid, report = RuleSet(RULES).validate_batch(records)
+    assert [r["order_number"] for r in valid] == [_record()["order_number"]]
+    assert report.valid_rows == 1
+    assert {row: [e.code for e in errors] for row, errors in report.rows.items()} == {3: ["min"], 4: ["pattern", "enum"]}
+
+
+def test_int_rejects_fractional_text():
+    _, errors = RuleSet(RULES).validate(_record(headcount="1.5"))
+    assert [(e.field, e.code) for e in errors] == [("headcount", "type")]
+    converted, errors = RuleSet(RULES).validate(_record(headcount="2.0", unit_price="12345678901234567"))
+    assert converted["headcount"] == 2
+    assert converted["unit_price"] == 12345678901234567
+    assert [e.code for e in errors] == ["max"]
+
+
+@pytest.mark.parametrize("rules, field", [
+    ({"patterns": {"order_number": "^PO-(\\d+$"}}, "order_number"),
+    ({"types": {"unit_price": "int"}, "ranges": {"unit_price": {"min": "十万"}}}, "unit_price"),
+    ({"ranges": {"start_date": {"max": "2020-13-01"}}, "date_formats": {"start_date": "%Y-%m-%d"}}, "start_date"),
+])
+def test_malformed_rules_name_template_and_field(rules, field):
+    with pytest.raises(ExcelParseError, match=f"テンプレート「発注一覧」.*'{field}'"):
+        RuleSet(rules, "発注一覧")
+
+
+def test_parser_reports_invalid_rows(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["発注番号", "案件名", "月額単価", "開始日"])
+    ws.append(["PO-001", "決済システム改修", 750000, datetime(2025, 4, 1)])
+    ws.append(["PO-002", None, 10, datetime(2025, 5, 1)])
+    ws.append(["PO-003", "社内DX", "未定", datetime(2025, 6, 1)])
+    path = str(tmp_path / "list.xlsx")
+    wb.save(path)
+
+    parser = ExcelParser({
+        "column_mappings": {"発注番号": "order_number", "案件名": "project_name", "月額単価": "unit_price", "開始日": "start_date"},
+        "validation_rules": RULES,
+    })
+    records = parser.parse(path)
+    assert [r["order_number"] for r in records] == ["PO-001"]
+    assert records[0]["start_date"] == date(2025, 4, 1)
+
+    report = parser.report.to_dict()
+    assert report["valid_rows"] == 1
+    assert {r["row"]: [e["code"] for e in r["errors"]] for r in report["errors"]} == {3: ["required", "min"], 4: ["type"]}
+    assert parser.errors[0] == "行3: 必須項目 'project_name' が空です"
+
+
+def test_key_value_validation():
+    parser = ExcelParser({"column_mappings": {"案件名": "project_name"}, "validation_rules": RULES})
+    data = parser.map_key_values({"案件名": "", "月額単価": "x"})
+    assert data["project_name"] == ""
+    report = parser.report.to_dict()
+    assert report["invalid_rows"] == 1
+    assert report["errors"][0]["row"] is None
+
+
+def test_to_json_value():
+    assert to_json_value(date(2025, 4, 1)) == "2025-04-01"
+    assert to_json_value(750000) == 750000
+    assert to_json_value(None) is None
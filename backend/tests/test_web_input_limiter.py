@@ -0,0 +1,200 @@
+"""Tests for app.services.web_input_limiter and throttled web input in the workers."""
+
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from app.config import settings
+from app.models.automation import DeadLetterJob, JobStatus, ProcessingJob
+from app.services import web_input_limiter
+from app.services.job_steps import ORDER_REGISTRATION, deferred_job_ids
+from app.services.web_input_limiter import Limit, LocalLimiter, WebInputThrottled, limit_for, web_input_slot
+from workers import tasks
+
+
+@pytest.fixture(autouse=True)
+def local_limits(monkeypatch):
+    from tests.conftest import TestingSessionLocal
+
+    monkeypatch.setattr("app.utils.redis_client.get_redis", lambda: None)
+    monkeypatch.setattr(tasks, "SessionLocal", TestingSessionLocal)
+    monkeypatch.setattr(settings, "WEB_INPUT_LIMITS", {})
+    web_input_limiter.local_limiter.reset()
+    yield
+    web_input_limiter.local_limiter.reset()
+
+
+def test_limit_for_applies_per_system_override(monkeypatch):
+    monkeypatch.setattr(settings, "WEB_INPUT_LIMITS", {"system_b": {"rate_per_second": 0.5, "max_concurrency": 1}})
+    assert limit_for("system_b") == Limit(0.5, settings.WEB_INPUT_BURST, 1)
+    assert limit_for("system_a") == Limit(
+        settings.WEB_INPUT_RATE_PER_SECOND, settings.WEB_INPUT_BURST, settings.WEB_INPUT_MAX_CONCURRENCY,
+    )
+
+
+def test_local_limiter_token_bucket():
+    limiter = LocalLimiter()
+    limit = Limit(rate_per_second=2.0, burst=2, max_concurrency=10)
+    assert limiter.try_acquire("system_a", limit, "a") == 0
+    assert limiter.try_acquire("system_a", limit, "b") == 0
+    wait = limiter.try_acquire("system_a", limit, "c")
+    assert 0.4 < wait <= 0.5
+    # 振り分け先ごとに別のバケット
+    assert limiter.try_acquire("system_b", limit, "d") == 0
+
+
+def test_local_limiter_caps_concurrency():
+    limiter = LocalLimiter()
+    limit = Limit(rate_per_second=100.0, burst=100, max_concurrency=1)
+    assert limiter.try_acquire("system_a", limit, "a") == 0
+    assert limiter.try_acquire("system_a", limit, "b") > 0
+    limiter.release("system_a", "a")
+    assert limiter.try_acquire("system_a", limit, "b") == 0
+
+
+def test_slot_raises_when_wait_exceeded(monkeypatch):
+    monkeypatch.setattr(settings, "WEB_INPUT_LIMITS", {"system_a": {"rate_per_second": 0.01, "burst": 1}})
+    with web_input_slot("system_a"):
+        pass
+    with pytest.raises(WebInputThrottled) as exc_info:
+        with web_input_slot("system_a", max_wait=0):
+            pass
+    assert exc_info.value.system == "system_a"
+    assert exc_info.value.retry_after > 1
+
+
+def test_slots_queue_up_instead_of_failing(monkeypatch):
+    monkeypatch.setattr(settings, "WEB_INPUT_LIMITS", {"system_a": {"rate_per_second": 100, "burst": 100, "max_concurrency": 2}})
+    active = 0
+    peak = 0
+    lock = threading.Lock()
+    errors = []
+
+    def submit():
+        nonlocal active, peak
+        try:
+            with web_input_slot("system_a", max_wait=5):
+                with lock:
+                    active += 1
+                    peak = max(peak, active)
+                time.sleep(0.05)
+                with lock:
+                    active -= 1
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=submit) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert peak == 2
+
+
+def test_throttled_task_is_requeued_without_failing(db):
+    job = ProcessingJob(
+        status=JobStatus.executing,
+        assigned_system="system_a",
+        result={"発注元": "株式会社クライアント", "案件名": "保守案件", "月額単価": "800000"},
+    )
+    db.add(job)
+    db.commit()
+
+    throttled = WebInputThrottled("system_a", 12.5)
+    with patch("app.services.mcp_executor.web_input_slot", side_effect=throttled), \
+            patch.object(tasks.process_order_async, "apply_async") as apply_async:
+        result = tasks.process_order_async(job.id)
+
+    assert result == {"status": "throttled", "job_id": job.id, "retry_after": 12.5}
+    apply_async.assert_called_once_with((job.id, None), countdown=12.5, retries=0)
+    db.expire_all()
+    job = db.get(ProcessingJob, job.id)
+    assert job.status == JobStatus.executing
+    assert set(job.checkpoints) == {ORDER_REGISTRATION}
+    assert db.query(DeadLetterJob).count() == 0
+
+
+def _exhaust(system):
+    with web_input_slot(system):
+        pass
+
+
+def test_approval_request_does_not_wait_for_slot(auth_client, db, monkeypatch):
+    monkeypatch.setattr(settings, "WEB_INPUT_LIMITS", {"system_a": {"rate_per_second": 0.01, "burst": 1}})
+    _exhaust("system_a")
+    job = ProcessingJob(status=JobStatus.pending_approval, assigned_system="system_a", result={"案件名": "保守案件"})
+    db.add(job)
+    db.commit()
+
+    started = time.monotonic()
+    with patch("app.services.order_registration.register_order_from_job", return_value={}), \
+            patch.object(tasks.process_order_async, "delay", side_effect=ConnectionError("broker unavailable")):
+        resp = auth_client.post(f"/api/v1/jobs/{job.id}/approve", json={"approved": True})
+
+    assert time.monotonic() - started < settings.WEB_INPUT_MAX_WAIT_SECONDS / 10
+    # 失敗にせず、実行中のままワーカーに任せる
+    assert resp.json()["status"] == "executing"
+    assert db.query(DeadLetterJob).filter(DeadLetterJob.job_id == job.id).count() == 0
+    assert deferred_job_ids(db) == [job.id]
+
+    with patch.object(tasks.process_order_async, "apply_async") as apply_async:
+        assert tasks.resume_deferred_jobs_task() == {"status": "completed", "resumed": 1}
+        # 投入済みのジョブは次の実行で拾い直さない
+        assert tasks.resume_deferred_jobs_task() == {"status": "completed", "resumed": 0}
+    apply_async.assert_called_once_with((job.id,))
+    db.expire_all()
+    job = db.get(ProcessingJob, job.id)
+    assert job.status == JobStatus.executing
+    assert set(job.checkpoints) == {ORDER_REGISTRATION}
+
+
+def test_slack_approval_defers_throttled_web_input(db, monkeypatch):
+    import asyncio
+
+    from app.routers import slack
+    from tests.conftest import TestingSessionLocal
+
+    monkeypatch.setattr(settings, "WEB_INPUT_LIMITS", {"system_a": {"rate_per_second": 0.01, "burst": 1}})
+    _exhaust("system_a")
+    job = ProcessingJob(status=JobStatus.pending_approval, assigned_system="system_a", result={"案件名": "保守案件"})
+    db.add(job)
+    db.commit()
+
+    with patch("app.database.SessionLocal", TestingSessionLocal), \
+            patch("app.services.order_registration.register_order_from_job", return_value={}), \
+            patch.object(tasks.process_order_async, "apply_async") as apply_async:
+        message = asyncio.run(slack._handle_job_approval(job.id, approved=True, slack_user="U1"))
+
+    assert "流量制限" in message
+    assert apply_async.call_args.args[0] == (job.id,)
+    db.expire_all()
+    job = db.get(ProcessingJob, job.id)
+    assert job.status == JobStatus.executing
+    assert set(job.checkpoints) == {ORDER_REGISTRATION}
+
+
+def test_slack_approval_keeps_job_when_queue_is_unavailable(db, monkeypatch):
+    import asyncio
+
+    from app.routers import slack
+    from tests.conftest import TestingSessionLocal
+
+    monkeypatch.setattr(settings, "WEB_INPUT_LIMITS", {"system_a": {"rate_per_second": 0.01, "burst": 1}})
+    _exhaust("system_a")
+    job = ProcessingJob(status=JobStatus.pending_approval, assigned_system="system_a", result={"案件名": "保守案件"})
+    db.add(job)
+    db.commit()
+
+    with patch("app.database.SessionLocal", TestingSessionLocal), \
+            patch("app.services.order_registration.register_order_from_job", return_value={}), \
+            patch.object(tasks.process_order_async, "apply_async", side_effect=ConnectionError("broker unavailable")):
+        message = asyncio.run(slack._handle_job_approval(job.id, approved=True, slack_user="U1"))
+
+    assert "ワーカーで後ほど実行" in message
+    db.expire_all()
+    assert db.get(ProcessingJob, job.id).status == JobStatus.executing
+    assert db.query(DeadLetterJob).count() == 0
+    assert deferred_job_ids(db) == [job.id]
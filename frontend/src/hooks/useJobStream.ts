@@ -0,0 +1,63 @@
+import { useEffect, useRef } from 'react'
+import api from '../services/api'
+import { JobLogEvent, JobStatusEvent } from '../types'
+
+interface Handlers {
+  onStatus: (event: JobStatusEvent) => void
+  onLog: (event: JobLogEvent) => void
+}
+
+const RECONNECT_DELAY_MS = 3000
+
+/**
+ * Subscribe to GET /jobs/stream (Server-Sent Events) and receive job status
+ * transitions and new log lines as deltas.  Each connection uses a single-use
+ * ticket from POST /jobs/stream-ticket (so the access token never appears in
+ * a URL); when the connection drops a new ticket is fetched and it reconnects.
+ */
+export function useJobStream(handlers: Handlers) {
+  const handlersRef = useRef(handlers)
+  handlersRef.current = handlers
+
+  useEffect(() => {
+    if (!localStorage.getItem('token')) return
+    let source: EventSource | null = null
+    let retry: ReturnType<typeof setTimeout> | undefined
+    let closed = false
+
+    const reconnect = () => {
+      if (!closed) retry = setTimeout(connect, RECONNECT_DELAY_MS)
+    }
+
+    async function connect() {
+      let ticket: string
+      try {
+        const { data } = await api.post<{ ticket: string; expires_in: number }>('/jobs/stream-ticket')
+        ticket = data.ticket
+      } catch {
+        reconnect()
+        return
+      }
+      if (closed) return
+      source = new EventSource(`/api/v1/jobs/stream?ticket=${encodeURIComponent(ticket)}`)
+      source.addEventListener('status', (e) => {
+        handlersRef.current.onStatus(JSON.parse((e as MessageEvent).data))
+      })
+      source.addEventListener('log', (e) => {
+        handlersRef.current.onLog(JSON.parse((e as MessageEvent).data))
+      })
+      // The ticket is spent, so EventSource's own retry would be rejected
+      source.onerror = () => {
+        source?.close()
+        reconnect()
+      }
+    }
+
+    connect()
+    return () => {
+      closed = true
+      clearTimeout(retry)
+      source?.close()
+    }
+  }, [])
+}
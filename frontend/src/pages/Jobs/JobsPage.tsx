@@ -1,6 +1,7 @@
-import { useState, useEffect, useCallback, Fragment } from 'react'
+import { useState, useEffect, useCallback, useRef, Fragment } from 'react'
 import api from '../../services/api'
-import { ProcessingJob, ProcessingLog } from '../../types'
+import { useJobStream } from '../../hooks/useJobStream'
+import { JobLogEvent, JobStatusEvent, ProcessingJob, ProcessingLog } from '../../types'
 import { ChevronLeft, ChevronRight, ChevronDown, ChevronUp, RefreshCw, Filter } from 'lucide-react'
 import toast from 'react-hot-toast'
 
@@ -234,6 +235,65 @@ export default function JobsPage() {
     fetchData()
   }, [fetchData])
 
+  // Apply pushed deltas to the loaded page instead of re-fetching the list.
+  // A top-level job that is not on the page (newly received) triggers one
+  // debounced refetch of the first page.
+  const refetchTimer = useRef<ReturnType<typeof setTimeout>>()
+  const scheduleRefetch = useCallback(() => {
+    clearTimeout(refetchTimer.current)
+    refetchTimer.current = setTimeout(fetchData, 2000)
+  }, [fetchData])
+  useEffect(() => () => clearTimeout(refetchTimer.current), [])
+
+  const jobIdsRef = useRef<Set<number>>(new Set())
+  jobIdsRef.current = new Set(jobs.map((j) => j.id))
+
+  useJobStream({
+    onStatus: (event: JobStatusEvent) => {
+      if (!jobIdsRef.current.has(event.job_id)) {
+        if (page === 1 && event.parent_job_id == null) scheduleRefetch()
+        return
+      }
+      setJobs((prev) =>
+        prev.map((j) =>
+          j.id === event.job_id
+            ? {
+                ...j,
+                status: event.status,
+                error_message: event.error_message,
+                assigned_system: event.assigned_system,
+              }
+            : j,
+        ),
+      )
+    },
+    onLog: (event: JobLogEvent) => {
+      if (!jobIdsRef.current.has(event.job_id)) return
+      setJobs((prev) =>
+        prev.map((j) =>
+          j.id === event.job_id
+            ? {
+                ...j,
+                logs: [
+                  ...(j.logs ?? []),
+                  {
+                    // Pushed lines have no row id yet; use a negative key until the next fetch.
+                    id: -((j.logs?.length ?? 0) + 1),
+                    job_id: event.job_id,
+                    step_name: event.step_name,
+                    status: event.status,
+                    message: event.message,
+                    screenshot_path: null,
+                    created_at: event.created_at,
+                  },
+                ],
+              }
+            : j,
+        ),
+      )
+    },
+  })
+
   // Reset to first page when filter changes
   useEffect(() => {
     setPage(1)
@@ -133,6 +133,7 @@ export interface Invoice {
 
 export interface ProcessingJob {
   id: number
+  parent_job_id: number | null
   slack_message_id: string | null
   slack_channel_id: string | null
   excel_file_path: string | null
@@ -157,6 +158,26 @@ export interface ProcessingLog {
   created_at: string
 }
 
+/** Status transition pushed by GET /jobs/stream */
+export interface JobStatusEvent {
+  type: 'status'
+  job_id: number
+  parent_job_id: number | null
+  status: ProcessingJob['status']
+  error_message: string | null
+  assigned_system: string | null
+}
+
+/** Log line pushed by GET /jobs/stream */
+export interface JobLogEvent {
+  type: 'log'
+  job_id: number
+  step_name: string
+  status: string
+  message: string
+  created_at: string
+}
+
 export interface PaginatedResponse<T> {
   items: T[]
   total: number
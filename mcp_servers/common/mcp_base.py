@@ -1,7 +1,11 @@
 """MCPサーバー基底クラスとモッククライアント"""
 import uuid
+from collections import OrderedDict
 from datetime import datetime
 
+# idempotency_key ごとに保持する入力結果の件数の上限 (古いものから捨てる)
+MAX_SUBMISSIONS = 10000
+
 
 class MCPServerBase:
     """MCPサーバーの基底クラス"""
@@ -9,19 +13,31 @@ class MCPServerBase:
     def __init__(self, system_name: str):
         self.system_name = system_name
 
-    def execute_order_input(self, order_data: dict) -> dict:
+    def execute_order_input(self, order_data: dict, idempotency_key: str | None = None) -> dict:
+        """発注を入力する。同じ idempotency_key の再送では入力をやり直さず、前回の結果を返す"""
         raise NotImplementedError
 
 
 class MockMCPClient(MCPServerBase):
-    """MCPクライアントのモック実装 (開発・テスト用)"""
+    """MCPクライアントのモック実装 (開発・テスト用)
+
+    idempotency_key ごとの入力結果はインスタンスごとに直近 max_submissions 件だけ保持する。
+    """
+
+    def __init__(self, system_name: str, max_submissions: int = MAX_SUBMISSIONS):
+        super().__init__(system_name)
+        self.max_submissions = max_submissions
+        self._submissions: OrderedDict[str, dict] = OrderedDict()
 
-    def execute_order_input(self, order_data: dict) -> dict:
+    def execute_order_input(self, order_data: dict, idempotency_key: str | None = None) -> dict:
         """発注入力をモック実行する"""
+        if idempotency_key and idempotency_key in self._submissions:
+            self._submissions.move_to_end(idempotency_key)
+            return dict(self._submissions[idempotency_key])
         confirmation_id = f"{self.system_name.upper()}-{uuid.uuid4().hex[:8].upper()}"
         order_number = order_data.get("order_number", f"ORD-{uuid.uuid4().hex[:6].upper()}")
 
-        return {
+        result = {
             "success": True,
             "order_number": order_number,
             "confirmation_id": confirmation_id,
@@ -30,3 +46,8 @@ class MockMCPClient(MCPServerBase):
             "processed_at": datetime.utcnow().isoformat(),
             "mock": True,
         }
+        if idempotency_key:
+            self._submissions[idempotency_key] = dict(result)
+            while len(self._submissions) > self.max_submissions:
+                self._submissions.popitem(last=False)
+        return result
@@ -8,8 +8,8 @@ class SystemBServer(MockMCPClient):
     def __init__(self):
         super().__init__("system_b")
 
-    def execute_order_input(self, order_data: dict) -> dict:
+    def execute_order_input(self, order_data: dict, idempotency_key: str | None = None) -> dict:
         """WebシステムBへの発注入力"""
-        result = super().execute_order_input(order_data)
+        result = super().execute_order_input(order_data, idempotency_key)
         result["system_label"] = "Webシステム B"
         return result
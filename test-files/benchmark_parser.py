@@ -0,0 +1,106 @@
+"""Excel解析ベンチマーク
+
+generate_test_files.py --corpus で生成したコーパスを、ExcelParser の各モードで解析して
+行数/秒とピークメモリ (ru_maxrss) を表示する。ピークメモリを正しく測るため、
+1ファイル×1モードごとに新しいプロセスで計測する。
+
+    python test-files/benchmark_parser.py [--modes fast,openpyxl] [--repeat 3] [--json] [ファイル ...]
+
+モード:
+    fast      高速リーダー (xlsx直接解析 / CSVはcsvモジュール) で1行ずつ読む
+    openpyxl  openpyxl の読み取り専用モードで1行ずつ読む (xlsxのみ)
+    parse     高速リーダーで全行をリストに読み込む (ExcelParser.parse 相当)
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+CORPUS_DIR = ROOT / "test-files" / "corpus"
+MODES = ("fast", "openpyxl", "parse")
+
+
+def _run_single(path: str, mode: str) -> dict:
+    """このプロセスで1回解析し、行数・経過時間・ピークメモリを返す"""
+    sys.path[:0] = [str(ROOT), str(ROOT / "backend")]
+    from workers.excel_parser import ExcelParser, ParseLimits, WorkbookSession
+
+    started = time.perf_counter()
+    parser = ExcelParser()
+    with WorkbookSession(path, fast=mode != "openpyxl", limits=ParseLimits.unlimited()) as session:
+        if session.detect_format() != "table":
+            rows = len(parser.extract_key_values(session))
+        elif mode == "parse":
+            rows = len(list(parser.iter_records(session)))
+        else:
+            rows = sum(1 for _ in parser.iter_records(session))
+    elapsed = time.perf_counter() - started
+    # Linux の ru_maxrss はKB単位 (macOS はバイト単位)
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        maxrss //= 1024
+    return {"file": Path(path).name, "mode": mode, "rows": rows, "seconds": elapsed, "maxrss_kb": maxrss}
+
+
+def _measure(path: Path, mode: str) -> dict:
+    proc = subprocess.run(
+        [sys.executable, __file__, "--single", mode, str(path)],
+        capture_output=True, text=True, check=False,
+    )
+    if proc.returncode != 0:
+        return {"file": path.name, "mode": mode, "error": proc.stderr.strip().splitlines()[-1:]}
+    return json.loads(proc.stdout)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("files", nargs="*", help="計測するファイル (既定: test-files/corpus/ の全ファイル)")
+    arg_parser.add_argument("--modes", default=",".join(MODES), help="計測するモード (カンマ区切り)")
+    arg_parser.add_argument("--repeat", type=int, default=1, help="繰り返し回数 (最速の結果を採用)")
+    arg_parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    arg_parser.add_argument("--single", help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.single:
+        print(json.dumps(_run_single(args.files[0], args.single)))
+        return
+
+    files = [Path(f) for f in args.files] or sorted(
+        p for p in CORPUS_DIR.glob("*") if p.suffix in (".xlsx", ".csv", ".tsv")
+    )
+    if not files:
+        sys.exit(f"{CORPUS_DIR} にファイルがありません。先に generate_test_files.py --corpus を実行してください。")
+
+    results = []
+    for path in files:
+        for mode in args.modes.split(","):
+            if mode == "openpyxl" and path.suffix != ".xlsx":
+                continue
+            runs = [_measure(path, mode) for _ in range(max(args.repeat, 1))]
+            ok = [r for r in runs if "error" not in r]
+            result = min(ok, key=lambda r: r["seconds"]) if ok else runs[0]
+            results.append(result)
+            if not args.json:
+                _print_result(result)
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+def _print_result(result: dict):
+    if "error" in result:
+        print(f"{result['file']:<28} {result['mode']:<9} エラー: {' '.join(result['error'])}")
+        return
+    rate = result["rows"] / result["seconds"] if result["seconds"] else 0
+    print(
+        f"{result['file']:<28} {result['mode']:<9} {result['rows']:>9,}行 "
+        f"{result['seconds']:>8.2f}秒 {rate:>11,.0f}行/秒 {result['maxrss_kb'] / 1024:>8.1f}MB"
+    )
+
+
+if __name__ == "__main__":
+    main()
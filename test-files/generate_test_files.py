@@ -4,9 +4,15 @@
 1. 発注仕様書Excel (Slack投稿用)
 2. 請求書PDF (請求管理画面でインポート用)
 3. 入金CSV (入金消込画面でインポート用)
+
+--corpus を付けるとExcel解析のベンチマーク用コーパスを test-files/corpus/ に生成する
+(benchmark_parser.py で計測する):
+    python test-files/generate_test_files.py --corpus [--sizes 1000,10000]
 """
+import argparse
 import os
-from datetime import date, datetime
+import random
+from datetime import date, datetime, timedelta
 from pathlib import Path
 
 # --- 1. 発注仕様書Excel ---
@@ -398,8 +404,148 @@ def create_order_list_excel():
     return path
 
 
+# --- 5. ベンチマーク用コーパス ---
+CORPUS_DIR = Path("test-files/corpus")
+CORPUS_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+WIDE_COLS = 150
+WIDE_ROWS = 5_000
+
+LIST_HEADERS = ["発注番号", "案件名", "発注元企業", "エンジニア名", "月額単価", "開始日", "終了日", "必須スキル", "備考"]
+_PROJECTS = ["決済システム改修", "社内DXプラットフォーム構築", "AI チャットボット開発", "ECサイトリニューアル開発", "基幹システム移行"]
+_COMPANIES = ["株式会社ペイメントテック", "株式会社デジタルワークス", "株式会社AIラボ", "株式会社テックソリューション"]
+_ENGINEERS = ["山田花子", "鈴木一郎", "佐藤次郎", "田中太郎", "高橋三郎"]
+_SKILLS = ["Java, Spring Boot, AWS", "Python, React, GCP", "Python, LLM, FastAPI", "Go, Kubernetes"]
+
+
+def _list_rows(count: int, seed: int = 0):
+    """発注一覧の行を決まった乱数で生成する (同じ件数なら毎回同じ内容)"""
+    rng = random.Random(seed)
+    start = date(2026, 4, 1)
+    for i in range(1, count + 1):
+        begin = start + timedelta(days=rng.randrange(0, 180))
+        yield [
+            f"PO-{i:07d}",
+            rng.choice(_PROJECTS),
+            rng.choice(_COMPANIES),
+            rng.choice(_ENGINEERS),
+            rng.randrange(500_000, 1_200_000, 10_000),
+            begin,
+            begin + timedelta(days=rng.randrange(90, 365)),
+            rng.choice(_SKILLS),
+            "" if i % 3 else "リモート併用可",
+        ]
+
+
+def _size_label(count: int) -> str:
+    return f"{count // 1_000_000}m" if count >= 1_000_000 else f"{count // 1_000}k"
+
+
+def create_corpus_list_excel(count: int) -> Path:
+    """発注一覧 (テーブル形式) の大きなExcel。write_only で書くため件数が多くてもメモリは一定"""
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("発注一覧")
+    ws.append(LIST_HEADERS)
+    for row in _list_rows(count):
+        ws.append(row)
+    path = CORPUS_DIR / f"list_{_size_label(count)}.xlsx"
+    wb.save(str(path))
+    return path
+
+
+def create_corpus_list_csv(count: int) -> Path:
+    """発注一覧のShift-JIS (cp932) CSV"""
+    import csv
+
+    path = CORPUS_DIR / f"list_{_size_label(count)}_sjis.csv"
+    with open(path, "w", encoding="cp932", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(LIST_HEADERS)
+        for row in _list_rows(count):
+            writer.writerow([v.strftime("%Y/%m/%d") if isinstance(v, date) else v for v in row])
+    return path
+
+
+def create_corpus_wide_excel(rows: int = WIDE_ROWS, cols: int = WIDE_COLS) -> Path:
+    """列数の多い一覧 (月別の稼働実績などを横に並べたもの)"""
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("稼働実績")
+    ws.append(["発注番号", "エンジニア名"] + [f"項目{i:03d}" for i in range(1, cols - 1)])
+    rng = random.Random(1)
+    for i in range(1, rows + 1):
+        ws.append([f"PO-{i:07d}", rng.choice(_ENGINEERS)] + [rng.randrange(0, 200) for _ in range(cols - 2)])
+    path = CORPUS_DIR / "wide.xlsx"
+    wb.save(str(path))
+    return path
+
+
+def create_corpus_spec_excel(merged: bool) -> Path:
+    """発注仕様書 (キーバリュー形式)。merged=True では見出し・項目名・値を結合セルで配置する"""
+    from openpyxl import Workbook
+
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "発注仕様書"
+    items = [
+        ("発注番号", "PO-2026-0215"),
+        ("発注元企業", "株式会社テックソリューション"),
+        ("案件名", "ECサイトリニューアル開発"),
+        ("業務内容", "既存ECサイトのフルリニューアル。React+Next.jsによるフロントエンド刷新を含む。"),
+        ("開始日", date(2026, 4, 1)),
+        ("終了日", date(2026, 9, 30)),
+        ("月額単価", 800000),
+        ("精算幅下限（H）", 140),
+        ("精算幅上限（H）", 180),
+        ("契約形態", "準委任"),
+        ("必須スキル", "React, TypeScript, Next.js, Go, AWS"),
+    ]
+    ws["A1"] = "発注仕様書"
+    if merged:
+        ws.merge_cells("A1:F1")
+        for row, (label, value) in enumerate(items, start=3):
+            ws.merge_cells(f"A{row}:B{row}")
+            ws.merge_cells(f"C{row}:F{row}")
+            ws[f"A{row}"] = label
+            ws[f"C{row}"] = value
+    else:
+        for row, (label, value) in enumerate(items, start=3):
+            ws[f"A{row}"] = label
+            ws[f"B{row}"] = value
+    path = CORPUS_DIR / ("spec_merged.xlsx" if merged else "spec.xlsx")
+    wb.save(str(path))
+    return path
+
+
+def create_corpus(sizes=CORPUS_SIZES):
+    CORPUS_DIR.mkdir(parents=True, exist_ok=True)
+    paths = [create_corpus_spec_excel(merged=False), create_corpus_spec_excel(merged=True)]
+    for count in sizes:
+        paths.append(create_corpus_list_excel(count))
+        paths.append(create_corpus_list_csv(count))
+    paths.append(create_corpus_wide_excel())
+    for path in paths:
+        print(f"  {path} ({path.stat().st_size:,} bytes)")
+    return paths
+
+
 if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--corpus", action="store_true", help="ベンチマーク用コーパスを生成する")
+    arg_parser.add_argument("--sizes", default=",".join(str(n) for n in CORPUS_SIZES),
+                            help="一覧の行数 (カンマ区切り、既定: %(default)s)")
+    args = arg_parser.parse_args()
+
     os.chdir(Path(__file__).parent.parent)
+    if args.corpus:
+        print("ベンチマーク用コーパスを生成中...\n")
+        create_corpus([int(n) for n in args.sizes.split(",") if n])
+        print(f"\n完了! {CORPUS_DIR}/ にファイルが生成されました。")
+        print("  計測: python test-files/benchmark_parser.py")
+        raise SystemExit
+
     print("テストファイルを生成中...\n")
     create_order_excel()
     create_invoice_pdf()
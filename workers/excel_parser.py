@@ -1,123 +1,840 @@
-"""Excel解析エンジン: openpyxlでExcelをパース、列マッピングに基づいてデータ抽出"""
+"""Excel解析エンジン: xlsxを直接ストリーム解析 (対応できないファイルはopenpyxl、CSV/TSVはcsvモジュール) し、列マッピングに基づいてデータ抽出"""
+import codecs
+import csv
 import json
+import posixpath
+import re
+import time
+import warnings
+import zipfile
+from dataclasses import dataclass, fields
+from itertools import chain, islice
 from pathlib import Path
+from typing import Any, Callable, Iterator
+from xml.etree.ElementTree import ParseError, fromstring, iterparse
 
 from openpyxl import load_workbook
+from openpyxl.styles.numbers import builtin_format_code, is_date_format, is_timedelta_format
+from openpyxl.utils.cell import column_index_from_string, range_boundaries
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, WINDOWS_EPOCH, from_excel, from_ISO8601
+from openpyxl.xml.constants import SHARED_STRINGS, SHEET_MAIN_NS, XLSM, XLSX, XLTM, XLTX
+
+from workers.validation import FieldError, RuleSet, ValidationReport
+
+# 形式判定に使う先頭行数
+DETECT_ROWS = 5
+# キーバリュー形式 (発注仕様書) の読み取り範囲
+KEY_VALUE_MAX_ROW = 50
+KEY_VALUE_MAX_COL = 10
+# 解析結果の形式が変わる変更を入れたら上げる (解析結果キャッシュのキーに含まれる)
+PARSER_VERSION = "2"
+# True の場合は xlsx を直接読む高速リーダーを使い、対応できないファイルのみ openpyxl で読む
+FAST_READER = True
+# テキスト形式 (CSV/TSV) として読む拡張子
+TEXT_SUFFIXES = (".csv", ".tsv", ".txt")
+# 文字コード・区切り文字の判定に読む先頭バイト数
+TEXT_SNIFF_BYTES = 64 * 1024
 
 
 class ExcelParseError(Exception):
     pass
 
 
+@dataclass(frozen=True)
+class RowPlan:
+    """ヘッダー行からコンパイルした「列インデックス → フィールド名・変換関数」の計画"""
+
+    columns: tuple[tuple[int, str, Callable[[Any], Any] | None], ...]
+
+    def apply(self, row: tuple) -> tuple[dict, list[str]]:
+        """1行をレコードに変換する。変換できなかったフィールド名も返す"""
+        record = {}
+        failed = []
+        width = len(row)
+        for col_idx, field, converter in self.columns:
+            value = row[col_idx] if col_idx < width else None
+            if converter is not None and value is not None and value != "":
+                try:
+                    value = converter(value)
+                except (ValueError, TypeError):
+                    failed.append(field)
+            record[field] = value
+        return record, failed
+
+
+@dataclass(frozen=True)
+class ParseLimits:
+    """1ファイルの解析に使える資源の上限 (巨大なファイルや zip bomb でプロセスを占有させないため)
+
+    None の項目は制限しない。既定値は app.config の EXCEL_* 設定から読む。
+    """
+
+    max_file_bytes: int | None = 20 * 1024 * 1024
+    max_uncompressed_bytes: int | None = 200 * 1024 * 1024
+    max_compression_ratio: float | None = 100.0
+    max_rows: int | None = 100_000
+    max_cols: int | None = 200
+    timeout_seconds: float | None = 60.0
+
+    @classmethod
+    def from_settings(cls) -> "ParseLimits":
+        from app.config import settings
+
+        return cls(
+            max_file_bytes=settings.EXCEL_MAX_FILE_BYTES,
+            max_uncompressed_bytes=settings.EXCEL_MAX_UNCOMPRESSED_BYTES,
+            max_compression_ratio=settings.EXCEL_MAX_COMPRESSION_RATIO,
+            max_rows=settings.EXCEL_MAX_ROWS,
+            max_cols=settings.EXCEL_MAX_COLS,
+            timeout_seconds=settings.EXCEL_PARSE_TIMEOUT_SECONDS,
+        )
+
+    @classmethod
+    def unlimited(cls) -> "ParseLimits":
+        return cls(**{f.name: None for f in fields(cls)})
+
+    def check_file(self, path: Path):
+        """開く前にファイルの有無・サイズと、zip (xlsx) の場合は展開後サイズ・圧縮率を確認する"""
+        if not path.exists():
+            raise ExcelParseError(f"ファイルが見つかりません: {path}")
+        size = path.stat().st_size
+        if self.max_file_bytes is not None and size > self.max_file_bytes:
+            raise ExcelParseError(f"ファイルサイズが上限 ({self.max_file_bytes:,}バイト) を超えています: {size:,}バイト")
+        if self.max_uncompressed_bytes is None and self.max_compression_ratio is None:
+            return
+        if not zipfile.is_zipfile(path):
+            return
+        # 展開時は zipfile が宣言サイズ以上を返さないため、宣言サイズで判定すればよい
+        with zipfile.ZipFile(path) as archive:
+            infos = archive.infolist()
+        uncompressed = sum(info.file_size for info in infos)
+        compressed = sum(info.compress_size for info in infos)
+        if self.max_uncompressed_bytes is not None and uncompressed > self.max_uncompressed_bytes:
+            raise ExcelParseError(
+                f"展開後のサイズが上限 ({self.max_uncompressed_bytes:,}バイト) を超えています: {uncompressed:,}バイト"
+            )
+        if self.max_compression_ratio is not None and uncompressed > self.max_compression_ratio * max(compressed, 1):
+            raise ExcelParseError(f"圧縮率が異常です (zip bomb の可能性): {uncompressed:,} / {compressed:,}バイト")
+
+    def guard(self, rows: Iterator[tuple], started: float) -> Iterator[tuple]:
+        """行数・列数・経過時間を数えながら行を返し、上限を超えた時点で中断する
+
+        max_rows はデータ行の上限で、先頭の見出し1行は数えない (max_rows 件の一覧はちょうど読める)。
+        """
+        max_rows, max_cols = self.max_rows, self.max_cols
+        deadline = started + self.timeout_seconds if self.timeout_seconds is not None else None
+        for count, row in enumerate(rows, start=1):
+            if max_rows is not None and count > max_rows + 1:
+                raise ExcelParseError(f"行数が上限 (見出しを除き{max_rows:,}行) を超えています")
+            if max_cols is not None and len(row) > max_cols:
+                raise ExcelParseError(f"列数が上限 ({max_cols}列) を超えています: {count}行目が{len(row)}列")
+            if deadline is not None and count % 256 == 0 and time.monotonic() > deadline:
+                raise ExcelParseError(f"解析時間が上限 ({self.timeout_seconds:g}秒) を超えました")
+            yield row
+
+
+_MAIN = "{%s}" % SHEET_MAIN_NS
+_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_CT_NS = "{http://schemas.openxmlformats.org/package/2006/content-types}"
+_ROW_TAG = _MAIN + "row"
+_CELL_TAG = _MAIN + "c"
+_VALUE_TAG = _MAIN + "v"
+_TEXT_TAG = _MAIN + "t"
+_RUN_TAG = _MAIN + "r"
+_INLINE_TAG = _MAIN + "is"
+_DIMENSION_TAG = _MAIN + "dimension"
+_SHEET_DATA_TAG = _MAIN + "sheetData"
+
+
+class _UnsupportedWorkbook(Exception):
+    """高速リーダーで扱えない構造のファイル (openpyxl にフォールバックする)"""
+
+
+def _string_item_text(node) -> str:
+    """<si> / <is> 要素の文字列 (ふりがな <rPh> は含めない)"""
+    parts = []
+    for child in node:
+        if child.tag == _TEXT_TAG:
+            parts.append(child.text or "")
+        elif child.tag == _RUN_TAG:
+            t = child.find(_TEXT_TAG)
+            if t is not None and t.text is not None:
+                parts.append(t.text)
+    return "".join(parts)
+
+
+def _column_index(letters: str, cache: dict[str, int]) -> int:
+    idx = cache.get(letters)
+    if idx is None:
+        idx = cache[letters] = column_index_from_string(letters)
+    return idx
+
+
+def _cast_number(value: str) -> int | float:
+    if "." in value or "E" in value or "e" in value:
+        return float(value)
+    return int(value)
+
+
+class FastXlsxReader:
+    """xlsx の zip を直接開き、シートXMLを iterparse で1行ずつ値のタプルに変換するリーダー
+
+    openpyxl の読み取り専用モードと同じ値・同じ行幅 (dimension に合わせた None 埋め) を返すが、
+    セルオブジェクトやスタイル情報を作らないぶん高速。
+    想定外の構造のファイルでは _UnsupportedWorkbook を送出する。
+    """
+
+    def __init__(self, file_path: str):
+        try:
+            self.archive = zipfile.ZipFile(file_path)
+        except (zipfile.BadZipFile, OSError) as e:
+            raise _UnsupportedWorkbook(str(e)) from e
+        try:
+            self._load_workbook()
+        except _UnsupportedWorkbook:
+            self.archive.close()
+            raise
+        except (KeyError, ValueError, ParseError) as e:
+            self.archive.close()
+            raise _UnsupportedWorkbook(str(e)) from e
+
+    def _read_xml(self, name: str):
+        return fromstring(self.archive.read(name))
+
+    def _load_workbook(self):
+        names = set(self.archive.namelist())
+        content_types = self._read_xml("[Content_Types].xml")
+        overrides = {
+            node.get("ContentType"): node.get("PartName", "").lstrip("/")
+            for node in content_types.iter(_CT_NS + "Override")
+        }
+        workbook_part = next((overrides[ct] for ct in (XLSX, XLSM, XLTX, XLTM) if ct in overrides), None)
+        if workbook_part is None:
+            raise _UnsupportedWorkbook("ワークブック定義が見つかりません")
+
+        workbook = self._read_xml(workbook_part)
+        if workbook.tag != _MAIN + "workbook":
+            raise _UnsupportedWorkbook(workbook.tag)
+        props = workbook.find(_MAIN + "workbookPr")
+        date1904 = props is not None and props.get("date1904") in ("1", "true")
+        self.epoch = CALENDAR_MAC_1904 if date1904 else WINDOWS_EPOCH
+
+        base = posixpath.dirname(workbook_part)
+        rels_path = posixpath.join(base, "_rels", posixpath.basename(workbook_part) + ".rels")
+        rels = {}
+        for rel in self._read_xml(rels_path).iter(_PKG_REL_NS + "Relationship"):
+            target = rel.get("Target", "")
+            target = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join(base, target))
+            rels[rel.get("Id")] = (rel.get("Type"), target)
+
+        # (シート名, パート名, 表示状態)
+        self.sheets: list[tuple[str, str, str]] = []
+        for sheet in workbook.iter(_MAIN + "sheet"):
+            rel_type, target = rels.get(sheet.get(_REL_NS + "id"), (None, None))
+            if rel_type is None or not rel_type.endswith("/worksheet") or target not in names:
+                raise _UnsupportedWorkbook(f"未対応のシート: {sheet.get('name')}")
+            self.sheets.append((sheet.get("name"), target, sheet.get("state", "visible")))
+
+        active = 0
+        for view in workbook.iter(_MAIN + "workbookView"):
+            if view.get("activeTab") is not None:
+                active = int(view.get("activeTab"))
+                break
+        if not 0 <= active < len(self.sheets):
+            raise _UnsupportedWorkbook("アクティブなシートが見つかりません")
+        self.active = active
+
+        self.shared_strings: list[str] = []
+        strings_part = overrides.get(SHARED_STRINGS)
+        if strings_part:
+            with self.archive.open(strings_part) as src:
+                for _, node in iterparse(src):
+                    if node.tag == _MAIN + "si":
+                        self.shared_strings.append(_string_item_text(node).replace("x005F_", ""))
+                        node.clear()
+
+        self.date_styles: set[int] = set()
+        self.timedelta_styles: set[int] = set()
+        if "xl/styles.xml" in names:
+            styles = self._read_xml("xl/styles.xml")
+            custom = {
+                int(fmt.get("numFmtId")): fmt.get("formatCode")
+                for fmt in styles.iter(_MAIN + "numFmt")
+            }
+            cell_xfs = styles.find(_MAIN + "cellXfs")
+            for idx, xf in enumerate(cell_xfs if cell_xfs is not None else ()):
+                fmt_id = int(xf.get("numFmtId", 0))
+                fmt = custom[fmt_id] if fmt_id in custom else builtin_format_code(fmt_id)
+                if is_date_format(fmt):
+                    self.date_styles.add(idx)
+                if is_timedelta_format(fmt):
+                    self.timedelta_styles.add(idx)
+
+    def sheet_index(self, name: str) -> int:
+        for idx, (sheet_name, _, _) in enumerate(self.sheets):
+            if sheet_name == name:
+                return idx
+        raise ExcelParseError(f"シートが見つかりません: {name}")
+
+    def rows(self, sheet_index: int | None = None) -> Iterator[tuple]:
+        """シートの行を値のタプルで返す (openpyxl の iter_rows(values_only=True) 相当)"""
+        _, part, _ = self.sheets[self.active if sheet_index is None else sheet_index]
+        shared_strings = self.shared_strings
+        date_styles = self.date_styles
+        col_cache: dict[str, int] = {}
+        max_col = max_row = None
+        empty_row: tuple = ()
+        counter = 1
+        row_counter = 0
+        sheet_data = None
+
+        with self.archive.open(part) as src:
+            for event, node in iterparse(src, events=("start", "end")):
+                tag = node.tag
+                if event == "start":
+                    if tag == _SHEET_DATA_TAG:
+                        sheet_data = node
+                    continue
+                if tag == _DIMENSION_TAG:
+                    _, _, max_col, max_row = range_boundaries(node.get("ref"))
+                    if max_col is not None:
+                        empty_row = (None,) * max_col
+                    continue
+                if tag != _ROW_TAG:
+                    continue
+
+                r = node.get("r")
+                row_counter = int(float(r)) if r is not None else row_counter + 1
+                idx = row_counter
+                if max_row is not None and idx > max_row:
+                    # dimension より後ろの行は読まず、dimension の末尾までを空行で埋める
+                    while counter <= max_row:
+                        counter += 1
+                        yield empty_row
+                    break
+
+                cells = []
+                col_counter = 0
+                for cell in node:
+                    if cell.tag != _CELL_TAG:
+                        continue
+                    ref = cell.get("r")
+                    if ref:
+                        letters = ref.rstrip("0123456789")
+                        col_counter = _column_index(letters, col_cache)
+                    else:
+                        col_counter += 1
+                    cells.append((col_counter, self._cell_value(cell, shared_strings, date_styles)))
+
+                if sheet_data is not None:
+                    sheet_data.clear()
+                else:
+                    node.clear()
+
+                # 欠けている行は空行で埋める
+                while counter < idx:
+                    counter += 1
+                    yield empty_row
+                if counter > idx:
+                    continue
+                counter += 1
+
+                width = max_col or (cells[-1][0] if cells else 0)
+                values = [None] * width
+                for col, value in cells:
+                    if col <= width:
+                        values[col - 1] = value
+                yield tuple(values)
+
+    def _cell_value(self, cell, shared_strings: list[str], date_styles: set[int]):
+        data_type = cell.get("t", "n")
+        if data_type == "inlineStr":
+            inline = cell.find(_INLINE_TAG)
+            return _string_item_text(inline) if inline is not None else None
+
+        value = cell.findtext(_VALUE_TAG) or None
+        if value is None:
+            return None
+        if data_type == "n":
+            value = _cast_number(value)
+            style = int(cell.get("s", 0) or 0)
+            if style in date_styles:
+                try:
+                    return from_excel(value, self.epoch, timedelta=style in self.timedelta_styles)
+                except (OverflowError, ValueError):
+                    warnings.warn(f"セル {cell.get('r')} の日付シリアル値 {value} が範囲外です")
+                    return "#VALUE!"
+            return value
+        if data_type == "s":
+            return shared_strings[int(value)]
+        if data_type == "b":
+            return bool(int(value))
+        if data_type == "d":
+            return from_ISO8601(value)
+        return value
+
+    def close(self):
+        self.archive.close()
+
+
+_BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+# 先頭ゼロのコード値 ("0012" など) は文字列のまま残す
+_NUMBER_RE = re.compile(r"-?(?:0|[1-9][0-9]*)(\.[0-9]+)?")
+
+
+def detect_encoding(path: str) -> str:
+    """BOM → UTF-8 → cp932 (Shift_JIS系) の順に文字コードを判定する
+
+    UTF-8 はファイル全体を逐次デコードして確認する (先頭だけASCIIで後ろに日本語がある場合に備えて)。
+    """
+    with open(path, "rb") as f:
+        head = f.read(4)
+        for bom, encoding in _BOMS:
+            if head.startswith(bom):
+                return encoding
+        f.seek(0)
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        try:
+            for chunk in iter(lambda: f.read(TEXT_SNIFF_BYTES), b""):
+                decoder.decode(chunk)
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            return "cp932"
+    return "utf-8"
+
+
+def _text_value(value: str):
+    """CSVのセル値を xlsx と同じ扱いにする (空欄は None、素直な数値は int / float)"""
+    if not value:
+        return None
+    match = _NUMBER_RE.fullmatch(value)
+    if match is None:
+        return value
+    return float(value) if match.group(1) else int(value)
+
+
+class CsvReader:
+    """CSV/TSV を csv モジュールで1行ずつ値のタプルに変換するリーダー
+
+    FastXlsxReader と同じインターフェース (sheets / sheet_index / rows / close) を持ち、
+    ファイル名をシート名とする1シートのワークブックとして扱う。
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.sheets: list[tuple[str, str, str]] = [(self.path.stem, self.path.name, "visible")]
+        self.active = 0
+        self._open_rows: list[Iterator[tuple]] = []
+        try:
+            self.encoding = detect_encoding(path)
+            with open(path, encoding=self.encoding, newline="") as f:
+                sample = f.read(TEXT_SNIFF_BYTES)
+        except (OSError, UnicodeError) as e:
+            raise ExcelParseError(f"ファイルを読み取れません: {e}") from e
+        self.delimiter = self._detect_delimiter(sample)
+
+    def _detect_delimiter(self, sample: str) -> str:
+        suffix = self.path.suffix.lower()
+        if suffix == ".tsv":
+            return "\t"
+        if suffix == ".csv":
+            return ","
+        try:
+            return csv.Sniffer().sniff(sample, delimiters=",\t;").delimiter
+        except csv.Error:
+            return ","
+
+    def sheet_index(self, name: str) -> int:
+        if name != self.sheets[0][0]:
+            raise ExcelParseError(f"シートが見つかりません: {name}")
+        return 0
+
+    def rows(self, sheet_index: int | None = None) -> Iterator[tuple]:
+        """行を値のタプルで返す。呼ぶたびにファイルを開き直すため peek と並行して読める"""
+        rows = self._iter_rows()
+        self._open_rows.append(rows)
+        return rows
+
+    def _iter_rows(self) -> Iterator[tuple]:
+        with open(self.path, encoding=self.encoding, newline="") as f:
+            try:
+                for row in csv.reader(f, delimiter=self.delimiter):
+                    yield tuple(_text_value(v) for v in row)
+            except (csv.Error, UnicodeError) as e:
+                raise ExcelParseError(f"ファイルを読み取れません: {e}") from e
+
+    def close(self):
+        for rows in self._open_rows:
+            rows.close()
+        self._open_rows.clear()
+
+
+# 高速リーダーが対応していないワークブックで送出しうる例外
+_FAST_READER_ERRORS = (_UnsupportedWorkbook, KeyError, ValueError, IndexError, ParseError)
+
+
+def _fast_rows(rows: Iterator[tuple]) -> Iterator[tuple]:
+    """高速リーダーの行を返し、読み取りエラーを ExcelParseError にする"""
+    try:
+        yield from rows
+    except _FAST_READER_ERRORS as e:
+        raise ExcelParseError(f"ファイルを読み取れません: {e!r}") from e
+
+
+class WorkbookSession:
+    """ワークブックを1度だけ開き、形式判定と抽出を同じ行イテレータで行う
+
+    先頭 DETECT_ROWS 行をバッファして形式判定に使い、rows() ではバッファ済みの
+    先頭行に続けて残りの行を返すため、xlsx(zip)の展開・解析は1回で済む。
+    """
+
+    def __init__(self, file_path: str, fast: bool | None = None, sheet: str | None = None,
+                 limits: ParseLimits | None = None):
+        path = Path(file_path)
+        self.limits = limits if limits is not None else ParseLimits.from_settings()
+        self._started = time.monotonic()
+        self.limits.check_file(path)
+
+        self._reader = None
+        self._sheet = sheet
+        if path.suffix.lower() in TEXT_SUFFIXES:
+            self._reader = CsvReader(str(path))
+            try:
+                self._rows = self._guard(self._reader.rows(None if sheet is None else self._reader.sheet_index(sheet)))
+                self._head = list(islice(self._rows, DETECT_ROWS))
+            except ExcelParseError:
+                self._reader.close()
+                raise
+        elif FAST_READER if fast is None else fast:
+            try:
+                self._reader = FastXlsxReader(str(path))
+                rows = self._guard(self._reader.rows(None if sheet is None else self._reader.sheet_index(sheet)))
+                self._head = list(islice(rows, DETECT_ROWS))
+                # 先頭行より後の読み取りエラーは openpyxl に切り替えられないため、解析エラーとして返す
+                self._rows = _fast_rows(rows)
+            except _FAST_READER_ERRORS:
+                if self._reader is not None:
+                    self._reader.close()
+                self._reader = None
+            except ExcelParseError:
+                self._reader.close()
+                raise
+
+        if self._reader is None:
+            self._open_openpyxl(path, sheet)
+        self._consumed = False
+
+    def _open_openpyxl(self, path: Path, sheet: str | None):
+        self.wb = load_workbook(str(path), read_only=True, data_only=True)
+        if sheet is None:
+            ws = self.wb.active
+        else:
+            ws = self.wb[sheet] if sheet in self.wb.sheetnames else None
+        if ws is None:
+            self.wb.close()
+            raise ExcelParseError("アクティブなシートが見つかりません" if sheet is None else f"シートが見つかりません: {sheet}")
+        self._rows = self._guard(ws.iter_rows(values_only=True))
+        try:
+            self._head = list(islice(self._rows, DETECT_ROWS))
+        except ExcelParseError:
+            self.wb.close()
+            raise
+
+    def _guard(self, rows: Iterator[tuple]) -> Iterator[tuple]:
+        return self.limits.guard(rows, self._started)
+
+    @property
+    def sheet_name(self) -> str:
+        """読み込んでいるシートの名前 (sheet を指定しなければアクティブなシート)"""
+        if self._sheet is not None:
+            return self._sheet
+        if self._reader is not None:
+            return self._reader.sheets[self._reader.active][0]
+        return self.wb.active.title
+
+    def sheet_names(self) -> list[str]:
+        """表示されているワークシートの名前 (ブック内の順)"""
+        if self._reader is not None:
+            return [name for name, _, state in self._reader.sheets if state == "visible"]
+        return [ws.title for ws in self.wb.worksheets if ws.sheet_state == "visible"]
+
+    def peek(self, sheet: str) -> list[tuple]:
+        """開いているワークブックの別シートの先頭 DETECT_ROWS 行を読む (形式判定用)"""
+        if self._reader is not None:
+            rows = self._reader.rows(self._reader.sheet_index(sheet))
+            try:
+                return list(islice(self._guard(_fast_rows(rows)), DETECT_ROWS))
+            finally:
+                rows.close()
+        return list(islice(self._guard(self.wb[sheet].iter_rows(values_only=True)), DETECT_ROWS))
+
+    @property
+    def header(self) -> tuple:
+        """1行目 (テーブル形式のヘッダー行)"""
+        return self._head[0] if self._head else ()
+
+    def detect_format(self) -> str:
+        """先頭行から形式を判定: 'table' (一覧表) or 'key_value' (仕様書)"""
+        return _detect_format(self._head)
+
+    def rows(self) -> Iterator[tuple]:
+        """先頭行を含むシートの全行 (値のタプル) を返す。1セッションにつき1回のみ"""
+        if self._consumed:
+            raise ExcelParseError("ワークブックの行は既に読み取り済みです")
+        self._consumed = True
+        return chain(self._head, self._rows)
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+        else:
+            self.wb.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _detect_format(head_rows: list[tuple]) -> str:
+    """先頭行のいずれかに3つ以上の非空セルがあればテーブル形式と判定する。"""
+    for row in head_rows:
+        non_empty = sum(1 for v in row if v is not None and str(v).strip())
+        if non_empty >= 3:
+            return "table"
+    return "key_value"
+
+
 class ExcelParser:
     """Excelファイルを解析し、テンプレート定義に基づいてデータを抽出する"""
 
-    def __init__(self, template: dict | None = None):
+    def __init__(self, template: dict | None = None, plans: dict[tuple, RowPlan] | None = None,
+                 rules: RuleSet | None = None):
         self.template = template or {}
         self.column_mappings = template.get("column_mappings", {}) if template else {}
         self.validation_rules = template.get("validation_rules", {}) if template else {}
+        # plans / rules を渡すと同じテンプレートのパーサー間でコンパイル済みのものを共有できる
+        self.rules = rules if rules is not None else RuleSet(self.validation_rules, self.template.get("name"))
+        self.converters = self.rules.converters
+        self.errors: list[str] = []
+        self.report = ValidationReport()
+        self._plans: dict[tuple, RowPlan] = plans if plans is not None else {}
+
+    def compile_plan(self, header_row: tuple) -> RowPlan:
+        """ヘッダー行から変換計画を作る。同じヘッダーに対しては一度だけコンパイルする"""
+        headers = tuple(str(h).strip() if h else f"col_{i}" for i, h in enumerate(header_row))
+        plan = self._plans.get(headers)
+        if plan is None:
+            columns = []
+            for col_idx, header in enumerate(headers):
+                field = self.column_mappings.get(header, header)
+                columns.append((col_idx, field, self.converters.get(field)))
+            plan = RowPlan(tuple(columns))
+            self._plans[headers] = plan
+        return plan
+
+    def open(self, file_path: str) -> WorkbookSession:
+        """ワークブックセッションを開く"""
+        return WorkbookSession(file_path)
 
     def parse(self, file_path: str) -> list[dict]:
         """Excelファイルをパースしてレコードのリストを返す"""
-        path = Path(file_path)
-        if not path.exists():
-            raise ExcelParseError(f"ファイルが見つかりません: {file_path}")
+        return list(self.iter_records(file_path))
 
-        wb = load_workbook(str(path), read_only=True, data_only=True)
-        ws = wb.active
-        if ws is None:
-            raise ExcelParseError("アクティブなシートが見つかりません")
+    def iter_records(self, source: "str | WorkbookSession") -> Iterator[dict]:
+        """テーブル形式のレコードを1行ずつ検証しながら返すジェネレータ
 
-        rows = list(ws.iter_rows(values_only=True))
-        if len(rows) < 2:
-            raise ExcelParseError("データ行が見つかりません")
+        読み取り専用ワークシートから1行ずつ読むため、行数に関わらずメモリ使用量は一定。
+        source にはファイルパス、または開いたままの WorkbookSession を渡す
+        (後者の場合は呼び出し側でセッションを閉じる)。
+        検証エラーの行はスキップし、内容は self.errors に残る。
+        """
+        if isinstance(source, WorkbookSession):
+            yield from self._iter_table(source.rows())
+            return
+        with self.open(source) as session:
+            yield from self._iter_table(session.rows())
 
-        headers = [str(h).strip() if h else f"col_{i}" for i, h in enumerate(rows[0])]
-        records = []
-        errors = []
+    def _iter_table(self, rows: Iterator[tuple]) -> Iterator[dict]:
+        """テーブル形式の行からレコードを抽出する (1行目はヘッダー)
 
-        for row_idx, row in enumerate(rows[1:], start=2):
-            record = {}
-            for col_idx, value in enumerate(row):
-                if col_idx < len(headers):
-                    key = self.column_mappings.get(headers[col_idx], headers[col_idx])
-                    record[key] = value
+        型変換・検証に失敗した行はスキップし、行ごとの全エラーを self.report に記録する。
+        """
+        self.errors = []
+        self.report = ValidationReport()
+        header_row = next(rows, None)
+        if header_row is None:
+            raise ExcelParseError("データ行が見つかりません")
 
-            validation_error = self._validate(record, row_idx)
-            if validation_error:
-                errors.append(validation_error)
-                continue
+        plan = self.compile_plan(header_row)
+        rules = None if self.rules.is_empty else self.rules
+        has_data = False
 
-            records.append(record)
+        for row_idx, row in enumerate(rows, start=2):
+            has_data = True
+            record, failed = plan.apply(row)
+            if rules is not None:
+                errors = [rules.conversion_error(field, record[field], row_idx) for field in failed]
+                errors.extend(rules.check(record, row_idx, failed))
+                if errors:
+                    self._add_errors(row_idx, errors)
+                    continue
+            self.report.valid_rows += 1
+            yield record
 
-        wb.close()
-        return records
+        if not has_data:
+            raise ExcelParseError("データ行が見つかりません")
 
-    def _validate(self, record: dict, row_idx: int) -> str | None:
-        """バリデーションルールに基づいて検証"""
-        required_fields = self.validation_rules.get("required", [])
-        for field in required_fields:
-            if not record.get(field):
-                return f"行{row_idx}: 必須項目 '{field}' が空です"
-        return None
+    def _add_errors(self, row_idx: int | None, errors: list[FieldError]):
+        self.report.add(row_idx, errors)
+        self.errors.extend(str(e) for e in errors)
 
     def detect_format(self, file_path: str) -> str:
         """Excelの形式を自動判定: 'table' (一覧表) or 'key_value' (仕様書)
 
         1行目に3つ以上の非空セルが連続していればテーブル形式と判定する。
         """
-        path = Path(file_path)
-        if not path.exists():
-            raise ExcelParseError(f"ファイルが見つかりません: {file_path}")
-
-        wb = load_workbook(str(path), read_only=True, data_only=True)
-        ws = wb.active
-        if ws is None:
-            wb.close()
-            raise ExcelParseError("アクティブなシートが見つかりません")
-
-        # 最初の数行を検査して形式を判定
-        for row in ws.iter_rows(min_row=1, max_row=5, values_only=True):
-            non_empty = sum(1 for v in row if v is not None and str(v).strip())
-            if non_empty >= 3:
-                wb.close()
-                return "table"
-
-        wb.close()
-        return "key_value"
+        with self.open(file_path) as session:
+            return session.detect_format()
 
     def smart_parse(self, file_path: str) -> dict | list[dict]:
         """形式を自動判定して適切なパーサーで処理する。
 
+        ワークブックは1度だけ開き、形式判定に使った先頭行をそのまま抽出に引き継ぐ。
+
         Returns:
             dict: キーバリュー形式（発注仕様書）の場合
             list[dict]: テーブル形式（発注一覧）の場合
         """
-        fmt = self.detect_format(file_path)
-        if fmt == "table":
-            return self.parse(file_path)
-        return self.parse_order_excel(file_path)
+        with self.open(file_path) as session:
+            if session.detect_format() == "table":
+                return list(self.iter_records(session))
+            return self.extract_key_values(session)
 
     def parse_order_excel(self, file_path: str) -> dict:
         """発注仕様書Excel専用のパース処理 (キーバリュー形式)"""
-        path = Path(file_path)
-        if not path.exists():
-            raise ExcelParseError(f"ファイルが見つかりません: {file_path}")
+        with self.open(file_path) as session:
+            return self.extract_key_values(session)
 
-        wb = load_workbook(str(path), read_only=True, data_only=True)
-        ws = wb.active
-        if ws is None:
-            raise ExcelParseError("アクティブなシートが見つかりません")
-
-        data = {}
-        for row in ws.iter_rows(min_row=1, max_row=50, max_col=10, values_only=False):
-            for cell in row:
-                if cell.value and isinstance(cell.value, str):
-                    key = cell.value.strip()
-                    # Look for value in next column
-                    next_cell = ws.cell(row=cell.row, column=cell.column + 1)
-                    if next_cell.value is not None:
-                        data[key] = next_cell.value
-
-        wb.close()
-        return data
+    def extract_key_values(self, session: WorkbookSession) -> dict:
+        """開いているセッションからキーバリュー形式のデータを抽出する"""
+        return self.map_key_values(self._extract_key_values(session.rows()))
+
+    def map_key_values(self, data: dict) -> dict:
+        """キーバリュー形式のデータにテンプレートの項目マッピング・型変換・検証を適用する
+
+        検証エラーは self.report (行番号なし) と self.errors に記録する。
+        """
+        self.report = ValidationReport()
+        if not self.column_mappings and self.rules.is_empty:
+            return data
+        mapped = {}
+        for key, value in data.items():
+            mapped.setdefault(self.column_mappings.get(key, key), value)
+        mapped, errors = self.rules.validate(mapped)
+        self.report.add(None, errors)
+        self.errors.extend(str(e) for e in errors)
+        return mapped
+
+    def _extract_key_values(self, rows: Iterator[tuple]) -> dict:
+        """先頭 KEY_VALUE_MAX_ROW 行 × KEY_VALUE_MAX_COL 列を一度だけ読み込み、項目名と値を組にする"""
+        grid = _read_grid(rows, KEY_VALUE_MAX_ROW, KEY_VALUE_MAX_COL + 1)
+        return _resolve_key_values(grid, KEY_VALUE_MAX_COL)
+
+
+def _read_grid(rows: Iterator[tuple], max_row: int, width: int) -> list[tuple]:
+    """先頭 max_row 行を幅 width に揃えたタプルのリストとして読み込む"""
+    grid = []
+    for row in islice(rows, max_row):
+        row = tuple(row[:width])
+        if len(row) < width:
+            row += (None,) * (width - len(row))
+        grid.append(row)
+    return grid
+
+
+# 「作成日: 2026年2月10日」のように項目名と値を1つのセルに書いた行
+_INLINE_ITEM = re.compile(r"^[^:：\s]+\s*[:：]\s*\S")
+
+
+def _title_row(grid: list[tuple]) -> int | None:
+    """表題の行 (値の入った最初の行が1セルだけで、真下の同じ列が1行で完結した項目の場合)。なければ None"""
+    for r, row in enumerate(grid):
+        filled = [c for c, v in enumerate(row) if v is not None]
+        if not filled:
+            continue
+        if len(filled) != 1 or r + 1 >= len(grid):
+            return None
+        below = grid[r + 1][filled[0]]
+        return r if isinstance(below, str) and _INLINE_ITEM.match(below) else None
+    return None
+
+
+def _resolve_key_values(grid: list[tuple], key_cols: int) -> dict:
+    """メモリ上のグリッドから項目名と値の組を解決する。
+
+    左から key_cols 列までの文字列セルを項目名とし、値は次の順で探す:
+    1. 右隣のセル
+    2. 右隣が空の場合 (項目名の結合セル)、同じ行を右へ進んだ最初の値。
+       ただしそのセル自体が項目名 (文字列で右隣に値を持つ) なら値とはみなさない
+    3. 右側がすべて空の場合、真下のセル。下から順に解決し、真下のセルが
+       既に値を持つ項目名であれば値とはみなさない (見出し → 項目名 → 値 の縦並び対策)。
+       ただし先頭の1セルだけの行の真下が「作成日: …」のような1行で完結した項目なら、
+       その行は表題 (「発注仕様書」など) とみなし、真下とは組にしない
+    値として使ったセルは項目名として扱わない。各セルの参照は定数回なので行数に対して線形。
+    """
+    n_rows = len(grid)
+    width = len(grid[0]) if grid else 0
+    title_row = _title_row(grid)
+    pairs: dict[tuple[int, int], tuple[int, int]] = {}
+    consumed: set[tuple[int, int]] = set()
+    below_candidates: list[tuple[int, int]] = []
+
+    def has_right_value(r: int, c: int) -> bool:
+        return c + 1 < width and grid[r][c + 1] is not None
+
+    def is_key(r: int, c: int) -> bool:
+        value = grid[r][c]
+        return bool(value) and isinstance(value, str) and (r, c) not in consumed
+
+    # 1, 2: 右方向 (上から順に解決)
+    for r, row in enumerate(grid):
+        for c in range(min(key_cols, width - 1)):
+            if not is_key(r, c):
+                continue
+            if row[c + 1] is not None:
+                target = (r, c + 1)
+            else:
+                next_col = next((i for i in range(c + 2, width) if row[i] is not None), None)
+                if next_col is None:
+                    below_candidates.append((r, c))
+                    continue
+                if isinstance(row[next_col], str) and has_right_value(r, next_col):
+                    continue
+                target = (r, next_col)
+            if target not in consumed:
+                pairs[(r, c)] = target
+                consumed.add(target)
+
+    # 3: 下方向 (下から順に解決)
+    for r, c in reversed(below_candidates):
+        if (r, c) in consumed or r == title_row or r + 1 >= n_rows:
+            continue
+        target = (r + 1, c)
+        if grid[r + 1][c] is None or target in consumed or target in pairs or has_right_value(r + 1, c):
+            continue
+        pairs[(r, c)] = target
+        consumed.add(target)
+
+    data = {}
+    for (r, c), (tr, tc) in sorted(pairs.items()):
+        if (r, c) in consumed:
+            continue
+        data[grid[r][c].strip()] = grid[tr][tc]
+    return data
@@ -0,0 +1,112 @@
+"""Excelテンプレート選択: ExcelTemplate をヘッダーの指紋で自動選択し、コンパイル済み計画をキャッシュする"""
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.models.automation import ExcelTemplate
+from workers.excel_parser import ExcelParser, RowPlan, WorkbookSession
+from workers.validation import RuleSet
+
+# マッピング定義の列名のうち、この割合以上がファイル側に存在すればテンプレートを採用する
+MIN_COVERAGE = 0.5
+
+# 選択結果キャッシュの上限 (ヘッダーの種類が増え続けてもメモリを食い潰さないように)
+SELECTION_CACHE_SIZE = 256
+
+# 有効なテンプレート一覧とコンパイル済み計画のプロセス内キャッシュ
+# stamp (件数・最大ID・最終更新日時) が変わったら丸ごと作り直す
+_cache: dict = {"stamp": None, "templates": [], "plans": {}, "rules": {}, "selection": {}}
+
+
+def _fingerprint(labels) -> frozenset[str]:
+    return frozenset(str(label).strip() for label in labels if label is not None and str(label).strip())
+
+
+def _template_dict(template: ExcelTemplate) -> dict:
+    return {
+        "id": template.id,
+        "name": template.name,
+        "template_type": template.template_type,
+        "column_mappings": template.column_mappings or {},
+        "validation_rules": template.validation_rules or {},
+    }
+
+
+class TemplateRegistry:
+    """有効な ExcelTemplate からファイルに合うものを選び、パーサーを組み立てる"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _templates(self) -> list[dict]:
+        stamp = tuple(
+            self.db.query(
+                func.count(ExcelTemplate.id), func.max(ExcelTemplate.id), func.max(ExcelTemplate.updated_at)
+            )
+            .filter(ExcelTemplate.is_active.is_(True))
+            .one()
+        )
+        if stamp != _cache["stamp"]:
+            templates = (
+                self.db.query(ExcelTemplate)
+                .filter(ExcelTemplate.is_active.is_(True))
+                .order_by(ExcelTemplate.id.asc())
+                .all()
+            )
+            _cache["templates"] = [_template_dict(t) for t in templates]
+            _cache["plans"] = {}
+            _cache["rules"] = {}
+            _cache["selection"] = {}
+            _cache["stamp"] = stamp
+        return _cache["templates"]
+
+    def version(self) -> str:
+        """有効なテンプレート群のバージョン。テンプレートが追加・変更されると変わる"""
+        self._templates()
+        count, max_id, updated_at = _cache["stamp"]
+        return f"{count}-{max_id}-{updated_at.isoformat() if updated_at else ''}"
+
+    def select(self, labels, template_type: str) -> dict | None:
+        """ヘッダー (またはキーバリューの項目名) の集合に最も合うテンプレートを返す
+
+        列名の一致率が MIN_COVERAGE 未満のテンプレートは対象外。
+        同率の場合は ID が小さいものを優先する。
+        """
+        templates = self._templates()
+        fingerprint = _fingerprint(labels)
+        cache_key = (template_type, fingerprint)
+        if cache_key in _cache["selection"]:
+            return _cache["selection"][cache_key]
+
+        best, best_coverage = None, 0.0
+        for template in templates:
+            if template["template_type"] != template_type or not template["column_mappings"]:
+                continue
+            keys = template["column_mappings"].keys()
+            coverage = sum(1 for key in keys if key in fingerprint) / len(keys)
+            if coverage >= MIN_COVERAGE and coverage > best_coverage:
+                best, best_coverage = template, coverage
+
+        if len(_cache["selection"]) >= SELECTION_CACHE_SIZE:
+            _cache["selection"].clear()
+        _cache["selection"][cache_key] = best
+        return best
+
+    def parser_for(self, template: dict | None) -> ExcelParser:
+        """テンプレートのパーサーを作る。コンパイル済みの計画・検証ルールはテンプレート単位で共有する"""
+        if template is None:
+            return ExcelParser()
+        plans: dict[tuple, RowPlan] = _cache["plans"].setdefault(template["id"], {})
+        rules = _cache["rules"].get(template["id"])
+        if rules is None:
+            rules = _cache["rules"][template["id"]] = RuleSet(template["validation_rules"], template["name"])
+        return ExcelParser(template, plans=plans, rules=rules)
+
+    def parser_for_table(self, session: WorkbookSession) -> ExcelParser:
+        """テーブル形式のヘッダー行からテンプレートを選んでパーサーを返す"""
+        return self.parser_for(self.select(session.header, "table"))
+
+    def extract_key_values(self, session: WorkbookSession) -> tuple[dict, ExcelParser]:
+        """キーバリュー形式を抽出し、項目名に合うテンプレートがあればマッピングを適用する"""
+        raw = ExcelParser().extract_key_values(session)
+        parser = self.parser_for(self.select(raw.keys(), "key_value"))
+        return parser.map_key_values(raw), parser
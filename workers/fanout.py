@@ -0,0 +1,161 @@
+"""一覧形式の発注の展開: 行ごとの子ジョブをまとめて作成し、振り分けを Celery の group で並列実行する
+
+子ジョブは FANOUT_CHUNK_SIZE 件ずつ複数行INSERTで作成する。振り分けは子ジョブIDの塊ごとに
+1タスクとし、同時に動くタスク数が FANOUT_MAX_PARALLEL を超えないよう塊の大きさを調整する。
+全タスクの結果は chord のコールバック (finalize_fanout) が親ジョブに集計する。
+"""
+import math
+from itertools import islice
+from typing import TYPE_CHECKING, Iterable, Sequence
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from app.models.automation import JobStatus, ProcessingJob, ProcessingLog
+from app.services.step_timing import STEP_ROUTE, STEP_TO_APPROVAL, record_timings, timing_row, utcnow
+from workers.validation import to_json_value
+
+if TYPE_CHECKING:
+    from app.services.routing import RoutingBatch
+
+# 1回の INSERT / 1タスクで扱う子ジョブの件数 (下限)
+FANOUT_CHUNK_SIZE = 200
+# 1つの親ジョブから同時に実行する振り分けタスクの上限
+FANOUT_MAX_PARALLEL = 8
+
+
+def create_child_jobs(
+    db: Session,
+    parent: ProcessingJob,
+    records: Sequence[dict],
+    labels: Sequence[str],
+    targets: Sequence[str | None] | None = None,
+    status: JobStatus = JobStatus.routing,
+) -> list[int]:
+    """レコードごとの子ジョブと「解析完了」ログを複数行INSERTで作成し、子ジョブIDを返す (コミットはしない)
+
+    Args:
+        labels: 子ジョブごとのログメッセージ
+        targets: 振り分け済みの場合の振り分け先 (None はこれから振り分ける)
+    """
+    if not records:
+        return []
+    targets = targets or [None] * len(records)
+    now = utcnow()
+    rows = [
+        {
+            "parent_job_id": parent.id,
+            "slack_channel_id": parent.slack_channel_id,
+            "slack_message_id": parent.slack_message_id,
+            "excel_file_path": parent.excel_file_path,
+            "status": status,
+            "assigned_system": target,
+            "result": {k: to_json_value(v) for k, v in record.items()},
+            "created_at": now,
+            "updated_at": now,
+        }
+        for record, target in zip(records, targets)
+    ]
+    ids = list(db.execute(
+        insert(ProcessingJob).returning(ProcessingJob.id, sort_by_parameter_order=True), rows,
+    ).scalars())
+    db.execute(insert(ProcessingLog), [
+        {"job_id": job_id, "step_name": "解析", "status": "completed", "message": label, "created_at": now}
+        for job_id, label in zip(ids, labels)
+    ])
+    if status == JobStatus.pending_approval:
+        # 振り分け済みで作成する場合 (Slack経由) は、受信から承認待ちまでの時間をここで記録する
+        record_timings(db, [timing_row(job_id, STEP_TO_APPROVAL, parent.created_at or now, now) for job_id in ids])
+    return ids
+
+
+def create_children_from(
+    db: Session,
+    parent: ProcessingJob,
+    items: Iterable[tuple[dict, str]],
+    routing: "RoutingBatch | None" = None,
+    chunk_size: int | None = None,
+) -> list[tuple[int, str]]:
+    """(レコード, ログメッセージ) を読みながら chunk_size 件ずつ子ジョブを作成し、(子ジョブID, ログメッセージ) を返す
+
+    routing を渡すと塊ごとにその場で振り分けて承認待ちで作成し、振り分け結果を routing に加える
+    (渡さない場合は振り分け待ちで作成する)。コミットはしないため、途中で解析に失敗した場合は
+    呼び出し側のロールバックで作成済みの子ジョブも取り消される。
+    """
+    from app.services.routing import route_batch
+
+    items = iter(items)
+    chunk_size = chunk_size or FANOUT_CHUNK_SIZE
+    created = []
+    while chunk := list(islice(items, chunk_size)):
+        records = [record for record, _ in chunk]
+        labels = [label for _, label in chunk]
+        if routing is None:
+            ids = create_child_jobs(db, parent, records, labels)
+        else:
+            batch = route_batch(db, records)
+            routing.extend(batch)
+            ids = create_child_jobs(db, parent, records, labels, batch.targets, status=JobStatus.pending_approval)
+        created += zip(ids, labels)
+    return created
+
+
+def plan_chunks(job_ids: Sequence[int], chunk_size: int | None = None,
+                max_parallel: int | None = None) -> list[list[int]]:
+    """子ジョブIDを振り分けタスクの単位に分ける (塊の数は max_parallel 以下)"""
+    chunk_size = chunk_size or FANOUT_CHUNK_SIZE
+    max_parallel = max_parallel or FANOUT_MAX_PARALLEL
+    size = max(chunk_size, math.ceil(len(job_ids) / max_parallel))
+    return [list(job_ids[i:i + size]) for i in range(0, len(job_ids), size)]
+
+
+def route_children(db: Session, job_ids: Iterable[int]) -> dict:
+    """子ジョブをまとめて振り分けて承認待ちにする。集計用に件数とルールの一致件数を返す"""
+    from app.services.routing import route_batch
+
+    started_at = utcnow()
+    jobs = (
+        db.query(ProcessingJob)
+        .filter(ProcessingJob.id.in_(list(job_ids)), ProcessingJob.status == JobStatus.routing)
+        .order_by(ProcessingJob.id)
+        .all()
+    )
+    batch = route_batch(db, [job.result or {} for job in jobs])
+    logs = []
+    timings = []
+    now = utcnow()
+    received = {}
+    parent_ids = {job.parent_job_id for job in jobs if job.parent_job_id}
+    if parent_ids:
+        # 受信時刻は親ジョブ (Slack受信・アップロード時に作成) の作成日時
+        received = dict(db.query(ProcessingJob.id, ProcessingJob.created_at).filter(ProcessingJob.id.in_(parent_ids)))
+    for job, target in zip(jobs, batch.targets):
+        timings.append(timing_row(job.id, STEP_ROUTE, started_at, now))
+        timings.append(timing_row(job.id, STEP_TO_APPROVAL, received.get(job.parent_job_id) or job.created_at, now))
+        job.assigned_system = target
+        job.status = JobStatus.pending_approval
+        if target:
+            logs.append({"job_id": job.id, "step_name": "routing", "status": "completed",
+                         "message": f"振り分け先: {target}", "created_at": now})
+        else:
+            logs.append({"job_id": job.id, "step_name": "routing", "status": "manual_required",
+                         "message": "自動振り分け不可。手動振り分けが必要です", "created_at": now})
+    if logs:
+        db.execute(insert(ProcessingLog), logs)
+    record_timings(db, timings)
+    db.commit()
+    return {"count": len(jobs), **batch.to_dict()}
+
+
+def summarize(results: Iterable[dict]) -> dict:
+    """振り分けタスクの結果を合算する"""
+    summary = {"routed": 0, "failed_chunks": 0, "routing": {"hits": {}, "unmatched": 0}}
+    for result in results:
+        if not isinstance(result, dict) or "error" in result:
+            summary["failed_chunks"] += 1
+            continue
+        summary["routed"] += result["count"]
+        summary["routing"]["unmatched"] += result["unmatched"]
+        for rule_id, count in result["hits"].items():
+            summary["routing"]["hits"][rule_id] = summary["routing"]["hits"].get(rule_id, 0) + count
+    return summary
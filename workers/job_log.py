@@ -0,0 +1,119 @@
+"""ジョブの処理ログのバッファ: ProcessingLog とステータス変更をまとめて1回のコミットで書き込む
+
+パイプラインはログ1行ごとにコミットすると処理時間の大半がコミット待ちになるため、
+ログはメモリに溜めてステップの区切り (flush) で複数行INSERTする。
+ジョブ監視画面の表示遅れは MAX_DELAY 秒までに抑える (log 呼び出し時に経過していれば書き出す)。
+ステップの所要時間 (processing_step_timings) も同じく溜めて flush で書き込む。
+コミットしたログとステータス変更は job_events で監視画面に配信する。
+"""
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from app.models.automation import JobStatus, ProcessingJob, ProcessingLog
+from app.services.job_events import log_event, publish, status_event
+from app.services.step_timing import record_timings, timing_row, utcnow
+
+# 溜めたログを書き出すまでの最大の遅れ (秒)
+MAX_DELAY = 2.0
+
+
+class JobLogBuffer:
+    """1ジョブ分のログとステータス変更を溜め、flush で1トランザクションにまとめて書き込む
+
+    with で使うと、例外で抜けた場合は途中の変更をロールバックし、それまでのログだけを書き出す。
+    """
+
+    def __init__(self, db: Session, job_id: int, max_delay: float = MAX_DELAY):
+        self.db = db
+        self.job_id = job_id
+        self.max_delay = max_delay
+        self._entries: list[dict] = []
+        self._timings: list[dict] = []
+        # 配信するステータス変更 (ジョブごとに最新のもの)
+        self._transitions: dict[int, dict] = {}
+        self._flushed_at = time.monotonic()
+
+    def log(self, step: str, status: str, message: str, screenshot: str | None = None):
+        self._entries.append({
+            "job_id": self.job_id,
+            "step_name": step,
+            "status": status,
+            "message": message,
+            "screenshot_path": screenshot,
+            # 複数行INSERTでも記録した時刻が残るよう、DBの now() ではなくここで時刻を入れる
+            "created_at": utcnow(),
+        })
+        if time.monotonic() - self._flushed_at >= self.max_delay:
+            self.flush()
+
+    def transition(self, job: ProcessingJob, status: JobStatus, **fields):
+        """ステータスと関連項目を変更する (コミットは次の flush で行う)"""
+        job.status = status
+        for name, value in fields.items():
+            setattr(job, name, value)
+        self._transitions[job.id] = status_event(job)
+
+    def timing(self, step: str, started_at: datetime, finished_at: datetime | None = None, status: str = "completed"):
+        """ステップの所要時間を記録する"""
+        self._timings.append(timing_row(self.job_id, step, started_at, finished_at or utcnow(), status))
+
+    @contextmanager
+    def timed(self, step: str):
+        """with ブロックの実行時間をステップの所要時間として記録する (例外時は failed)"""
+        started_at = utcnow()
+        try:
+            yield
+        except BaseException:
+            self.timing(step, started_at, status="failed")
+            raise
+        self.timing(step, started_at)
+
+    @property
+    def pending(self) -> int:
+        return len(self._entries)
+
+    def _write(self):
+        """溜めたログと所要時間をコミットする (失敗した場合は溜めたまま残す)"""
+        if self._entries:
+            self.db.execute(insert(ProcessingLog), self._entries)
+        record_timings(self.db, self._timings)
+        self.db.commit()
+        events = [log_event(entry) for entry in self._entries] + list(self._transitions.values())
+        self._entries, self._timings, self._transitions = [], [], {}
+        publish(events)
+
+    def flush(self):
+        """溜めたログを複数行INSERTし、ステータス変更などと一緒にコミットする"""
+        self._write()
+        self._flushed_at = time.monotonic()
+
+    def close(self, discard_changes: bool = False):
+        """残りのログを書き出す
+
+        discard_changes=True (例外で抜けた場合) は途中までの変更をロールバックし、ログだけを書く。
+        コミットに失敗した場合も同様にログだけを書き直す。
+        """
+        if discard_changes:
+            self.db.rollback()
+            self._transitions = {}
+        elif not self._entries and not self._timings:
+            return
+        else:
+            try:
+                self.flush()
+                return
+            except Exception:
+                self.db.rollback()
+                self._transitions = {}
+        if self._entries or self._timings:
+            self._write()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(discard_changes=exc_type is not None)
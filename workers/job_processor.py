@@ -1,27 +1,19 @@
 """ジョブプロセッサ: Celeryタスクとして自動化パイプラインを実行"""
-from datetime import datetime, timezone
-
-from celery import shared_task
-from sqlalchemy.orm import Session
+from celery import chord, group, shared_task
 
 from app.database import SessionLocal
-from app.models.automation import ProcessingJob, ProcessingLog, JobStatus
-from workers.excel_parser import ExcelParser, ExcelParseError
+from app.models.automation import ProcessingJob, JobStatus
+from app.services.dead_letter import record_failure
+from app.services.step_timing import STEP_PARSE, STEP_ROUTE, STEP_TO_APPROVAL, utcnow
+from workers.excel_parser import ExcelParseError
+from workers.fanout import create_children_from, plan_chunks, route_children, summarize
+from workers.job_log import JobLogBuffer
+from workers.multi_sheet import iter_sheet_records
+from workers.parse_cache import open_parsed
+from workers.validation import to_json_value
 from workers.routing_engine import RoutingEngine
 
 
-def _add_log(db: Session, job_id: int, step: str, status: str, message: str, screenshot: str | None = None):
-    log = ProcessingLog(
-        job_id=job_id,
-        step_name=step,
-        status=status,
-        message=message,
-        screenshot_path=screenshot,
-    )
-    db.add(log)
-    db.commit()
-
-
 @shared_task(name="workers.process_order")
 def process_order(job_id: int) -> dict:
     """発注処理パイプラインのメインタスク"""
@@ -31,89 +23,161 @@ def process_order(job_id: int) -> dict:
         if not job:
             return {"error": f"Job {job_id} not found"}
 
-        # Step 1: Excel解析
-        job.status = JobStatus.parsing
-        db.commit()
-        _add_log(db, job_id, "excel_parse", "started", "Excel解析を開始")
-
-        try:
-            parser = ExcelParser()
-            result = parser.smart_parse(job.excel_file_path)
-            if isinstance(result, list):
-                # テーブル形式: 複数レコード → 最初のレコードを使用、全件数を記録
-                order_data = result[0] if result else {}
-                _add_log(db, job_id, "excel_parse", "completed", f"一覧形式: {len(result)}件検出、{len(order_data)}フィールド抽出")
-                job.result = {"all_records": [{k: str(v) for k, v in r.items()} for r in result]}
-                db.commit()
+        with JobLogBuffer(db, job_id) as log:
+            # Step 1: Excel解析
+            log.transition(job, JobStatus.parsing)
+            log.log("excel_parse", "started", "Excel解析を開始")
+            log.flush()
+            parse_started = utcnow()
+
+            try:
+                child_ids = []
+                with open_parsed(db, job.excel_file_path) as parsed:
+                    if parsed.format == "table":
+                        # テーブル形式: 行を逐次読み、FANOUT_CHUNK_SIZE 件ずつ子ジョブをまとめて作成する
+                        items = ((record, f"一覧 {n}行目") for n, record in enumerate(parsed.iter_records(), start=1))
+                        child_ids = [child_id for child_id, _ in create_children_from(db, job, items)]
+                        record_count = len(child_ids)
+                        report = parsed.report
+                        errors = parsed.errors
+                    elif parsed.format == "multi_sheet":
+                        # 複数シート: シートの順にレコードを読み、一覧の行・仕様書シートをそれぞれ子ジョブにする
+                        summary = {}
+                        created = create_children_from(db, job, iter_sheet_records(parsed.iter_sheets(), summary))
+                        child_ids = [child_id for child_id, _ in created]
+                        record_count = len(child_ids)
+                        report = {"invalid_rows": sum(r["invalid_rows"] for r in summary["validation"].values())}
+                        errors = summary["errors"]
+                    else:
+                        order_data = parsed.data
+                        record_count = 1 if order_data else 0
+                        report = parsed.report
+                        errors = parsed.errors
+                    if parsed.from_cache:
+                        log.log("excel_parse", "cached", "解析済みの結果を再利用")
+
+                fanout = parsed.format in ("table", "multi_sheet")
+                # 検証エラー: 仕様書形式、または一覧の全行が不正な場合は登録前にここで止める
+                if report["invalid_rows"] and (not fanout or record_count == 0):
+                    error_message = "検証エラー: " + " / ".join(errors[:5])
+                    log.transition(job, JobStatus.failed, error_message=error_message, result={"validation": report})
+                    log.log("excel_parse", "failed", error_message)
+                    log.timing(STEP_PARSE, parse_started, status="failed")
+                    record_failure(db, job, STEP_PARSE, error_message, error_class="ValidationError")
+                    log.flush()
+                    return {"error": error_message, "validation": report}
+                if report["invalid_rows"]:
+                    log.log("excel_parse", "warning", f"検証エラーのため{report['invalid_rows']}行をスキップ: " + " / ".join(errors[:5]))
+
+                if parsed.format == "table":
+                    log.log("excel_parse", "completed", f"一覧形式: {record_count}件検出、個別ジョブを作成")
+                    job.result = {"format": "table", "record_count": record_count, "child_count": record_count, "validation": report}
+                elif parsed.format == "multi_sheet":
+                    log.log("excel_parse", "completed", f"複数シート: {len(summary['sheets'])}シートから{record_count}件検出、個別ジョブを作成")
+                    job.result = {
+                        "format": "multi_sheet", "record_count": record_count, "child_count": record_count,
+                        "sheets": summary["sheets"], "validation": summary["validation"],
+                    }
+                else:
+                    log.log("excel_parse", "completed", f"仕様書形式: {len(order_data)}フィールド抽出")
+                    job.result = {"record_count": record_count, "validation": report}
+            except ExcelParseError as e:
+                # 途中まで作成した子ジョブを取り消してから失敗を記録する
+                db.rollback()
+                log.transition(job, JobStatus.failed, error_message=str(e))
+                log.log("excel_parse", "failed", str(e))
+                log.timing(STEP_PARSE, parse_started, status="failed")
+                record_failure(db, job, STEP_PARSE, e)
+                log.flush()
+                return {"error": str(e)}
+            log.timing(STEP_PARSE, parse_started)
+
+            if fanout:
+                # Step 2: 子ジョブの振り分けを並列実行し、完了後に finalize_fanout が親ジョブを完了にする
+                log.transition(job, JobStatus.routing)
+                log.log("routing", "started", f"{record_count}件の振り分けを開始")
+                log.flush()
+                dispatch_fanout(job_id, child_ids)
+                return {"status": "routing", "job_id": job_id, "child_count": record_count}
+
+            # Step 2: 振り分け判定
+            log.transition(job, JobStatus.routing)
+            log.log("routing", "started", "振り分け判定を開始")
+            log.flush()
+
+            with log.timed(STEP_ROUTE):
+                target = RoutingEngine(db).determine_target(order_data)
+
+            if target:
+                job.assigned_system = target
+                log.log("routing", "completed", f"振り分け先: {target}")
             else:
-                order_data = result
-                _add_log(db, job_id, "excel_parse", "completed", f"仕様書形式: {len(order_data)}フィールド抽出")
-        except ExcelParseError as e:
-            job.status = JobStatus.failed
-            job.error_message = str(e)
-            db.commit()
-            _add_log(db, job_id, "excel_parse", "failed", str(e))
-            return {"error": str(e)}
-
-        # Step 2: 振り分け判定
-        job.status = JobStatus.routing
-        db.commit()
-        _add_log(db, job_id, "routing", "started", "振り分け判定を開始")
-
-        engine = RoutingEngine(db)
-        target = engine.determine_target(order_data)
-
-        if target:
-            job.assigned_system = target
-            _add_log(db, job_id, "routing", "completed", f"振り分け先: {target}")
-        else:
-            job.assigned_system = None
-            _add_log(db, job_id, "routing", "manual_required", "自動振り分け不可。手動振り分けが必要です")
-
-        # Step 3: 承認待ち
-        job.status = JobStatus.pending_approval
-        job.result = {"order_data": {k: str(v) for k, v in order_data.items()}}
-        db.commit()
-        _add_log(db, job_id, "approval", "waiting", "承認待ち")
-
-        return {"status": "pending_approval", "target": target, "job_id": job_id}
+                job.assigned_system = None
+                log.log("routing", "manual_required", "自動振り分け不可。手動振り分けが必要です")
+
+            # Step 3: 承認待ち
+            log.transition(
+                job, JobStatus.pending_approval,
+                result={**job.result, "order_data": {k: to_json_value(v) for k, v in order_data.items()}},
+            )
+            log.log("approval", "waiting", "承認待ち")
+            log.timing(STEP_TO_APPROVAL, job.created_at)
+            log.flush()
+
+            return {"status": "pending_approval", "target": target, "job_id": job_id}
 
     finally:
         db.close()
 
 
-@shared_task(name="workers.execute_web_input")
-def execute_web_input(job_id: int) -> dict:
-    """承認後のWeb入力実行タスク"""
-    db = SessionLocal()
-    try:
-        job = db.query(ProcessingJob).filter(ProcessingJob.id == job_id).first()
-        if not job:
-            return {"error": f"Job {job_id} not found"}
-
-        job.status = JobStatus.executing
-        db.commit()
-        _add_log(db, job_id, "web_input", "started", f"Web入力を開始: {job.assigned_system}")
+def dispatch_fanout(parent_id: int, child_ids: list[int]):
+    """子ジョブの振り分けを group で投入し、chord のコールバックで親ジョブに集計する
 
-        try:
-            # MCP経由でWebシステムに入力 (モック)
-            from mcp_servers.common.mcp_base import MockMCPClient
-            client = MockMCPClient(job.assigned_system or "system_a")
-            result = client.execute_order_input(job.result.get("order_data", {}))
+    ブローカーに接続できない場合はこのプロセスで順に実行する。
+    """
+    chunks = plan_chunks(child_ids)
+    if not chunks:
+        finalize_fanout([], parent_id)
+        return
+    try:
+        chord(group(route_child_jobs.s(chunk) for chunk in chunks))(finalize_fanout.s(parent_id))
+    except Exception:
+        # Redis未接続時は同期実行
+        finalize_fanout([route_child_jobs(chunk) for chunk in chunks], parent_id)
 
-            job.status = JobStatus.completed
-            job.result = {**(job.result or {}), "web_result": result}
-            db.commit()
-            _add_log(db, job_id, "web_input", "completed", f"Web入力完了: {result.get('order_number', 'N/A')}", result.get("screenshot_path"))
 
-            return {"status": "completed", "result": result}
+@shared_task(name="workers.route_child_jobs")
+def route_child_jobs(job_ids: list[int]) -> dict:
+    """子ジョブの塊を振り分けて承認待ちにする"""
+    db = SessionLocal()
+    try:
+        return route_children(db, job_ids)
+    except Exception as e:
+        db.rollback()
+        return {"error": str(e), "job_ids": job_ids}
+    finally:
+        db.close()
 
-        except Exception as e:
-            job.status = JobStatus.failed
-            job.error_message = str(e)
-            db.commit()
-            _add_log(db, job_id, "web_input", "failed", str(e))
-            return {"error": str(e)}
 
+@shared_task(name="workers.finalize_fanout")
+def finalize_fanout(results: list[dict], parent_id: int) -> dict:
+    """振り分けタスクの結果を親ジョブに集計し、親ジョブを完了にする"""
+    db = SessionLocal()
+    try:
+        job = db.query(ProcessingJob).filter(ProcessingJob.id == parent_id).first()
+        if not job:
+            return {"error": f"Job {parent_id} not found"}
+
+        summary = summarize(results)
+        with JobLogBuffer(db, parent_id) as log:
+            log.transition(job, JobStatus.completed, result={**(job.result or {}), **summary})
+            if summary["failed_chunks"]:
+                failed = [r for r in results if isinstance(r, dict) and "error" in r]
+                log.log("routing", "warning", f"{summary['failed_chunks']}個の振り分けタスクが失敗: " + " / ".join(r["error"] for r in failed[:5]))
+            log.log("routing", "completed",
+                    f"{summary['routed']}件を振り分け (手動振り分け {summary['routing']['unmatched']}件)")
+            log.flush()
+        return {"status": "completed", "job_id": parent_id, **summary}
     finally:
         db.close()
+
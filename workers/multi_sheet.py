@@ -0,0 +1,231 @@
+"""複数シートのワークブック取り込み: データのあるシートを検出し、シートごとに形式判定・並列解析する
+
+案件ごと・月ごとにシートを分けたExcelを、ファイルを分割せずにそのまま取り込むためのもの。
+テーブル形式のシートが複数ある場合はプロセスプールで並列に解析し、各ワーカーは
+STREAM_CHUNK_SIZE 件ずつキューに送る。受け取る側はシートの順にレコードを読みながら処理でき、
+1シート分のレコードをまとめてメモリに載せることはない。
+"""
+import os
+import queue
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from multiprocessing import get_context
+from typing import Iterable, Iterator
+
+from workers.excel_parser import ExcelParseError, ExcelParser, WorkbookSession, _detect_format
+
+# 並列解析に使うプロセス数の上限
+MAX_WORKERS = os.cpu_count() or 1
+# ワーカーから1回に送るレコード数
+STREAM_CHUNK_SIZE = 500
+# シートごとに溜めておく塊の上限 (読む側が遅い場合はワーカーが待つ)
+STREAM_MAX_CHUNKS = 4
+# ワーカーの異常終了を確認する間隔 (秒)
+RECEIVE_TIMEOUT = 0.5
+
+
+@dataclass(frozen=True)
+class SheetInfo:
+    name: str
+    format: str
+    header: tuple
+
+
+@dataclass
+class SheetResult:
+    """1シート分の解析結果。テーブル形式は iter_records()、キーバリュー形式は data で読む
+
+    テーブル形式の errors / report はレコードを最後まで読んだ時点で確定する。
+    """
+
+    name: str
+    format: str
+    data: dict = field(default_factory=dict)
+    errors: list[str] = field(default_factory=list)
+    report: dict = field(default_factory=dict)
+    records: Iterator[dict] | None = field(default=None, repr=False)
+
+    def iter_records(self) -> Iterator[dict]:
+        """テーブル形式のレコードを読みながら返す (1度だけ)
+
+        レコードを返し始めた後にシートの解析に失敗した場合は ExcelParseError を送出する
+        (最初のレコードより前の失敗は errors に残し、0件のシートとして扱う)。
+        """
+        records, self.records = self.records, None
+        return records if records is not None else iter(())
+
+
+def discover_sheets_in(session: WorkbookSession) -> list[SheetInfo]:
+    """開いているワークブックの表示中のシートのうち、先頭行に値のあるものを形式判定付きで返す"""
+    sheets = []
+    for name in session.sheet_names():
+        head = session.peek(name)
+        if not any(v is not None and str(v).strip() for row in head for v in row):
+            continue
+        sheets.append(SheetInfo(name, _detect_format(head), tuple(head[0]) if head else ()))
+    return sheets
+
+
+def discover_sheets(file_path: str) -> list[SheetInfo]:
+    with WorkbookSession(file_path) as session:
+        return discover_sheets_in(session)
+
+
+def _local_records(result: SheetResult, file_path: str, template: dict | None) -> Iterator[dict]:
+    """このプロセスでテーブル形式の1シートを読みながら返す"""
+    parser = ExcelParser(template)
+    yielded = False
+    try:
+        with WorkbookSession(file_path, sheet=result.name) as session:
+            for record in parser.iter_records(session):
+                yielded = True
+                yield record
+    except ExcelParseError as e:
+        if yielded:
+            raise
+        parser.errors.append(str(e))
+    finally:
+        result.errors, result.report = parser.errors, parser.report.to_dict()
+
+
+def _stream_table_sheet(file_path: str, sheet: str, template: dict | None, channel) -> None:
+    """テーブル形式の1シートを解析し、STREAM_CHUNK_SIZE 件ずつ channel に送る (プロセスプールのワーカーで実行される)
+
+    送るメッセージ: ("records", [...]) を0回以上、最後に ("done" | "failed", errors, report)
+    """
+    parser = ExcelParser(template)
+    chunk = []
+    try:
+        with WorkbookSession(file_path, sheet=sheet) as session:
+            for record in parser.iter_records(session):
+                chunk.append(record)
+                if len(chunk) >= STREAM_CHUNK_SIZE:
+                    channel.put(("records", chunk))
+                    chunk = []
+        if chunk:
+            channel.put(("records", chunk))
+    except ExcelParseError as e:
+        channel.put(("failed", [*parser.errors, str(e)], parser.report.to_dict()))
+        return
+    channel.put(("done", parser.errors, parser.report.to_dict()))
+
+
+def _receive(channel, future: Future):
+    """channel から次のメッセージを受け取る。ワーカーが何も送らずに終了した場合は None"""
+    while True:
+        try:
+            return channel.get(timeout=RECEIVE_TIMEOUT)
+        except queue.Empty:
+            if future.done():
+                try:
+                    return channel.get_nowait()
+                except queue.Empty:
+                    return None
+
+
+def _remote_records(result: SheetResult, channel, future: Future, file_path: str,
+                    template: dict | None) -> Iterator[dict]:
+    """ワーカーから送られたレコードを返す"""
+    yielded = False
+    while True:
+        message = _receive(channel, future)
+        if message is None:
+            # ワーカーが異常終了した: 何も返していなければこのプロセスで解析し直す
+            if yielded:
+                raise ExcelParseError(f"シート「{result.name}」の解析中にワーカーが異常終了しました")
+            yield from _local_records(result, file_path, template)
+            return
+        kind = message[0]
+        if kind == "records":
+            yielded = True
+            yield from message[1]
+            continue
+        result.errors, result.report = message[1], message[2]
+        if kind == "failed" and yielded:
+            raise ExcelParseError(f"シート「{result.name}」: {message[1][-1]}")
+        return
+
+
+def iter_sheets(file_path: str, registry=None, sheets: list[SheetInfo] | None = None,
+                max_workers: int | None = None) -> Iterator[SheetResult]:
+    """全データシートを解析し、ブック内の順にシートごとの結果を返す
+
+    registry (TemplateRegistry) を渡すとシートごとにテンプレートを選択する。
+    テーブル形式のシートが2つ以上あればプロセスプールで並列に解析する。
+    各シートのレコードは、次のシートの結果を受け取る前に読み終えること。
+    キーバリュー形式のシートは小さいためその場で読む。
+    """
+    sheets = sheets if sheets is not None else discover_sheets(file_path)
+    templates = {
+        sheet.name: registry.select(sheet.header, "table") if registry is not None else None
+        for sheet in sheets
+        if sheet.format == "table"
+    }
+
+    workers = min(len(templates), max_workers or MAX_WORKERS)
+    manager = executor = None
+    streams = {}
+    if workers > 1:
+        try:
+            context = get_context("spawn")
+            manager = context.Manager()
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+            for name, template in templates.items():
+                channel = manager.Queue(maxsize=STREAM_MAX_CHUNKS)
+                streams[name] = (channel, executor.submit(_stream_table_sheet, file_path, name, template, channel))
+        except (OSError, RuntimeError, AssertionError):
+            # プロセスを作れない環境 (daemonプロセス内など) では順番に解析する
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            if manager is not None:
+                manager.shutdown()
+            manager = executor = None
+            streams = {}
+
+    try:
+        for sheet in sheets:
+            if sheet.format == "table":
+                result = SheetResult(sheet.name, "table")
+                if sheet.name in streams:
+                    channel, future = streams[sheet.name]
+                    result.records = _remote_records(result, channel, future, file_path, templates[sheet.name])
+                else:
+                    result.records = _local_records(result, file_path, templates[sheet.name])
+                yield result
+            else:
+                with WorkbookSession(file_path, sheet=sheet.name) as session:
+                    if registry is not None:
+                        data, parser = registry.extract_key_values(session)
+                    else:
+                        parser = ExcelParser()
+                        data = parser.extract_key_values(session)
+                yield SheetResult(sheet.name, "key_value", data=data, errors=parser.errors, report=parser.report.to_dict())
+    finally:
+        # 先にキューを閉じ、読まれずに待っているワーカーを終わらせてからプールを止める
+        if manager is not None:
+            manager.shutdown()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def iter_sheet_records(results: Iterable[SheetResult], summary: dict) -> Iterator[tuple[dict, str]]:
+    """全シートのレコードを (レコード, ログメッセージ) としてシートの順に読みながら返す
+
+    一覧シートは行ごと、仕様書シートはシートごとに1件 (検証エラーのシートは除く)。
+    読み終えたシートの件数・検証レポート・エラーを summary の "sheets" / "validation" / "errors" に記録する。
+    """
+    sheet_counts = summary.setdefault("sheets", {})
+    validation = summary.setdefault("validation", {})
+    errors = summary.setdefault("errors", [])
+    for sheet in results:
+        count = 0
+        if sheet.format == "table":
+            for count, record in enumerate(sheet.iter_records(), start=1):
+                yield record, f"シート「{sheet.name}」 {count}行目"
+        elif not sheet.errors:
+            count = 1
+            yield sheet.data, f"シート「{sheet.name}」 仕様書"
+        sheet_counts[sheet.name] = count
+        if sheet.report.get("invalid_rows"):
+            validation[sheet.name] = sheet.report
+        errors.extend(f"シート「{sheet.name}」: {error}" for error in sheet.errors)
@@ -0,0 +1,370 @@
+"""Excel解析結果キャッシュ: ファイル内容のSHA-256をキーに解析結果を保存し、再解析を省く
+
+同じExcelがSlackに再投稿された場合やジョブの再実行時に、openpyxlでの解析をスキップする。
+保存先はディスク (既定) か Redis で、どちらも合計サイズの上限を超えると古いものから削除する。
+"""
+import hashlib
+import json
+import os
+import time
+from contextlib import ExitStack, contextmanager
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+from pathlib import Path
+from typing import Callable, Iterator
+
+from app.config import settings
+from workers.excel_parser import PARSER_VERSION, ParseLimits, WorkbookSession
+from workers.excel_templates import TemplateRegistry
+from workers.multi_sheet import SheetInfo, SheetResult, discover_sheets_in, iter_sheets
+
+REDIS_KEY_PREFIX = "parse_cache:"
+REDIS_INDEX_KEY = "parse_cache:index"
+REDIS_SIZES_KEY = "parse_cache:sizes"
+# これより行数の多い一覧 (複数シートは全シートの合計) はキャッシュしない (逐次読みのメモリ使用量を保つため)
+MAX_CACHED_RECORDS = 50_000
+
+
+def file_digest(file_path: str) -> str:
+    """ファイル内容のSHA-256 (16進)"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# --- シリアライズ (日付などの型を保ったままJSONにする) ---
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"__type__": "datetime", "v": value.isoformat()}
+    if isinstance(value, date):
+        return {"__type__": "date", "v": value.isoformat()}
+    if isinstance(value, dt_time):
+        return {"__type__": "time", "v": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"__type__": "decimal", "v": str(value)}
+    raise TypeError(f"{type(value).__name__} はキャッシュできません")
+
+
+def _decode(obj: dict):
+    type_name = obj.get("__type__")
+    if type_name == "datetime":
+        return datetime.fromisoformat(obj["v"])
+    if type_name == "date":
+        return date.fromisoformat(obj["v"])
+    if type_name == "time":
+        return dt_time.fromisoformat(obj["v"])
+    if type_name == "decimal":
+        return Decimal(obj["v"])
+    return obj
+
+
+def dumps(payload: dict) -> bytes:
+    return json.dumps(payload, ensure_ascii=False, default=_encode).encode("utf-8")
+
+
+def loads(raw: bytes) -> dict:
+    return json.loads(raw.decode("utf-8"), object_hook=_decode)
+
+
+# --- 保存先 ---
+
+class DiskCacheBackend:
+    """ディレクトリに1エントリ1ファイルで保存する。読み出し時に更新日時を進め、LRUで削除する"""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            raw = path.read_bytes()
+        except OSError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return raw
+
+    def set(self, key: str, raw: bytes) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_bytes(raw)
+        os.replace(tmp, path)
+        self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        total = 0
+        for path in self.directory.glob("*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+
+
+class RedisCacheBackend:
+    """Redisに保存する。最終参照時刻のソート済み集合でLRUを管理し、合計サイズを上限以下に保つ"""
+
+    def __init__(self, client, max_bytes: int):
+        self.client = client
+        self.max_bytes = max_bytes
+
+    def get(self, key: str) -> bytes | None:
+        raw = self.client.get(REDIS_KEY_PREFIX + key)
+        if raw is not None:
+            self.client.zadd(REDIS_INDEX_KEY, {key: time.time()})
+        return raw
+
+    def set(self, key: str, raw: bytes) -> None:
+        pipe = self.client.pipeline()
+        pipe.set(REDIS_KEY_PREFIX + key, raw)
+        pipe.zadd(REDIS_INDEX_KEY, {key: time.time()})
+        pipe.hset(REDIS_SIZES_KEY, key, len(raw))
+        pipe.execute()
+        self._evict()
+
+    def _evict(self) -> None:
+        sizes = self.client.hgetall(REDIS_SIZES_KEY)
+        total = sum(int(size) for size in sizes.values())
+        if total <= self.max_bytes:
+            return
+        for member in self.client.zrange(REDIS_INDEX_KEY, 0, -1):
+            if total <= self.max_bytes:
+                break
+            key = member.decode() if isinstance(member, bytes) else member
+            total -= int(sizes.get(member, 0))
+            pipe = self.client.pipeline()
+            pipe.delete(REDIS_KEY_PREFIX + key)
+            pipe.zrem(REDIS_INDEX_KEY, key)
+            pipe.hdel(REDIS_SIZES_KEY, key)
+            pipe.execute()
+
+
+class ParseCache:
+    """解析結果キャッシュ。保存先の障害は握りつぶし、キャッシュなしで解析を続けさせる"""
+
+    def __init__(self, backend, max_entry_bytes: int):
+        self.backend = backend
+        self.max_entry_bytes = max_entry_bytes
+
+    def get(self, key: str) -> dict | None:
+        try:
+            raw = self.backend.get(key)
+            return loads(raw) if raw is not None else None
+        except Exception:
+            return None
+
+    def set(self, key: str, payload: dict) -> bool:
+        try:
+            raw = dumps(payload)
+        except (TypeError, ValueError):
+            return False
+        if len(raw) > self.max_entry_bytes:
+            return False
+        try:
+            self.backend.set(key, raw)
+        except Exception:
+            return False
+        return True
+
+
+def get_parse_cache() -> ParseCache | None:
+    """設定に応じたキャッシュを返す。無効化されているかRedisに繋がらない場合は None"""
+    backend_name = settings.PARSE_CACHE_BACKEND
+    if backend_name == "disk":
+        backend = DiskCacheBackend(settings.PARSE_CACHE_DIR, settings.PARSE_CACHE_MAX_BYTES)
+    elif backend_name == "redis":
+        from app.utils.redis_client import get_redis
+
+        client = get_redis()
+        if client is None:
+            return None
+        backend = RedisCacheBackend(client, settings.PARSE_CACHE_MAX_BYTES)
+    else:
+        return None
+    return ParseCache(backend, settings.PARSE_CACHE_MAX_ENTRY_BYTES)
+
+
+# --- 解析 ---
+
+class ParsedWorkbook:
+    """解析結果。キャッシュから復元したものか、実際にワークブックを読むものかを意識せずに使える"""
+
+    def __init__(self, format: str, data: dict | None = None, records: Iterator[dict] | None = None,
+                 errors: list[str] | None = None, report: dict | None = None, parser=None,
+                 from_cache: bool = False, sheets: list | None = None,
+                 sheet_results: Callable[[int | None], Iterator[SheetResult]] | None = None):
+        self.format = format
+        self.data = data or {}
+        # 複数シート (format == "multi_sheet") の場合のデータシート (SheetInfo)。解析結果は iter_sheets() で読む
+        self.sheets = sheets or []
+        self._sheet_results = sheet_results
+        self._records = records
+        self._errors = errors if errors is not None else []
+        self._report = report
+        self._parser = parser
+        self.from_cache = from_cache
+
+    @property
+    def errors(self) -> list[str]:
+        return self._parser.errors if self._parser is not None else self._errors
+
+    @property
+    def report(self) -> dict:
+        """行ごとの検証レポート (ValidationReport.to_dict の形式)。テーブル形式は全行を読んだ後に確定する"""
+        if self._parser is not None:
+            return self._parser.report.to_dict()
+        return self._report or {"valid_rows": 0, "invalid_rows": 0, "errors": [], "truncated": False}
+
+    def iter_records(self) -> Iterator[dict]:
+        """テーブル形式のレコードを返す (1度だけ)"""
+        if self._records is None:
+            return iter(())
+        records, self._records = self._records, None
+        return records
+
+    def iter_sheets(self, max_workers: int | None = None) -> Iterator[SheetResult]:
+        """複数シートの解析結果をブック内の順に返す (1度だけ)
+
+        各シートのレコードは、次のシートの結果を受け取る前に読み終えること。
+        max_workers は並列解析に使うプロセス数の上限 (1 ならこのプロセスで順に解析する)。
+        """
+        sheet_results, self._sheet_results = self._sheet_results, None
+        return sheet_results(max_workers) if sheet_results is not None else iter(())
+
+
+def _cached_sheet(entry: dict) -> SheetResult:
+    records = iter(entry["records"]) if entry["format"] == "table" else None
+    return SheetResult(entry["name"], entry["format"], data=entry.get("data") or {}, errors=entry["errors"],
+                       report=entry["report"], records=records)
+
+
+def _caching_sheets(results: Iterator[SheetResult], sheets: list[SheetInfo], cache: ParseCache,
+                    key: str) -> Iterator[SheetResult]:
+    """シートごとの解析結果を返しながら溜め、全シートを最後まで読み終えた時点でまとめて保存する"""
+    entries = []
+
+    def buffered(result: SheetResult, records: Iterator[dict], entry: dict) -> Iterator[dict]:
+        buffer = []
+        for record in records:
+            if buffer is not None:
+                buffer.append(record)
+                if len(buffer) > MAX_CACHED_RECORDS:
+                    buffer = None
+            yield record
+        # テーブル形式の errors / report はレコードを読み終えた時点で確定する
+        entry.update(records=buffer, errors=result.errors, report=result.report)
+
+    for result in results:
+        entry = {"name": result.name, "format": result.format, "data": result.data,
+                 "errors": result.errors, "report": result.report}
+        if result.format == "table":
+            entry["records"] = None
+            result.records = buffered(result, result.records or iter(()), entry)
+        entries.append(entry)
+        yield result
+
+    tables = [entry["records"] for entry in entries if entry["format"] == "table"]
+    if any(records is None for records in tables) or sum(map(len, tables)) > MAX_CACHED_RECORDS:
+        return
+    cache.set(key, {
+        "format": "multi_sheet",
+        "sheets": [{"name": s.name, "format": s.format, "header": list(s.header)} for s in sheets],
+        "results": entries,
+    })
+
+
+def _cache_key(db, file_path: str, limits: ParseLimits) -> str:
+    # 上限も含める (緩い上限で解析した結果を、より厳しい上限のもとで返さないため)
+    version = TemplateRegistry(db).version()
+    return hashlib.sha256(f"{file_digest(file_path)}:{PARSER_VERSION}:{version}:{limits!r}".encode()).hexdigest()
+
+
+@contextmanager
+def open_parsed(db, file_path: str, cache: ParseCache | None = None):
+    """Excelを解析して ParsedWorkbook を返すコンテキストマネージャ
+
+    同じ内容・同じテンプレート構成で解析済みならキャッシュから返し、ワークブックは開かない。
+    テーブル形式はキャッシュミス時も1行ずつ読み、最後まで読み終えた時点で結果を保存する。
+    データのあるシートが複数ある場合は format "multi_sheet" とシートの一覧 (sheets) を返し、
+    シートごとの解析結果は iter_sheets() で読む (全シートを読み終えた時点で結果を保存する)。
+    データのあるシートが1つだけで、それがアクティブなシートでない場合はそのシートを開き直して解析する。
+    """
+    cache = cache if cache is not None else get_parse_cache()
+    limits = ParseLimits.from_settings()
+    key = None
+    if cache is not None:
+        # 上限を超えるファイルは、内容を読んでハッシュを計算する前に拒否する
+        limits.check_file(Path(file_path))
+        key = _cache_key(db, file_path, limits)
+        payload = cache.get(key)
+        if payload is not None:
+            yield ParsedWorkbook(
+                payload["format"],
+                data=payload.get("data"),
+                records=iter(payload.get("records", [])),
+                errors=payload.get("errors", []),
+                report=payload.get("report"),
+                from_cache=True,
+                sheets=[SheetInfo(s["name"], s["format"], tuple(s["header"])) for s in payload.get("sheets", [])],
+                sheet_results=lambda max_workers: (_cached_sheet(entry) for entry in payload.get("results", [])),
+            )
+            return
+
+    registry = TemplateRegistry(db)
+    with ExitStack() as stack:
+        session = stack.enter_context(WorkbookSession(file_path, limits=limits))
+        sheets = discover_sheets_in(session) if len(session.sheet_names()) > 1 else []
+        if len(sheets) == 1 and sheets[0].name != session.sheet_name:
+            # アクティブなシート (空の表紙など) ではなく、データのある唯一のシートを読む
+            stack.close()
+            session = stack.enter_context(WorkbookSession(file_path, sheet=sheets[0].name, limits=limits))
+        if len(sheets) > 1:
+            def sheet_results(max_workers: int | None) -> Iterator[SheetResult]:
+                results = iter_sheets(file_path, registry=registry, sheets=sheets, max_workers=max_workers)
+                return _caching_sheets(results, sheets, cache, key) if cache is not None else results
+
+            yield ParsedWorkbook("multi_sheet", sheets=sheets, sheet_results=sheet_results)
+            return
+
+        if session.detect_format() != "table":
+            data, parser = registry.extract_key_values(session)
+            if cache is not None:
+                cache.set(key, {"format": "key_value", "data": data, "errors": parser.errors, "report": parser.report.to_dict()})
+            yield ParsedWorkbook("key_value", data=data, parser=parser)
+            return
+
+        parser = registry.parser_for_table(session)
+
+        def records() -> Iterator[dict]:
+            buffered = [] if cache is not None else None
+            for record in parser.iter_records(session):
+                if buffered is not None:
+                    buffered.append(record)
+                    if len(buffered) > MAX_CACHED_RECORDS:
+                        buffered = None
+                yield record
+            if buffered is not None:
+                cache.set(key, {"format": "table", "records": buffered, "errors": parser.errors, "report": parser.report.to_dict()})
+
+        yield ParsedWorkbook("table", records=records(), parser=parser)
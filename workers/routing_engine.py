@@ -1,7 +1,12 @@
-"""振り分けエンジン: ルールベースでWebシステムA/Bに振り分け"""
+"""振り分けエンジン: ルールベースでWebシステムA/Bに振り分け
+
+ルールのコンパイル・キャッシュは app.services.routing にあり、承認後のWeb入力と共有する。
+"""
+from typing import Iterable
+
 from sqlalchemy.orm import Session
 
-from app.models.automation import RoutingRule
+from app.services.routing import RoutingBatch, determine_target, route_batch
 
 
 class RoutingEngine:
@@ -16,38 +21,13 @@ class RoutingEngine:
         Returns:
             "system_a", "system_b", or None (手動振り分け必要)
         """
-        rules = (
-            self.db.query(RoutingRule)
-            .filter(RoutingRule.is_active.is_(True))
-            .order_by(RoutingRule.priority.asc())
-            .all()
-        )
-
-        for rule in rules:
-            if self._evaluate_rule(rule, order_data):
-                return rule.target_system.value
-
-        return None
-
-    def _evaluate_rule(self, rule: RoutingRule, data: dict) -> bool:
-        """単一ルールを評価する"""
-        condition_type = rule.condition_type
-        condition_value = rule.condition_value
-
-        if condition_type == "vendor_name":
-            return data.get("vendor_name", "") == condition_value
-        elif condition_type == "vendor_name_contains":
-            return condition_value in data.get("vendor_name", "")
-        elif condition_type == "category":
-            return data.get("category", "") == condition_value
-        elif condition_type == "amount_gte":
-            amount = data.get("amount", 0)
-            return isinstance(amount, (int, float)) and amount >= float(condition_value)
-        elif condition_type == "amount_lt":
-            amount = data.get("amount", 0)
-            return isinstance(amount, (int, float)) and amount < float(condition_value)
-        elif condition_type == "keyword":
-            description = data.get("description", "")
-            return condition_value in str(description)
-
-        return False
+        return determine_target(self.db, order_data)
+
+    def determine_targets(self, records: Iterable[dict]) -> RoutingBatch:
+        """一覧の全レコードをまとめて判定する
+
+        Returns:
+            RoutingBatch: targets (レコードごとの振り分け先、None は手動振り分け) と
+            hits (ルールIDごとの一致件数)
+        """
+        return route_batch(self.db, records)
@@ -2,18 +2,9 @@
 from celery import shared_task
 
 from app.database import SessionLocal
-from app.models.automation import ProcessingJob, ProcessingLog, JobStatus
-
-
-def _add_log(db, job_id: int, step: str, status: str, message: str):
-    log = ProcessingLog(
-        job_id=job_id,
-        step_name=step,
-        status=status,
-        message=message,
-    )
-    db.add(log)
-    db.commit()
+from app.models.automation import ProcessingJob, JobStatus
+from app.services.web_input_limiter import WebInputThrottled
+from workers.job_log import JobLogBuffer
 
 
 @shared_task(name="workers.generate_report")
@@ -65,11 +56,98 @@ def auto_reconcile_task() -> dict:
         db.close()
 
 
+@shared_task(name="workers.match_new_payments")
+def match_new_payments_task(payment_ids: list[int]) -> dict:
+    """取り込まれた入金のみを自動マッチングする (入金CSVインポート時に起動)。"""
+    from app.services.reconciliation import match_new_payments
+
+    db = SessionLocal()
+    try:
+        results = match_new_payments(db, payment_ids)
+        matched_count = sum(1 for r in results if r["status"] == "matched")
+        return {"status": "completed", "matched": matched_count, "total": len(results)}
+    except Exception as e:
+        return {"error": str(e)}
+    finally:
+        db.close()
+
+
+@shared_task(name="workers.match_sent_invoice")
+def match_sent_invoice_task(invoice_id: int) -> dict:
+    """送付済みになった請求書を未消込の入金と照合する (請求書送付時に起動)。"""
+    from app.services.reconciliation import match_sent_invoice
+
+    db = SessionLocal()
+    try:
+        result = match_sent_invoice(db, invoice_id)
+        if result is None:
+            return {"status": "completed", "matched": 0}
+        return {"status": "completed", "matched": 1, "payment_id": result["payment_id"]}
+    except Exception as e:
+        return {"error": str(e)}
+    finally:
+        db.close()
+
+
+@shared_task(name="workers.replay_dead_letters")
+def replay_dead_letters_task(dead_letter_ids: list[int], batch_size: int, interval_seconds: float) -> dict:
+    """まとめて再実行の次のバッチを投入する (残りがあればさらに次を予約する)。
+
+    既に再実行された記録は対象外のため、このタスクが再配送されてもジョブが重複して投入されることはない。
+    """
+    from app.services.dead_letter import query_dead_letters, replay
+
+    if not dead_letter_ids:
+        return {"selected": 0, "batches": 0, "job_ids": []}
+    db = SessionLocal()
+    try:
+        dead_letters = query_dead_letters(db, ids=dead_letter_ids).all()
+        return replay(db, dead_letters, batch_size=batch_size, interval_seconds=interval_seconds)
+    finally:
+        db.close()
+
+
+@shared_task(name="workers.resume_deferred_jobs")
+def resume_deferred_jobs_task() -> dict:
+    """流量制限のためリクエスト処理中に実行できず、キューにも投入できなかったジョブをワーカーで再開する。
+
+    1件ずつ投入し、投入できたジョブから記録してコミットする (同じジョブを重複して投入しない)。
+    """
+    from app.models.automation import ProcessingLog
+    from app.services.job_steps import WEB_INPUT, deferred_job_ids, pending_step
+
+    db = SessionLocal()
+    try:
+        job_ids = deferred_job_ids(db)
+        for job_id in job_ids:
+            process_order_async.apply_async((job_id,))
+            job = db.get(ProcessingJob, job_id)
+            db.add(ProcessingLog(job_id=job_id, step_name=pending_step(job) or WEB_INPUT, status="queued",
+                                 message="ワーカーで再開します"))
+            db.commit()
+        return {"status": "completed", "resumed": len(job_ids)}
+    finally:
+        db.close()
+
+
 @shared_task(name="workers.process_order_async", bind=True, max_retries=3)
-def process_order_async(self, job_id: int) -> dict:
-    """承認後の発注登録+Web入力を非同期で実行する。"""
-    from app.services.order_registration import register_order_from_job
-    from app.services.mcp_executor import execute_mcp_input
+def process_order_async(self, job_id: int, from_step: str | None = None) -> dict:
+    """承認後の発注登録+Web入力を非同期で実行する。
+
+    ステップごとに完了を記録してコミットするため、再試行では最初の未完了のステップから再開する。
+    from_step を渡すとそのステップから再開する (デッドレターからの再実行)。
+    それより前のステップが完了していない場合はやり直さずに失敗にする。
+    """
+    from app.services.job_steps import STEPS, completed_result, pending_step, run_step
+
+    started_messages = {
+        "order_registration": lambda job: "発注登録を開始",
+        "web_input": lambda job: f"Web入力を開始: {job.assigned_system}",
+    }
+    completed_messages = {
+        "order_registration": lambda result: f"登録完了: {result}",
+        "web_input": lambda result: "Web入力完了",
+    }
 
     db = SessionLocal()
     try:
@@ -77,30 +155,44 @@ def process_order_async(self, job_id: int) -> dict:
         if not job:
             return {"error": f"Job {job_id} not found"}
 
-        job.status = JobStatus.executing
-        db.commit()
-        _add_log(db, job_id, "order_registration", "started", "発注登録を開始")
-
-        try:
-            reg_result = register_order_from_job(db, job)
-            _add_log(db, job_id, "order_registration", "completed", f"登録完了: {reg_result}")
-        except Exception as e:
-            _add_log(db, job_id, "order_registration", "failed", str(e))
-            raise
-
-        _add_log(db, job_id, "web_input", "started", f"Web入力を開始: {job.assigned_system}")
-
-        try:
-            mcp_result = execute_mcp_input(db, job)
-            _add_log(db, job_id, "web_input", "completed", f"Web入力完了")
-        except Exception as e:
-            _add_log(db, job_id, "web_input", "failed", str(e))
-            raise
-
-        job.status = JobStatus.completed
-        db.commit()
+        with JobLogBuffer(db, job_id) as log:
+            if from_step is not None:
+                names = [step for step, _ in STEPS]
+                missing = [step for step in names[:names.index(from_step)] if completed_result(job, step) is None]
+                if missing:
+                    message = f"{from_step} より前のステップ ({', '.join(missing)}) が完了していないため再開できません"
+                    log.transition(job, JobStatus.failed, error_message=message)
+                    log.log(from_step, "failed", message)
+                    log.flush()
+                    return {"error": message, "job_id": job_id}
+
+            log.transition(job, JobStatus.executing)
+            for step, _ in STEPS:
+                if completed_result(job, step) is not None:
+                    log.log(step, "skipped", "前回の実行で完了済みのためスキップ")
+                    continue
+                log.log(step, "started", started_messages[step](job))
+                log.flush()
+                try:
+                    result = run_step(db, job, step)
+                except WebInputThrottled as e:
+                    log.log(step, "throttled", str(e))
+                    raise
+                except Exception as e:
+                    log.log(step, "failed", str(e))
+                    raise
+                # ステップで作成したデータと完了の記録を同じトランザクションでコミットする
+                log.log(step, "completed", completed_messages[step](result))
+                log.flush()
+
+            log.transition(job, JobStatus.completed)
+            log.flush()
         return {"status": "completed", "job_id": job_id}
 
+    except WebInputThrottled as e:
+        # 流量制限は失敗として数えない: 再試行回数を引き継いで、枠が空く頃に再投入する
+        self.apply_async((job_id, from_step), countdown=e.retry_after, retries=self.request.retries)
+        return {"status": "throttled", "job_id": job_id, "retry_after": e.retry_after}
     except Exception as e:
         job = db.query(ProcessingJob).filter(ProcessingJob.id == job_id).first()
         if job:
@@ -110,6 +202,12 @@ def process_order_async(self, job_id: int) -> dict:
         try:
             self.retry(countdown=60 * (2 ** self.request.retries))
         except self.MaxRetriesExceededError:
+            if job:
+                # 再試行を使い切ったジョブは dead_letter_jobs に残し、原因の解消後にまとめて再実行する
+                from app.services.dead_letter import record_failure
+
+                record_failure(db, job, pending_step(job) or STEPS[-1][0], e)
+                db.commit()
             return {"error": str(e), "job_id": job_id}
     finally:
         db.close()
@@ -0,0 +1,297 @@
+"""Excel行の検証エンジン: ExcelTemplate.validation_rules をフィールドごとの変換・検査関数にコンパイルする
+
+validation_rules の形式:
+    {
+        "required": ["project_name"],                         # 必須項目
+        "types": {"unit_price": "int", "start_date": "date"}, # int / float / str / date
+        "date_formats": {"start_date": ["%Y/%m/%d"]},         # date 型の入力フォーマット (省略時は既定の候補)
+        "ranges": {"unit_price": {"min": 0, "max": 2000000}}, # 数値・日付の範囲 (両端を含む)
+        "patterns": {"order_number": "^PO-\\d+$"},            # 正規表現 (re.search)
+        "enums": {"contract_type": ["準委任", "請負"]},       # 許可する値
+    }
+
+変換後の値はPythonの型 (int / float / date など) のまま保持する。
+"""
+import re
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import date, datetime
+from typing import Any, Callable, Iterable
+
+# 既定の日付フォーマット候補
+DATE_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%Y年%m月%d日", "%Y.%m.%d", "%Y-%m-%d %H:%M:%S", "%Y/%m/%d %H:%M:%S")
+# 検証レポートに載せる行数の上限 (巨大な一覧で全行がエラーでも結果のJSONが膨らまないように)
+REPORT_MAX_ROWS = 100
+
+
+def _to_str(value: Any) -> str:
+    return value.strip() if isinstance(value, str) else str(value)
+
+
+def _to_int(value: Any) -> int:
+    if isinstance(value, bool):
+        raise ValueError(value)
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError(value)
+        return int(value)
+    cleaned = str(value).replace(",", "").replace("¥", "").replace("￥", "").replace("円", "").strip()
+    try:
+        return int(cleaned)
+    except ValueError:
+        pass
+    # "800000.0" のような表記は受け付け、"1.5" のように端数のある値は切り捨てずにエラーにする
+    number = float(cleaned)
+    if not number.is_integer():
+        raise ValueError(value)
+    return int(number)
+
+
+def _to_float(value: Any) -> float:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return float(str(value).replace(",", "").replace("¥", "").replace("￥", "").replace("円", "").strip())
+
+
+def _date_converter(formats: tuple[str, ...]) -> Callable[[Any], date]:
+    def convert(value: Any) -> date:
+        if isinstance(value, datetime):
+            return value.date()
+        if isinstance(value, date):
+            return value
+        text = str(value).strip()
+        for fmt in formats:
+            try:
+                return datetime.strptime(text, fmt).date()
+            except ValueError:
+                continue
+        raise ValueError(value)
+
+    return convert
+
+
+_to_date = _date_converter(DATE_FORMATS)
+
+# validation_rules["types"] で指定できる型と変換関数
+CONVERTERS: dict[str, Callable[[Any], Any]] = {
+    "str": _to_str,
+    "int": _to_int,
+    "float": _to_float,
+    "date": _to_date,
+}
+
+_TYPE_LABELS = {"str": "文字列", "int": "整数", "float": "数値", "date": "日付"}
+
+
+def is_empty(value: Any) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def to_json_value(value: Any) -> Any:
+    """JSONカラムに保存できる値にする (数値・真偽値・None はそのまま、日付はISO形式)"""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+@dataclass(frozen=True)
+class FieldError:
+    """1項目の検証エラー"""
+
+    row: int | None
+    field: str
+    code: str  # required / type / min / max / pattern / enum
+    message: str
+    value: Any = None
+
+    def __str__(self) -> str:
+        return f"行{self.row}: {self.message}" if self.row is not None else self.message
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["value"] = to_json_value(self.value)
+        return data
+
+
+class ValidationReport:
+    """行ごとの検証結果の集計"""
+
+    def __init__(self):
+        self.valid_rows = 0
+        self.rows: dict[int | None, list[FieldError]] = {}
+
+    def add(self, row: int | None, errors: list[FieldError]):
+        if errors:
+            self.rows.setdefault(row, []).extend(errors)
+        else:
+            self.valid_rows += 1
+
+    @property
+    def invalid_rows(self) -> int:
+        return len(self.rows)
+
+    @property
+    def has_errors(self) -> bool:
+        return bool(self.rows)
+
+    def to_dict(self, max_rows: int = REPORT_MAX_ROWS) -> dict:
+        rows = list(self.rows.items())
+        return {
+            "valid_rows": self.valid_rows,
+            "invalid_rows": self.invalid_rows,
+            "errors": [
+                {"row": row, "errors": [e.to_dict() for e in errors]}
+                for row, errors in rows[:max_rows]
+            ],
+            "truncated": len(rows) > max_rows,
+        }
+
+
+class RuleSet:
+    """validation_rules をコンパイルした検証ルール
+
+    converters は型変換 (行の変換計画に組み込まれる)、checks は変換後の値に対する検査。
+    不正なルール (正しくない正規表現・範囲の値など) は ExcelParseError でテンプレート名と項目を示す。
+    """
+
+    def __init__(self, validation_rules: dict | None = None, template_name: str | None = None):
+        self.template_name = template_name
+        rules = validation_rules or {}
+        self.required: tuple[str, ...] = tuple(rules.get("required", []))
+
+        date_formats = {
+            field: tuple([formats] if isinstance(formats, str) else formats)
+            for field, formats in rules.get("date_formats", {}).items()
+        }
+        self.types: dict[str, str] = {
+            **{field: "date" for field in date_formats},
+            **{field: type_name for field, type_name in rules.get("types", {}).items() if type_name in CONVERTERS},
+        }
+        self.converters: dict[str, Callable[[Any], Any]] = {}
+        for field, type_name in self.types.items():
+            if type_name == "date" and field in date_formats:
+                self.converters[field] = _date_converter(date_formats[field])
+            else:
+                self.converters[field] = CONVERTERS[type_name]
+
+        checks: list[tuple[str, Callable[[Any], FieldError | None]]] = []
+        for field, bounds in rules.get("ranges", {}).items():
+            with self._compiling("ranges", field):
+                checks.extend((field, check) for check in self._range_checks(field, bounds))
+        for field, pattern in rules.get("patterns", {}).items():
+            with self._compiling("patterns", field):
+                checks.append((field, self._pattern_check(field, pattern)))
+        for field, choices in rules.get("enums", {}).items():
+            with self._compiling("enums", field):
+                checks.append((field, self._enum_check(field, choices)))
+        self.checks = tuple(checks)
+
+    @contextmanager
+    def _compiling(self, kind: str, field: str):
+        """ルールのコンパイル中の例外を、テンプレート名と項目を示す ExcelParseError にする"""
+        try:
+            yield
+        except (re.error, ValueError, TypeError, AttributeError) as e:
+            from workers.excel_parser import ExcelParseError
+
+            source = f"テンプレート「{self.template_name}」" if self.template_name else "検証ルール"
+            raise ExcelParseError(f"{source}の {kind} の項目 '{field}' が不正です: {e}") from e
+
+    def _range_checks(self, field: str, bounds: dict):
+        convert = self.converters.get(field, _to_float)
+        for code, label, compare in (("min", "以上", lambda v, b: v >= b), ("max", "以下", lambda v, b: v <= b)):
+            if bounds.get(code) is None:
+                continue
+            bound = convert(bounds[code])
+
+            def check(value, code=code, label=label, compare=compare, bound=bound):
+                try:
+                    ok = compare(value, bound)
+                except TypeError:
+                    return FieldError(None, field, "type", f"項目 '{field}' の値を範囲と比較できません", value)
+                if not ok:
+                    return FieldError(None, field, code, f"項目 '{field}' は {bound} {label}である必要があります", value)
+                return None
+
+            yield check
+
+    @staticmethod
+    def _pattern_check(field: str, pattern: str):
+        compiled = re.compile(pattern)
+
+        def check(value):
+            if compiled.search(str(value)) is None:
+                return FieldError(None, field, "pattern", f"項目 '{field}' の形式が正しくありません", value)
+            return None
+
+        return check
+
+    @staticmethod
+    def _enum_check(field: str, choices: list):
+        allowed = frozenset(choices) | frozenset(str(c) for c in choices)
+
+        def check(value):
+            if value not in allowed and str(value) not in allowed:
+                return FieldError(None, field, "enum", f"項目 '{field}' の値は {', '.join(map(str, choices))} のいずれかである必要があります", value)
+            return None
+
+        return check
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.required or self.converters or self.checks)
+
+    def conversion_error(self, field: str, value: Any, row: int | None = None) -> FieldError:
+        label = _TYPE_LABELS.get(self.types.get(field, ""), self.types.get(field, ""))
+        return FieldError(row, field, "type", f"項目 '{field}' の値を{label}に変換できません", value)
+
+    def check(self, record: dict, row: int | None = None, skip: frozenset[str] | set[str] = frozenset()) -> list[FieldError]:
+        """変換済みのレコードを検査する。skip のフィールド (変換に失敗したもの) は検査しない"""
+        errors = []
+        for field in self.required:
+            if is_empty(record.get(field)):
+                errors.append(FieldError(row, field, "required", f"必須項目 '{field}' が空です"))
+        for field, check in self.checks:
+            value = record.get(field)
+            if field in skip or is_empty(value):
+                continue
+            error = check(value)
+            if error is not None:
+                errors.append(FieldError(row, error.field, error.code, error.message, error.value))
+        return errors
+
+    def validate(self, record: dict, row: int | None = None) -> tuple[dict, list[FieldError]]:
+        """未変換のレコードを型変換してから検査する"""
+        converted = dict(record)
+        errors = []
+        failed = set()
+        for field, convert in self.converters.items():
+            value = converted.get(field)
+            if is_empty(value):
+                continue
+            try:
+                converted[field] = convert(value)
+            except (ValueError, TypeError):
+                failed.add(field)
+                errors.append(self.conversion_error(field, value, row))
+        errors.extend(self.check(converted, row, failed))
+        return converted, errors
+
+    def validate_batch(self, records: Iterable[tuple[int, dict]]) -> tuple[list[dict], ValidationReport]:
+        """(行番号, レコード) の並びをまとめて検証し、正常な行 (変換済み) と行ごとの検証レポートを返す
+
+        ルールはこのインスタンスの作成時に1度だけコンパイルされるため、シートごとに1つの RuleSet で呼ぶ。
+        """
+        report = ValidationReport()
+        valid = []
+        for row, record in records:
+            converted, errors = self.validate(record, row)
+            report.add(row, errors)
+            if not errors:
+                valid.append(converted)
+        return valid, report
+